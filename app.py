@@ -1,29 +1,37 @@
 # app.py
 
+import json
 import os
 import re
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine
-from langchain.memory import ConversationBufferWindowMemory
+from conversation_memory import ConversationMemory
 from dotenv import load_dotenv
 
 # Load environment variables (GROQ_KEY, MERCHANT_NAME, IS_PER_DIEM)
 load_dotenv()
 
-# Import backend functions and memory placeholder from main.py
+# Import the backend query service from main.py
 import main
-from main import nl_to_sql, fix_sql_with_error, summarize_result
+import tracing
+from main import iterate_sync
+from database import create_scoped_engine, get_merchant_directory, lookup_store_id, scope_key
+from merchant_directory import normalize_name
 
 st.set_page_config(page_title="Per Diem DataQuery Chatbot")
 
-# Load merchant names from CSV (cached)
-@st.cache_data
-def load_merchant_names():
-    df = pd.read_csv("Processed/cleaned_stores.csv")
-    return sorted(df["name"].unique().tolist())
+# One query service per server process, shared by every session: Groq client, LLM response and
+# paraphrase caches and the bounded LLM pool. Sessions only keep their own memory and scope.
+@st.cache_resource
+def get_query_service():
+    return main.QueryService()
 
-merchant_names = load_merchant_names()
+# One engine per scope, shared by every session asking about that scope; each engine keeps a small
+# pool of ready-scoped connections (see database.create_scoped_engine)
+@st.cache_resource(max_entries=int(os.getenv("ENGINE_CACHE_ENTRIES", "64")))
+def get_scoped_engine(store_id: str = None):
+    return create_scoped_engine(store_id)
+
+service = get_query_service()
 
 # Initialize session state variables
 if "current_mode" not in st.session_state:
@@ -33,6 +41,9 @@ if "current_mode" not in st.session_state:
 if "engine" not in st.session_state:
     st.session_state.engine = None
 
+if "scope" not in st.session_state:
+    st.session_state.scope = ""
+
 if "context_str" not in st.session_state:
     st.session_state.context_str = ""
 
@@ -40,15 +51,22 @@ if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
 if "memories" not in st.session_state:
-    # A dict of mode → ConversationBufferWindowMemory
+    # A dict of mode → ConversationMemory
     st.session_state.memories = {}
 
-# Sidebar: select user type and, if merchant, choose merchant name
+# Sidebar: select user type and, if merchant, find the merchant by typing part of its name. Only the
+# matches from the merchant directory are listed, one per store (stores sharing a name show their id);
+# an exact name (any case or spacing) is preselected.
 st.sidebar.title("User Selection")
 user_type = st.sidebar.radio("I am a:", ["PerDiem Internal User", "Merchant"])
 
 if user_type == "Merchant":
-    selected_merchant = st.sidebar.selectbox("Choose your merchant:", [""] + merchant_names)
+    search_text = st.sidebar.text_input("Search your merchant:", placeholder="Start typing a merchant name")
+    matches = [name for name, _ in get_merchant_directory().search(search_text)] if search_text else []
+    exact = bool(matches) and normalize_name(matches[0]) == normalize_name(search_text)
+    selected_merchant = st.sidebar.selectbox(
+        "Choose your merchant:", [""] + matches, index=1 if exact else 0, disabled=not matches
+    )
     is_per_diem = False
     mode = f"merchant:{selected_merchant}" if selected_merchant else None
 else:
@@ -56,69 +74,49 @@ else:
     is_per_diem = True
     mode = "internal"
 
+# LLM response cache counters (shared by every session in this process)
+llm_stats = service.llm_cache.stats()
+st.sidebar.caption(f"LLM cache: {llm_stats['hits']} hits / {llm_stats['misses']} misses")
+
 # When the mode changes, reset engine, context, chat history, and memory
 if mode != st.session_state.current_mode:
     st.session_state.current_mode = mode
     st.session_state.chat_history = []
     if mode:
-        st.session_state.memories[mode] = ConversationBufferWindowMemory(return_messages=True, k=3)
+        st.session_state.memories[mode] = ConversationMemory()
 
 # Helper to get the current memory object (or None if no mode selected)
 def get_current_memory():
     return st.session_state.memories.get(st.session_state.current_mode)
 
-# Function to initialize or filter database based on merchant
+# Function to initialize the database engine, scoped to the merchant's store when one is chosen
 def initialize_database(merchant_name: str, is_per_diem_user: bool):
-    original_db = "Processed/dashboard_chatbot.db"
     if merchant_name:
-        engine_full = create_engine(f"sqlite:///{original_db}")
-        stores_df = pd.read_sql_query(
-            "SELECT * FROM stores WHERE name = ? LIMIT 1",
-            engine_full,
-            params=(merchant_name,)
-        )
-        if stores_df.empty:
+        store_id = lookup_store_id(merchant_name)
+        if store_id is None:
             st.error(f"No store found with name '{merchant_name}'")
-            return None, ""
-        store_id = stores_df.iloc[0]["store_id"]
-
-        orders_df = pd.read_sql_query(
-            "SELECT * FROM orders WHERE store_id = ?",
-            engine_full,
-            params=(store_id,)
-        )
-        customers_df = pd.read_sql_query(
-            "SELECT * FROM customers WHERE store_id = ?",
-            engine_full,
-            params=(store_id,)
-        )
-
-        filtered_db = "Processed/filtered_dashboard_chatbot.db"
-        if os.path.exists(filtered_db):
-            os.remove(filtered_db)
-        engine_filtered = create_engine(f"sqlite:///{filtered_db}")
-        stores_df.to_sql("stores", engine_filtered, index=False)
-        orders_df.to_sql("orders", engine_filtered, index=False)
-        customers_df.to_sql("customers", engine_filtered, index=False)
+            return None, "", ""
 
+        # Per-store TEMP views over the shared read-only database; no rows are copied
         context = f"Serving for merchant: {merchant_name}"
-        return create_engine(f"sqlite:///{filtered_db}"), context
+        return get_scoped_engine(store_id), context, scope_key(store_id)
 
     else:
         context = "Serving for PerDiem internal user"
-        return create_engine(f"sqlite:///{original_db}"), context
+        return get_scoped_engine(), context, scope_key()
 
 # Reinitialize the database engine and context string whenever mode changes
 if st.session_state.current_mode:
     if st.session_state.current_mode == "internal":
-        st.session_state.engine, st.session_state.context_str = initialize_database("", True)
+        st.session_state.engine, st.session_state.context_str, st.session_state.scope = initialize_database("", True)
     else:
         merchant_name = st.session_state.current_mode.split("merchant:")[1]
         if merchant_name:
-            st.session_state.engine, st.session_state.context_str = initialize_database(merchant_name, False)
+            st.session_state.engine, st.session_state.context_str, st.session_state.scope = initialize_database(merchant_name, False)
         else:
             st.session_state.engine = None
             st.session_state.context_str = ""
+            st.session_state.scope = ""
 
 # Title and context display
 st.title("Per Diem DataQuery Chatbot")
@@ -131,11 +129,15 @@ for entry in st.session_state.chat_history:
         st.markdown(f"**You:** {entry['content']}")
     else:
         st.markdown("**Assistant:**")
+        if entry.get("table") is not None:
+            st.dataframe(entry["table"], hide_index=True)
         st.markdown(entry["content"])
 
 
-def process_query():
-    question = st.session_state.input_text.strip()
+# Runs the async pipeline and renders it live: the result table appears as soon as the SQL has run,
+# then the summary streams in token by token.
+def process_query(question: str):
+    question = question.strip()
 
     # If mode not selected or question not given, exit without running backend
     if not question or not st.session_state.current_mode:
@@ -143,66 +145,59 @@ def process_query():
 
     # Append user message to chat history
     st.session_state.chat_history.append({"role": "user", "content": question})
-
-    # Ensure backend uses the correct memory for both nl_to_sql and fix_sql_with_error (loads the past three set of user-assistant conversations)
-    main.memory = get_current_memory()
-
-    # Attempt up to 3 times: generate SQL → execute → fix if needed
-    generated_sql = nl_to_sql(question, st.session_state.context_str)
-    if generated_sql.startswith("--ERROR"):
-        # If nl_to_sql functon  itself failed, skip retries
-        error_msg = generated_sql
-        # No data retrieved 
-        df_result = None
-    else:
-        df_result = None
-        error_msg = None
-        MAX_RETRIES = 3
-        attempt = 0
-
-        while attempt < MAX_RETRIES:
-            try:
-                df_result = pd.read_sql_query(generated_sql, st.session_state.engine)
-                error_msg = None
-                break  # Success, exit retry loop
-            except Exception as e:
-                error_msg = str(e)
-                attempt += 1
-                # Generate a corrected SQL using memory + context
-                corrected_sql = fix_sql_with_error(
-                    question,
-                    generated_sql,
-                    error_msg,
-                    st.session_state.context_str
-                )
-                if corrected_sql.startswith("--ERROR"):
-                    # If correction loop function itself failed, stop retrying
-                    break
-                generated_sql = corrected_sql
-
-        # If after retries we still have an error, df_result remains None
-
-    # Summarize results or error via LLM
-    response = summarize_result(
-        question,
-        generated_sql,
-        df_result,
-        error_msg,
-        st.session_state.context_str
+    st.markdown(f"**You:** {question}")
+
+    # This session's memory is passed along explicitly, so concurrent sessions never share history
+    memory = get_current_memory()
+
+    st.markdown("**Assistant:**")
+    table_slot = st.empty()
+    result = {"table": None}
+
+    def summary_tokens():
+        events = iterate_sync(service.answer_question_async(
+            question,
+            st.session_state.engine,
+            st.session_state.scope,
+            st.session_state.context_str,
+            memory
+        ))
+        for kind, payload in events:
+            if kind == "table":
+                result["table"] = payload
+                table_slot.dataframe(payload, hide_index=True)
+            elif kind == "token":
+                # Clean up dollar sign, to not be misinterpretted by markdown
+                yield payload.replace("$", "\\$")
+
+    # One trace per question: stage spans, token usage, rows and cache hits (see tracing.py)
+    with tracing.tracer.trace(question, st.session_state.scope) as trace:
+        response = st.write_stream(summary_tokens())
+    st.session_state.last_trace = trace
+    if not isinstance(response, str):
+        response = "".join(str(part) for part in response)
+
+    st.session_state.chat_history.append(
+        {"role": "assistant", "content": response, "table": result["table"]}
     )
 
-    # Clean up dollar sign, to not be misinterpretted by markdown 
-    response = response.replace("$", "\\$")
-
-    st.session_state.chat_history.append({"role": "assistant", "content": response})
-
-    # Clear the input box
-    st.session_state.input_text = ""
-
-# Single-line text_input with on_change callback
-st.text_input(
-    "Your question:",
-    key="input_text",
-    on_change=process_query,
-    placeholder="Type a question and press Enter"
-)
+# Chat input pinned to the bottom of the page; each submission runs the pipeline inline
+question = st.chat_input("Type a question and press Enter")
+if question:
+    process_query(question)
+
+# Optional debug panel, drawn after the answer so it covers the question just asked
+if st.sidebar.checkbox("Show debug panel", value=False):
+    import pandas as pd
+    last_trace = st.session_state.get("last_trace")
+    if last_trace is not None:
+        st.sidebar.markdown(f"**Last question:** {last_trace.total_ms:.0f} ms")
+        st.sidebar.dataframe(pd.DataFrame(last_trace.spans).set_index("name"))
+    trace_stats = tracing.tracer.stats()
+    if trace_stats:
+        st.sidebar.markdown("**All questions in this process**")
+        st.sidebar.dataframe(pd.DataFrame.from_dict(trace_stats, orient="index"))
+        st.sidebar.download_button(
+            "Export stats (JSON)", json.dumps(trace_stats, indent=2), file_name="trace_stats.json",
+            mime="application/json",
+        )
@@ -0,0 +1,110 @@
+# Head-to-head benchmark of the SQLite and DuckDB query backends (see QUERY_BACKEND).
+#
+# Builds a scaled copy of the database (orders replicated --scale times across the stores),
+# exports it to Parquet, then runs cross-store aggregates through run_guarded_query on both
+# engines. Results are checked for equality and median/p95 latency is reported.
+#
+#   python benchmarks/backend_benchmark.py --db Processed/dashboard_chatbot.db --scale 20
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DuckDBEngine, create_scoped_engine, run_guarded_query  # noqa: E402
+from benchmarks.synthetic import scale_database  # noqa: E402
+
+# Internal-user style aggregates written in SQL that both dialects accept
+QUERIES = [
+    (
+        "revenue by merchant by month",
+        "SELECT s.name, substr(o.created_date, 1, 7) AS month, SUM(o.total_amount_in_cents) AS revenue "
+        "FROM orders AS o JOIN stores AS s ON o.store_id = s.store_id "
+        "GROUP BY s.name, month ORDER BY s.name, month",
+    ),
+    (
+        "fulfillment mix per store",
+        "SELECT store_id, fulfillment_type, COUNT(*) AS orders, AVG(total_amount_in_cents) AS average_order "
+        "FROM orders GROUP BY store_id, fulfillment_type ORDER BY store_id, fulfillment_type",
+    ),
+    (
+        "top customers by spend",
+        "SELECT customer_id, COUNT(*) AS orders, SUM(total_amount_in_cents) AS spend FROM orders "
+        "WHERE customer_id IS NOT NULL GROUP BY customer_id ORDER BY spend DESC, customer_id LIMIT 20",
+    ),
+    (
+        "courier fees by provider",
+        "SELECT COALESCE(delivery_provider, 'none') AS provider, COUNT(*) AS orders, "
+        "SUM(delivery_provider_fee_in_cents) AS fees FROM orders GROUP BY provider ORDER BY provider",
+    ),
+]
+
+
+# Runs sql repeat times through the guarded execution path; returns (result, median ms, p95 ms)
+def time_query(engine, sql: str, repeat: int):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run_guarded_query(sql, engine, timeout_seconds=600, max_rows=10 ** 7)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))]
+    return result, statistics.median(timings), p95
+
+
+# Both engines must agree up to numeric types (DuckDB sums come back as floats)
+def same_result(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    try:
+        pd.testing.assert_frame_equal(
+            a.reset_index(drop=True), b.reset_index(drop=True), check_dtype=False, check_exact=False
+        )
+        return True
+    except AssertionError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite vs DuckDB on cross-store aggregates")
+    parser.add_argument("--db", default="Processed/dashboard_chatbot.db", help="database built by preprocess.py")
+    parser.add_argument("--scale", type=int, default=10, help="replicate the orders this many times")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per query and engine")
+    parser.add_argument("--threads", type=int, default=None, help="DuckDB threads (default: DUCKDB_THREADS)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "dashboard_chatbot.db")
+        parquet_folder = os.path.join(tmp, "parquet")
+        start = time.perf_counter()
+        orders = scale_database(args.db, db_path, args.scale, parquet_folder)
+        print(f"{orders} orders (x{args.scale}), built in {time.perf_counter() - start:.1f} s")
+
+        sqlite_engine = create_scoped_engine(db_path=db_path, backend="sqlite")
+        duckdb_engine = DuckDBEngine(parquet_folder) if args.threads is None else DuckDBEngine(
+            parquet_folder, threads=args.threads
+        )
+        start = time.perf_counter()
+        duckdb_engine.read_generation()
+        print(f"DuckDB load: {(time.perf_counter() - start) * 1000:.0f} ms ({duckdb_engine.threads} threads)")
+        print(f"{'query':<30} {'sqlite p50':>11} {'sqlite p95':>11} {'duckdb p50':>11} {'duckdb p95':>11} {'speedup':>8}")
+
+        for name, sql in QUERIES:
+            sqlite_result, sqlite_p50, sqlite_p95 = time_query(sqlite_engine, sql, args.repeat)
+            duckdb_result, duckdb_p50, duckdb_p95 = time_query(duckdb_engine, sql, args.repeat)
+            if not same_result(sqlite_result, duckdb_result):
+                sys.exit(f"Result mismatch for {name}")
+            print(
+                f"{name:<30} {sqlite_p50:9.1f}ms {sqlite_p95:9.1f}ms {duckdb_p50:9.1f}ms {duckdb_p95:9.1f}ms "
+                f"{sqlite_p50 / max(duckdb_p50, 1e-6):7.1f}x"
+            )
+        sqlite_engine.dispose()
+        print("Both backends returned the same results.")
+
+
+if __name__ == "__main__":
+    main()
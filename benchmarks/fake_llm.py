@@ -0,0 +1,92 @@
+# Offline stand-in for the Groq client used by main.py (client.chat.completions.create).
+#
+# Answers from a recorded question corpus: SQL prompts get the entry's `first_sql` on the first
+# request (to exercise the fix loop) and its `sql` afterwards, fix prompts get `sql`, and summary
+# prompts get a templated sentence. Unknown questions fall back to a templated query. Every call
+# sleeps for the configured latency, records the prompt size and reports an estimated `usage`, so
+# the benchmark measures the pipeline around the model rather than the model itself. stream=True
+# returns the reply as word chunks, with the usage on the last one like Groq's x_groq.
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from result_summary import estimate_tokens
+
+# Used for questions that are not in the corpus
+FALLBACK_SQL = "SELECT COUNT(*) AS orders FROM orders"
+
+
+# Which prompt of main.py the messages belong to, recognized from its system instructions
+def prompt_kind(messages: list) -> str:
+    system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+    if "natural language request" in system:
+        return "nl_to_sql"
+    if "failed on" in system:
+        return "fix_sql"
+    return "summarize"
+
+
+class FakeLLMClient:
+    def __init__(self, corpus: list, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0):
+        self.corpus = corpus
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.prompt_tokens = {}
+        self.calls = 0
+        self._seen = set()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # Mirrors the client.chat.completions.create attribute path of the Groq SDK
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    # Forgets which questions were already asked, so the next run sees first_sql again
+    def reset(self):
+        with self._lock:
+            self._seen.clear()
+
+    # Longest corpus question in the last message: the question itself, or its "User question:" line
+    # (the conversation memory in front of it may quote earlier questions)
+    def _entry(self, messages: list):
+        text = messages[-1]["content"]
+        if "User question: " in text:
+            text = text.split("User question: ", 1)[1].split("\n", 1)[0]
+        matches = [entry for entry in self.corpus if entry["question"] in text]
+        return max(matches, key=lambda entry: len(entry["question"])) if matches else None
+
+    def _reply(self, kind: str, entry) -> str:
+        if entry is None:
+            return FALLBACK_SQL if kind != "summarize" else "Here is the answer to your question."
+        if kind == "nl_to_sql":
+            with self._lock:
+                first = entry["question"] not in self._seen
+                self._seen.add(entry["question"])
+            return entry.get("first_sql", entry["sql"]) if first else entry["sql"]
+        if kind == "fix_sql":
+            return entry["sql"]
+        return f"Answer to “{entry['question']}” based on the rows returned."
+
+    def create(self, model: str = None, messages: list = None, temperature: float = 0.0,
+               max_tokens: int = None, stream: bool = False):
+        kind = prompt_kind(messages)
+        tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens.setdefault(kind, []).append(tokens)
+            delay = self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        content = self._reply(kind, self._entry(messages))
+        usage = SimpleNamespace(
+            prompt_tokens=tokens, completion_tokens=estimate_tokens(content), total_tokens=tokens + estimate_tokens(content)
+        )
+        if stream:
+            words = content.split(" ")
+            return [
+                SimpleNamespace(
+                    choices=[SimpleNamespace(delta=SimpleNamespace(content=word if i == 0 else " " + word))],
+                    x_groq=SimpleNamespace(usage=usage if i == len(words) - 1 else None),
+                )
+                for i, word in enumerate(words)
+            ]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
@@ -0,0 +1,258 @@
+# End-to-end benchmark and regression check of the question pipeline, fully offline.
+#
+# Builds synthetic datasets (the raw CSVs go through the real preprocessing, larger scales replicate
+# the orders), gives a main.QueryService the client of benchmarks/fake_llm.py and replays the question
+# corpus through its answer_question: nl_to_sql → pre-flight → execute (→ fix_sql_with_error) → summarize.
+# Response, result and paraphrase caches are bypassed so every question does the full work; each
+# question starts without conversation memory unless --conversation replays the corpus as one
+# conversation per scope (the report then shows the memory tokens added to each prompt).
+# Stage timings come from the question traces (tracing.py; --trace-log keeps them as JSON lines).
+# Reports p50/p95 per stage, retries, rows returned, prompt token sizes and the tokens saved by schema
+# pruning; each final result is compared with the corpus SQL run directly, and the pruned schema of
+# every question must contain all tables and columns its corpus SQL uses (schema recall). The store
+# names each question mentions must resolve through the merchant directory to exactly the entry's
+# `stores` (none when absent). Entries with `fast_path` state whether the rule-based summary answers
+# the result (true) or leaves it to the LLM (false), e.g. for cents that come through a CTE. --check
+# exits non-zero on any wrong answer, schema recall miss, store resolution or fast-path mismatch.
+#
+#   python benchmarks/pipeline_benchmark.py --scales 1,10,100 --llm-latency-ms 300 --check
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import main  # noqa: E402
+import tracing  # noqa: E402
+from cache import LLMResponseCache  # noqa: E402
+from conversation_memory import ConversationMemory  # noqa: E402
+from database import (  # noqa: E402
+    create_scoped_engine, get_merchant_directory, lookup_store_id, run_guarded_query, scope_key, scope_store_id,
+)
+from preprocess import DataPreprocessor  # noqa: E402
+from semantic_cache import SemanticQuestionCache  # noqa: E402
+from benchmarks.backend_benchmark import same_result  # noqa: E402
+from benchmarks.fake_llm import FakeLLMClient  # noqa: E402
+from benchmarks.synthetic import SYNTHETIC_STORE_NAMES, scale_database, write_synthetic_raw  # noqa: E402
+
+STAGES = ["nl_to_sql", "preflight", "execute", "fix_sql", "summarize", "total"]
+_IDENTIFIER_RE = re.compile(r"\b(?:(\w+)\.)?([A-Za-z_]\w*)\b")
+_TABLE_ALIAS_RE = re.compile(r"\b(?:from|join)\s+(\w+)(?:\s+(?:as\s+)?(?!where|join|on|group|order|limit|left|inner)(\w+))?", re.I)
+
+
+def load_corpus(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# (p50, p95) of a list of numbers
+def percentiles(values: list):
+    if not values:
+        return 0.0, 0.0
+    values = sorted(values)
+    return statistics.median(values), values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+
+
+# Builds the 1x database from synthetic raw CSVs; returns its path
+def build_base_database(folder: str, orders: int) -> str:
+    write_synthetic_raw(os.path.join(folder, "Raw"), orders)
+    processor = DataPreprocessor(os.path.join(folder, "Raw"), os.path.join(folder, "Processed"))
+    processor.preprocess_files(workers=1)
+    processor.clean_and_save_all()
+    return processor.db_path
+
+
+# Replays the corpus once against one database; returns per-question records
+def run_corpus(corpus: list, db_path: str, service: main.QueryService, fake: FakeLLMClient,
+               tracer: tracing.Tracer, conversation: bool = False) -> list:
+    merchant = SYNTHETIC_STORE_NAMES[0]
+    store_id = lookup_store_id(merchant, db_path)
+    scopes = {
+        "internal": (create_scoped_engine(db_path=db_path, backend="sqlite"), scope_key(),
+                     "Serving for PerDiem internal user"),
+        "merchant": (create_scoped_engine(store_id, db_path=db_path, backend="sqlite"), scope_key(store_id),
+                     f"Serving for merchant: {merchant}"),
+    }
+    memories = {name: ConversationMemory() for name in scopes}
+    service.merchant_directory = get_merchant_directory(db_path)
+    fake.reset()
+    records = []
+    for entry in corpus:
+        engine, scope, context_str = scopes[entry.get("scope", "internal")]
+        # Every question starts cold: no cached results or reusable SQL, and no conversation memory
+        # unless the corpus is replayed as a conversation
+        memory = memories[entry.get("scope", "internal")] if conversation else ConversationMemory()
+        database.result_cache.clear()
+        service.semantic_cache = SemanticQuestionCache(threshold=service.semantic_cache.threshold)
+
+        with tracer.trace(entry["question"], scope) as trace:
+            sql, df, error_msg, _ = service.answer_question(
+                entry["question"], engine, scope, context_str, memory, verbose=False
+            )
+        expected = run_guarded_query(entry["sql"], engine)
+        stores = service.merchant_directory.resolve_mentions(entry["question"], scope_store_id(scope))
+        resolved = [name for _, _, name, _ in stores]
+        fast_path = main.fast_path_summary(entry["question"], sql, df, error_msg, main.CENTS_COLUMNS)
+        records.append({
+            "question": entry["question"],
+            "stages": trace.stage_ms(),
+            "total": trace.total_ms,
+            "retries": trace.attrs.get("retries", 0),
+            "rows": 0 if df is None else len(df),
+            "answered": error_msg is None and df is not None,
+            "correct": error_msg is None and df is not None and same_result(df, expected),
+            "error": error_msg,
+            "tokens_saved": sum(span.get("tokens_saved", 0) for span in trace.spans),
+            "memory_tokens": {span["name"]: span["memory_tokens"] for span in trace.spans if "memory_tokens" in span},
+            "schema_misses": schema_misses(entry["question"], entry["sql"], stores),
+            "stores_ok": resolved == entry.get("stores", []),
+            "stores": resolved,
+            "fast_path_ok": entry.get("fast_path", fast_path is not None) == (fast_path is not None),
+            "fast_path": fast_path,
+        })
+    for engine, _, _ in scopes.values():
+        engine.dispose()
+    return records
+
+
+# Tables and columns of the corpus SQL missing from the question's pruned schema, as "table.column"
+def schema_misses(question: str, sql: str, stores: list = None) -> list:
+    selected = main.schema_retriever.select(question, stores)
+    if selected is None:
+        return []
+    retriever = main.schema_retriever
+    sql = re.sub(r"'[^']*'", "''", sql)
+    aliases = {}
+    for table, alias in _TABLE_ALIAS_RE.findall(sql):
+        aliases[table.lower()] = table.lower()
+        if alias:
+            aliases[alias.lower()] = table.lower()
+    tables = [table for table in dict.fromkeys(aliases.values()) if table in retriever.tables]
+    misses = [table for table in tables if table not in selected]
+    for qualifier, name in _IDENTIFIER_RE.findall(sql):
+        owners = [aliases.get(qualifier.lower())] if qualifier else tables
+        owners = [t for t in owners if t in retriever.tables and name in (c["name"] for c in retriever.tables[t]["columns"])]
+        if owners and not any(name in selected.get(table, []) for table in owners):
+            misses.append(f"{owners[0]}.{name}")
+    return sorted(set(misses))
+
+
+def report(records: list, fake: FakeLLMClient):
+    print(f"  {'stage':<12} {'p50':>9} {'p95':>9} {'calls':>6}")
+    for stage in STAGES:
+        if stage == "total":
+            values = [record["total"] for record in records]
+        else:
+            values = [record["stages"][stage] for record in records if stage in record["stages"]]
+        p50, p95 = percentiles(values)
+        print(f"  {stage:<12} {p50:7.2f}ms {p95:7.2f}ms {len(values):6d}")
+
+    retries = [record["retries"] for record in records]
+    rows_p50, rows_p95 = percentiles([record["rows"] for record in records])
+    print(
+        f"  retries: {sum(retries)} in total, {sum(1 for r in retries if r)} of {len(records)} questions needed a fix; "
+        f"rows returned p50 {rows_p50:.0f}, p95 {rows_p95:.0f}"
+    )
+    for kind, tokens in sorted(fake.prompt_tokens.items()):
+        p50, p95 = percentiles(tokens)
+        print(f"  prompt tokens {kind:<10} p50 {p50:6.0f}  p95 {p95:6.0f}  ({len(tokens)} calls)")
+    for stage in ("nl_to_sql", "fix_sql", "summarize"):
+        values = [record["memory_tokens"][stage] for record in records if stage in record["memory_tokens"]]
+        if values:
+            p50, p95 = percentiles(values)
+            print(f"  memory tokens {stage:<10} p50 {p50:6.0f}  p95 {p95:6.0f}")
+    saved_p50, saved_p95 = percentiles([record["tokens_saved"] for record in records])
+    print(f"  schema pruning saved p50 {saved_p50:.0f}, p95 {saved_p95:.0f} prompt tokens per question")
+    recalled = sum(not record["schema_misses"] for record in records)
+    print(f"  schema recall {recalled}/{len(records)}")
+    for record in records:
+        if record["schema_misses"]:
+            print(f"  SCHEMA MISS: {record['question']} ({', '.join(record['schema_misses'])})")
+    resolved = sum(record["stores_ok"] for record in records)
+    print(f"  store resolution {resolved}/{len(records)}")
+    for record in records:
+        if not record["stores_ok"]:
+            print(f"  STORE MISMATCH: {record['question']} (resolved {record['stores'] or 'none'})")
+    fast = sum(record["fast_path"] is not None for record in records)
+    print(f"  fast-path answers {fast}/{len(records)}")
+    for record in records:
+        if not record["fast_path_ok"]:
+            print(f"  FAST PATH MISMATCH: {record['question']} ({record['fast_path'] or 'left to the LLM'})")
+    answered = sum(record["answered"] for record in records)
+    correct = sum(record["correct"] for record in records)
+    print(f"  answered {answered}/{len(records)}, correct {correct}/{len(records)}")
+    for record in records:
+        if not record["correct"]:
+            print(f"  WRONG: {record['question']} ({record['error'] or 'result differs from the corpus SQL'})")
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the question pipeline")
+    parser.add_argument("--scales", default="1,10,100", help="comma-separated order multipliers")
+    parser.add_argument("--orders", type=int, default=5600, help="orders in the 1x dataset")
+    parser.add_argument("--repeat", type=int, default=3, help="corpus replays per scale")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency per LLM call")
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0, help="uniform +/- jitter on that latency")
+    parser.add_argument(
+        "--corpus", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions.jsonl"),
+        help="JSONL of {question, sql, first_sql?, scope?, stores?, fast_path?}",
+    )
+    parser.add_argument(
+        "--check", action="store_true",
+        help="exit non-zero when an answer is wrong, the pruned schema misses a column, a store name is not resolved "
+             "or the fast-path summary answers differently than the corpus expects"
+    )
+    parser.add_argument(
+        "--conversation", action="store_true", help="keep conversation memory across the questions of a scope"
+    )
+    parser.add_argument("--trace-log", default="", help="append the question traces to this JSON-lines file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        fake = FakeLLMClient(corpus, args.llm_latency_ms, args.llm_jitter_ms)
+        # A zero TTL turns the on-disk completion cache into a pass-through
+        service = main.QueryService(
+            client=fake, llm_cache=LLMResponseCache(os.path.join(tmp, "llm_responses.db"), ttl_seconds=0)
+        )
+
+        start = time.perf_counter()
+        base_db = build_base_database(tmp, args.orders)
+        print(f"Synthetic 1x dataset built in {time.perf_counter() - start:.1f} s")
+
+        for scale in [int(value) for value in args.scales.split(",") if value.strip()]:
+            db_path = base_db
+            if scale > 1:
+                db_path = os.path.join(tmp, f"scaled_{scale}", "dashboard_chatbot.db")
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+                start = time.perf_counter()
+                orders = scale_database(base_db, db_path, scale)
+                print(f"\nScale {scale}x: {orders} orders, built in {time.perf_counter() - start:.1f} s")
+            else:
+                print(f"\nScale 1x: {args.orders} orders")
+
+            fake.prompt_tokens.clear()
+            tracer = tracing.Tracer(log_path=args.trace_log)
+            records = []
+            for _ in range(args.repeat):
+                records.extend(run_corpus(corpus, db_path, service, fake, tracer, args.conversation))
+            report(records, fake)
+            failures += sum(
+                not record["correct"] or bool(record["schema_misses"]) or not record["stores_ok"]
+                or not record["fast_path_ok"]
+                for record in records
+            )
+
+    if args.check and failures:
+        sys.exit(f"{failures} wrong answers, schema recall misses, store resolution or fast-path mismatches")
+
+
+if __name__ == "__main__":
+    main_benchmark()
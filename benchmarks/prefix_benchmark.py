@@ -0,0 +1,101 @@
+# Throughput benchmark for the CSV comma pre-fixer in preprocess.py.
+#
+# Generates synthetic orders/stores-style CSVs with JSON-like fields, runs the reference
+# character-by-character fixer and the block/regex fixer (sequential and in a process pool),
+# checks that the outputs are byte-identical and reports MB/s.
+#
+#   python benchmarks/prefix_benchmark.py --mb 50 --files 4
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocess import DataPreprocessor, _replace_commas_reference, prefix_csv_file  # noqa: E402
+
+
+# Writes a CSV of roughly size_mb megabytes; most rows carry nested JSON fields with commas
+def write_synthetic_csv(path: str, size_mb: float, seed: int = 0):
+    rng = random.Random(seed)
+    header = "order_id,store_id,total_amount_in_cents,delivery_info,subscription_discounts_metadata,notes\n"
+    target = int(size_mb * 1024 * 1024)
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(header)
+        while written < target:
+            if rng.random() < 0.3:
+                info = "{}"
+            else:
+                info = (
+                    '{"address":{"line1":"%d Main St","city":"Springfield","zip":"%05d"},'
+                    '"eta_minutes":%d,"fee":{"amount":%d,"currency":"usd"}}'
+                    % (rng.randint(1, 999), rng.randint(0, 99999), rng.randint(5, 90), rng.randint(0, 900))
+                )
+            meta = '{"plan":"monthly","discount":%d}' % rng.randint(0, 50) if rng.random() < 0.2 else "{}"
+            line = '"%032x","%032x",%d,%s,%s,"note, with comma"\n' % (
+                rng.getrandbits(128), rng.getrandbits(128), rng.randint(100, 20000), info, meta
+            )
+            f.write(line)
+            written += len(line)
+
+
+def reference_prefix(csv_file: str, output_path: str):
+    with open(csv_file, "r", encoding="utf-8") as infile, open(output_path, "w", encoding="utf-8") as outfile:
+        for line in infile:
+            outfile.write(_replace_commas_reference(line))
+
+
+def timed(label: str, total_mb: float, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:8.3f} s  {total_mb / elapsed:8.1f} MB/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mb", type=float, default=20, help="size of each synthetic file in MB")
+    parser.add_argument("--files", type=int, default=4, help="number of synthetic files")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, "Raw")
+        os.makedirs(raw)
+        for i in range(args.files):
+            write_synthetic_csv(os.path.join(raw, f"orders_2025_{i + 1}.csv"), args.mb, seed=i)
+        files = sorted(os.listdir(raw))
+        total_mb = sum(os.path.getsize(os.path.join(raw, f)) for f in files) / (1024 * 1024)
+        print(f"{len(files)} files, {total_mb:.1f} MB in total")
+
+        out_ref = os.path.join(tmp, "ref")
+        out_seq = os.path.join(tmp, "seq")
+        out_par = os.path.join(tmp, "par")
+        for folder in (out_ref, out_seq, out_par):
+            os.makedirs(folder)
+
+        timed("reference (char loop)", total_mb, lambda: [
+            reference_prefix(os.path.join(raw, f), os.path.join(out_ref, f"fixed_{f}")) for f in files
+        ])
+        timed("block + regex, sequential", total_mb, lambda: [
+            prefix_csv_file(os.path.join(raw, f), os.path.join(out_seq, f"fixed_{f}")) for f in files
+        ])
+        processor = DataPreprocessor(input_folder=raw, output_folder=out_par)
+        timed("block + regex, process pool", total_mb, lambda: processor.preprocess_files(workers=args.workers))
+
+        for f in files:
+            with open(os.path.join(out_ref, f"fixed_{f}"), "rb") as a:
+                expected = a.read()
+            for folder in (out_seq, out_par):
+                with open(os.path.join(folder, f"fixed_{f}"), "rb") as b:
+                    if b.read() != expected:
+                        sys.exit(f"Output mismatch for {f} in {os.path.basename(folder)}")
+        print("Outputs are byte-identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Latency benchmark for the daily_store_metrics rollup built by preprocess.py.
+#
+# Runs the common merchant metrics (daily counts, monthly revenue, weekly tips, fulfillment mix)
+# once against the raw orders table and once against the rollup, checks that both return the
+# same rows and reports median/p95 latency. Queries go through the same read-only, optionally
+# store-scoped connections the app uses.
+#
+#   python benchmarks/rollup_benchmark.py --db Processed/dashboard_chatbot.db --repeat 50
+#   python benchmarks/rollup_benchmark.py --store <store_id>
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import connect_scoped  # noqa: E402
+
+# (name, raw orders query, equivalent rollup query)
+QUERY_PAIRS = [
+    (
+        "daily order count",
+        "SELECT created_date AS day, COUNT(*) AS orders FROM orders GROUP BY created_date ORDER BY day",
+        "SELECT date AS day, SUM(order_count) AS orders FROM daily_store_metrics GROUP BY date ORDER BY day",
+    ),
+    (
+        "monthly revenue per store",
+        "SELECT store_id, substr(created_date, 1, 7) AS month, SUM(total_amount_in_cents) AS revenue "
+        "FROM orders GROUP BY store_id, month ORDER BY store_id, month",
+        "SELECT store_id, substr(date, 1, 7) AS month, SUM(revenue_in_cents) AS revenue "
+        "FROM daily_store_metrics GROUP BY store_id, month ORDER BY store_id, month",
+    ),
+    (
+        "weekly tips",
+        "SELECT strftime('%Y-%W', created_date) AS week, SUM(tip_amount_in_cents) AS tips "
+        "FROM orders GROUP BY week ORDER BY week",
+        "SELECT strftime('%Y-%W', date) AS week, SUM(tip_amount_in_cents) AS tips "
+        "FROM daily_store_metrics GROUP BY week ORDER BY week",
+    ),
+    (
+        "fulfillment mix",
+        "SELECT COALESCE(fulfillment_type, 'unknown') AS fulfillment, COUNT(*) AS orders, "
+        "SUM(delivery_fee_in_cents) AS delivery_fees FROM orders GROUP BY fulfillment ORDER BY fulfillment",
+        "SELECT fulfillment_type AS fulfillment, SUM(order_count) AS orders, "
+        "SUM(delivery_fee_in_cents) AS delivery_fees FROM daily_store_metrics GROUP BY fulfillment ORDER BY fulfillment",
+    ),
+]
+
+
+# Runs sql repeat times and returns (rows, median ms, p95 ms)
+def time_query(conn, sql: str, repeat: int):
+    timings = []
+    rows = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(sql).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))]
+    return rows, statistics.median(timings), p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raw orders scans vs the daily_store_metrics rollup")
+    parser.add_argument("--db", default="Processed/dashboard_chatbot.db", help="database built by preprocess.py")
+    parser.add_argument("--store", default=None, help="store_id to scope the queries to (default: all stores)")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per query")
+    args = parser.parse_args()
+
+    conn = connect_scoped(args.db, args.store)
+    orders = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    rollup_rows = conn.execute("SELECT COUNT(*) FROM daily_store_metrics").fetchone()[0]
+    print(f"{orders} orders, {rollup_rows} rollup rows ({'store ' + args.store if args.store else 'all stores'})")
+    print(f"{'query':<28} {'raw p50':>9} {'raw p95':>9} {'rollup p50':>11} {'rollup p95':>11} {'speedup':>8}")
+
+    for name, raw_sql, rollup_sql in QUERY_PAIRS:
+        raw_rows, raw_p50, raw_p95 = time_query(conn, raw_sql, args.repeat)
+        rollup_rows, rollup_p50, rollup_p95 = time_query(conn, rollup_sql, args.repeat)
+        if raw_rows != rollup_rows:
+            sys.exit(f"Result mismatch for {name}")
+        print(
+            f"{name:<28} {raw_p50:8.2f}ms {raw_p95:8.2f}ms {rollup_p50:10.2f}ms {rollup_p95:10.2f}ms "
+            f"{raw_p50 / max(rollup_p50, 1e-6):7.1f}x"
+        )
+    conn.close()
+    print("Rollup results match the raw scans.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Cold-start benchmark: how long a fresh interpreter takes to import the app's backend and list the
+# merchants, which is what every new Streamlit server process and console run pays before it can serve.
+#
+# Each module is imported N times in a new `python -X importtime` process. The report shows the
+# median cumulative import time, the slowest direct imports and which heavy modules (pandas,
+# SQLAlchemy, the Groq SDK, NumPy, LangChain) were loaded; none of them should be, they are imported
+# on first use. A merchant typeahead search over the directory built by preprocess.py is timed cold
+# and, for comparison, the way the app used to list merchants (pandas over cleaned_stores.csv), on a
+# synthetic build.
+# --check exits non-zero when `import main` exceeds --budget-ms or loads a heavy module.
+#
+#   python benchmarks/startup_benchmark.py --runs 5 --budget-ms 300 --check
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import write_synthetic_raw  # noqa: E402
+
+# Modules the backend imports on first use only; loading one at startup is a regression
+HEAVY_MODULES = ["pandas", "sqlalchemy", "groq", "numpy", "langchain"]
+# Modules whose import time is reported; app.py imports these besides streamlit itself
+MODULES = ["main", "database", "conversation_memory", "tracing"]
+
+
+# One `python -X importtime -c "import <module>"` run: (cumulative ms of the module, set of modules
+# loaded, [(cumulative ms, name)] of its direct imports)
+def import_profile(module: str):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    loaded, direct, children, total_ms = set(), [], [], 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        loaded.add(name.split(".")[0])
+        # Children are listed before their parent, so the direct imports of a top-level module are
+        # the depth-1 lines since the previous top-level one
+        if depth == 0:
+            if name == module:
+                total_ms, direct = int(cumulative) / 1000, children
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative) / 1000, name))
+    return total_ms, loaded, direct
+
+
+# Median wall time (ms) of a fresh interpreter running code, minus that of an empty one
+def cold_run_ms(code: str, runs: int) -> float:
+    def wall(snippet):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", snippet], cwd=ROOT, check=True)
+            times.append((time.perf_counter() - start) * 1000)
+        return statistics.median(times)
+    return wall(code) - wall("pass")
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Cold-start import and merchant list benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--budget-ms", type=float, default=300.0, help="import time allowed for `import main`")
+    parser.add_argument("--orders", type=int, default=2000, help="orders in the synthetic build")
+    parser.add_argument("--check", action="store_true", help="fail when over budget or a heavy module is loaded")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':<22} {'p50 ms':>8}  heavy modules loaded")
+    for module in MODULES:
+        profiles = [import_profile(module) for _ in range(args.runs)]
+        p50 = statistics.median(total for total, _, _ in profiles)
+        heavy = sorted(set(HEAVY_MODULES) & set.union(*(loaded for _, loaded, _ in profiles)))
+        print(f"{module:<22} {p50:8.1f}  {', '.join(heavy) or '-'}")
+        if module == "main":
+            slowest = sorted(profiles[-1][2], reverse=True)[:5]
+            print("  slowest imports of main: " + ", ".join(f"{name} {ms:.1f} ms" for ms, name in slowest))
+            if p50 > args.budget_ms:
+                failures.append(f"import main takes {p50:.0f} ms (budget {args.budget_ms:.0f} ms)")
+            if heavy:
+                failures.append(f"import main loads {', '.join(heavy)}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Imported here so that the import measurements above start from a cold interpreter
+        from preprocess import DataPreprocessor
+        write_synthetic_raw(os.path.join(tmp, "Raw"), args.orders)
+        processor = DataPreprocessor(os.path.join(tmp, "Raw"), os.path.join(tmp, "Processed"))
+        processor.preprocess_files(workers=1)
+        processor.clean_and_save_all()
+        csv_path = os.path.join(tmp, "Processed", "cleaned_stores.csv")
+
+        search_ms = cold_run_ms(
+            f"from database import get_merchant_directory; get_merchant_directory({processor.db_path!r}).search('bag')",
+            args.runs,
+        )
+        csv_ms = cold_run_ms(
+            f"import pandas as pd; sorted(pd.read_csv({csv_path!r})['name'].unique().tolist())", args.runs
+        )
+        print(f"\nMerchant search, cold: directory {search_ms:.1f} ms, pandas over cleaned_stores.csv {csv_ms:.1f} ms")
+
+    if failures:
+        print()
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        if args.check:
+            sys.exit(f"{len(failures)} startup check(s) failed")
+
+
+if __name__ == "__main__":
+    main_benchmark()
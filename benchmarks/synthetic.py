@@ -0,0 +1,144 @@
+# Synthetic data for the benchmarks.
+#
+# write_synthetic_raw writes Raw-folder CSVs in the exported format (including unquoted JSON with
+# commas in the stores file), so the whole preprocessing pipeline can run offline.
+# scale_database copies a dashboard_chatbot.db with its orders replicated `factor` times: each copy
+# gets fresh order_ids and is assigned round-robin to the existing stores, so cross-store aggregates
+# have work to do. The rollup is then rebuilt and, optionally, the Parquet export written.
+import csv
+import json
+import os
+import random
+import sqlite3
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocess import TABLE_SCHEMAS, DataPreprocessor  # noqa: E402
+
+
+# Store names used by write_synthetic_raw; the benchmark question corpus refers to them. "My Business"
+# and "The Coffee Shop" are made of everyday words that questions use without meaning the store; the
+# last one is spelled like some real exports (upper case, trailing space) to exercise name normalization.
+SYNTHETIC_STORE_NAMES = [
+    "Tikka Shack", "Coffee Drip", "Migos Fine Foods", "LiftOff Creamery", "Bagel Barn", "Noodle Nook",
+    "Taco Terrace", "Pita Palace", "Sushi Stop", "Burger Bay", "Curry Corner", "My Business",
+    "The Coffee Shop", "WAFFLE WORKS INC. ",
+]
+
+_ORDER_COLUMNS = [name for name, _ in TABLE_SCHEMAS["orders"] if name not in (
+    "created_epoch", "created_date", "delivery_provider", "delivery_provider_fee_in_cents",
+    "delivery_pickup_address", "delivery_dropoff_address", "delivered_at",
+)]
+
+
+def _timestamp(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+# Writes stores.csv, customers_2025_3.csv and orders_2025_3/4.csv with about `orders` orders in total
+def write_synthetic_raw(raw_folder: str, orders: int = 5600, seed: int = 0):
+    rng = random.Random(seed)
+    os.makedirs(raw_folder, exist_ok=True)
+    store_ids = [_uuid(rng) for _ in SYNTHETIC_STORE_NAMES]
+
+    with open(os.path.join(raw_folder, "stores.csv"), "w", encoding="utf-8") as f:
+        f.write("store_id,external_store_id,name,active,created_at,updated_at,delivery_fee,platform_fee,consumer_fee,pre_sale\n")
+        for store_id, name in zip(store_ids, SYNTHETIC_STORE_NAMES):
+            fee = rng.choice([25, 50])
+            platform = {"fee": fee, "type": "amount", "enabled_fee": True} if rng.random() < 0.8 else \
+                {"fee": 6, "type": "percentage", "enabled_fee": True}
+            consumer = {kind: {"fee": rng.choice([25, 100, 150]), "type": "amount", "enabled_fee": True,
+                               "enabled_waiver": False} for kind in ("pickup", "delivery")}
+            delivery = {"fee": rng.choice([0, 300, 500]), "title": "Delivery Fee", "enabled_fee": True,
+                        "enabled_waiver": False}
+            created = _timestamp(datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 300)))
+            f.write(
+                f'"{store_id}","EXT{rng.getrandbits(40):010X}","{name}",true,"{created}","{created}",'
+                f"{json.dumps(delivery, separators=(',', ':'))},{json.dumps(platform, separators=(',', ':'))},"
+                f"{json.dumps(consumer, separators=(',', ':'))},{{\"active\":false}} \n"
+            )
+
+    customers = {store_id: [_uuid(rng) for _ in range(max(5, orders // (4 * len(store_ids))))] for store_id in store_ids}
+    with open(os.path.join(raw_folder, "customers_2025_3.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        writer.writerow(["customer_id", "store_id", "external_customer_id"])
+        for store_id, ids in customers.items():
+            for customer_id in ids:
+                writer.writerow([customer_id, store_id, f"{rng.getrandbits(64):016X}"])
+
+    for month in (3, 4):
+        with open(os.path.join(raw_folder, f"orders_2025_{month}.csv"), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+            writer.writerow(_ORDER_COLUMNS)
+            for _ in range(orders // 2):
+                # A few busy stores take most orders, like the real data
+                store_id = store_ids[min(int(rng.expovariate(0.5)), len(store_ids) - 1)]
+                created = datetime(2025, month, 1) + timedelta(seconds=rng.randint(0, 29 * 24 * 3600))
+                delivery = rng.random() < 0.1
+                total = rng.randint(500, 9000)
+                info = "{}"
+                if delivery:
+                    info = json.dumps({
+                        "type": "DELIVERY", "deliverAt": _timestamp(created + timedelta(minutes=40))[:-5] + "Z",
+                        "pickupAddress": "150 W Chocolate Ave, Hershey, PA 17033, US",
+                        "dropoffAddress": f"{rng.randint(1, 999)} Main Street, Hershey, PA, USA",
+                        "courierProviderName": "doordash", "providerDeliveryFee": str(rng.choice([700, 750])),
+                    }, separators=(",", ":"))
+                order_type = "regular_checkout" if rng.random() < 0.97 else rng.choice(["gift_card", "store_credit_reload"])
+                values = {
+                    "order_id": _uuid(rng), "store_id": store_id, "customer_id": rng.choice(customers[store_id]),
+                    "external_location_id": "LOC1", "external_order_id": f"{rng.getrandbits(64):016X}",
+                    "total_amount_in_cents": total, "discount_amount_in_cents": rng.choice([0, 0, 0, 200, 500]),
+                    "delivery_fee_in_cents": rng.choice([700, 750]) if delivery else 0,
+                    "created_at": _timestamp(created), "updated_at": _timestamp(created),
+                    "fulfillment_type": "delivery" if delivery else "pickup",
+                    "tip_amount_in_cents": rng.choice([0, 0, 100, total // 10]), "service_fee_in_cents": 0,
+                    "subscription_discounts_metadata": "{}", "notes": "", "delivery_info": info,
+                    "risk_level": 1 if rng.random() < 0.98 else 0, "order_type": order_type,
+                    "perdiem_platform_fee_in_cents": 100 if delivery else 0,
+                    "scheduled_fulfillment_at": _timestamp(created + timedelta(minutes=20)) + " ",
+                }
+                writer.writerow([values[name] for name in _ORDER_COLUMNS])
+
+
+# Copies src_db to dst_db with its orders replicated factor times; returns the number of orders
+def scale_database(src_db: str, dst_db: str, factor: int, parquet_folder: str = None) -> int:
+    if os.path.exists(dst_db):
+        os.remove(dst_db)
+    source = sqlite3.connect(f"file:{src_db}?mode=ro", uri=True)
+    conn = sqlite3.connect(dst_db)
+    source.backup(conn)
+    source.close()
+
+    stores = [row[0] for row in conn.execute("SELECT store_id FROM stores ORDER BY store_id")]
+    columns = [name for name, _ in TABLE_SCHEMAS["orders"]]
+    conn.execute("CREATE TEMP TABLE base_orders AS SELECT * FROM orders")
+    for copy in range(1, max(1, int(factor))):
+        select = ", ".join(
+            "order_id || ?" if name == "order_id" else "?" if name == "store_id" else name for name in columns
+        )
+        conn.execute(
+            f"INSERT INTO orders ({', '.join(columns)}) SELECT {select} FROM temp.base_orders",
+            (f"-x{copy}", stores[copy % len(stores)]),
+        )
+    conn.execute("DROP TABLE temp.base_orders")
+    conn.commit()
+
+    processor = DataPreprocessor(
+        input_folder=os.path.dirname(dst_db), output_folder=os.path.dirname(dst_db), parquet_folder=parquet_folder
+    )
+    processor.refresh_rollups(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+    if parquet_folder:
+        processor.export_parquet(conn)
+    orders = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    conn.close()
+    return orders
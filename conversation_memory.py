@@ -0,0 +1,79 @@
+import os
+import re
+from collections import deque
+
+from result_summary import estimate_tokens
+
+# Number of recent question/answer turns kept (the window of the former LangChain memory)
+MEMORY_TURNS = int(os.getenv("MEMORY_TURNS", "3"))
+# Prompt tokens the remembered turns may take; the oldest turns are dropped first to stay within it
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "400"))
+# Characters of the answer kept in a turn's digest
+MEMORY_DIGEST_CHARS = int(os.getenv("MEMORY_DIGEST_CHARS", "200"))
+
+_SPACE_RE = re.compile(r"\s+")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+_MARKDOWN_RE = re.compile(r"[*_`#>|]+")
+
+
+# Short form of an answer: markdown stripped, whitespace collapsed, cut at a sentence end when possible
+def digest(text: str, max_chars: int = MEMORY_DIGEST_CHARS) -> str:
+    text = _SPACE_RE.sub(" ", _MARKDOWN_RE.sub("", text or "")).strip()
+    if len(text) <= max_chars:
+        return text
+    ends = [match.start() for match in _SENTENCE_END_RE.finditer(text, 0, max_chars + 1)]
+    return text[: ends[-1]] if ends else text[:max_chars].rstrip() + "…"
+
+
+# Conversation memory of one chat session: a ring buffer of compact turns (question, final SQL,
+# answer digest) bounded by MEMORY_TURNS and MEMORY_TOKEN_BUDGET. Each prompt renders only what it
+# needs: SQL generation and correction see the questions and their SQL, the summary sees the
+# questions and answer digests. Keeps the load_memory_variables/save_context/clear interface of the
+# LangChain window memory it replaces.
+class ConversationMemory:
+    def __init__(self, k: int = MEMORY_TURNS, token_budget: int = MEMORY_TOKEN_BUDGET,
+                 digest_chars: int = MEMORY_DIGEST_CHARS):
+        self.k = k
+        self.token_budget = token_budget
+        self.digest_chars = digest_chars
+        self.turns = deque(maxlen=max(0, k))
+
+    def save_turn(self, question: str, sql: str = None, answer: str = ""):
+        if not self.k:
+            return
+        turn = {
+            "question": _SPACE_RE.sub(" ", question).strip(),
+            "sql": _SPACE_RE.sub(" ", sql).strip() if sql else None,
+            "answer": digest(answer, self.digest_chars),
+        }
+        turn["tokens"] = estimate_tokens(self._render_turn(turn, "full"))
+        self.turns.append(turn)
+        # Oldest-first eviction; the latest turn is always kept
+        while len(self.turns) > 1 and sum(t["tokens"] for t in self.turns) > self.token_budget:
+            self.turns.popleft()
+
+    # LangChain-compatible: inputs {"user": question, "sql": final SQL (optional)}, outputs {"assistant": answer}
+    def save_context(self, inputs: dict, outputs: dict):
+        self.save_turn(inputs.get("user", ""), inputs.get("sql"), outputs.get("assistant", ""))
+
+    @staticmethod
+    def _render_turn(turn: dict, view: str) -> str:
+        lines = [f"User: {turn['question']}"]
+        if view in ("sql", "full"):
+            lines.append(f"SQL: {turn['sql'] or '(failed)'}")
+        if view in ("summary", "full") and turn["answer"]:
+            lines.append(f"Answer: {turn['answer']}")
+        return "\n".join(lines)
+
+    # Remembered turns, oldest first, for a prompt: "sql" (questions and SQL), "summary" (questions and
+    # answer digests) or "full"
+    def render(self, view: str = "full") -> str:
+        if not self.turns:
+            return "(none)"
+        return "\n" + "\n\n".join(self._render_turn(turn, view) for turn in self.turns)
+
+    def load_memory_variables(self, inputs: dict) -> dict:
+        return {"history": self.render("full")}
+
+    def clear(self):
+        self.turns.clear()
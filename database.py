@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING
+from cache import ResultCache, normalize_sql
+from merchant_directory import MerchantDirectory
+from sql_validator import statement_error
+import tracing
+
+# pandas and SQLAlchemy are imported on first use (engine creation, first query), not at startup
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Shared database built by DataPreprocessor (see preprocess.py)
+ORIGINAL_DB_PATH = "Processed/dashboard_chatbot.db"
+
+# Process-wide cache of query results; size is configurable through RESULT_CACHE_MB
+result_cache = ResultCache(max_bytes=int(float(os.getenv("RESULT_CACHE_MB", "64")) * 1024 * 1024))
+
+# Query engine for generated SQL: "sqlite" (default) or "duckdb", which runs over the Parquet export
+# written by `python preprocess.py --parquet`
+QUERY_BACKEND = os.getenv("QUERY_BACKEND", "sqlite").lower()
+PARQUET_FOLDER = os.getenv("PARQUET_FOLDER", "Processed/parquet")
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", str(os.cpu_count() or 1)))
+
+# Execution guardrails for generated SQL (configurable through the environment)
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "10"))
+QUERY_ROW_LIMIT = int(os.getenv("QUERY_ROW_LIMIT", "10000"))
+QUERY_CHUNK_ROWS = 1000
+
+# Connections kept open per scoped engine, and extra ones opened under load
+ENGINE_POOL_SIZE = int(os.getenv("ENGINE_POOL_SIZE", "5"))
+ENGINE_MAX_OVERFLOW = int(os.getenv("ENGINE_MAX_OVERFLOW", "10"))
+
+# Number of SQLite VM instructions between two deadline checks
+PROGRESS_HANDLER_STEPS = 10000
+
+# Tables exposed to the LLM-generated SQL. For merchants each one is shadowed by a TEMP view.
+SCOPED_TABLES = {
+    "stores": "store_id",
+    "orders": "store_id",
+    "customers": "store_id",
+    "store_consumer_fees": "store_id",
+    "daily_store_metrics": "store_id",
+}
+
+# SQLite bookkeeping tables that may still be read directly inside a scoped connection
+_SYSTEM_TABLES = ("sqlite_master", "sqlite_schema", "sqlite_temp_master", "sqlite_stat1")
+
+
+# Raised when generated SQL runs past its time budget or returns more rows than allowed.
+# The message is written for the LLM fix loop, which receives it like any other SQLite error.
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# Pragmas generated SQL and the pipeline may run: schema lookups (validator), the generation stamp and
+# SQLAlchemy's isolation level probe. Those without an argument are only allowed as reads.
+_READ_PRAGMAS = {"table_info", "table_xinfo", "index_list", "index_info", "foreign_key_list"}
+_READ_ONLY_PRAGMAS = {"user_version", "read_uncommitted", "query_only"}
+
+# Statement kinds a connection accepts once set up: queries only
+_ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+
+# Authorizer installed on every connection once it is set up. Anything but a query is denied at
+# prepare time: writes, CREATE/DROP (the TEMP views included), ATTACH and pragmas that change state,
+# so `PRAGMA query_only = OFF` followed by `DROP VIEW temp.orders` cannot unscope a pooled connection.
+# For merchants the base tables are only readable through the TEMP views: a direct reference such as
+# `main.orders` has no view attached and is denied too.
+def _authorizer(scoped: bool):
+    def authorize(action, arg1, arg2, db_name, trigger_or_view):
+        if action == sqlite3.SQLITE_PRAGMA:
+            name = (arg1 or "").lower()
+            if name in _READ_PRAGMAS or (name in _READ_ONLY_PRAGMAS and arg2 is None):
+                return sqlite3.SQLITE_OK
+            return sqlite3.SQLITE_DENY
+        if action not in _ALLOWED_ACTIONS:
+            return sqlite3.SQLITE_DENY
+        if scoped and action == sqlite3.SQLITE_READ and db_name == "main":
+            if trigger_or_view is None and arg1 not in _SYSTEM_TABLES:
+                return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK
+    return authorize
+
+
+# Identity of the database file: DataPreprocessor swaps a rebuilt database in as a new file, so a
+# connection opened before the swap still reads the old one (None when the file does not exist)
+def database_file_id(db_path: str):
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+# sqlite3 connection that remembers which database file it was opened on
+class _FileConnection(sqlite3.Connection):
+    db_path = None
+    file_id = None
+
+
+# Creates a read-only connection where, for merchants, every table in SCOPED_TABLES only contains rows
+# for one store
+def connect_scoped(db_path: str, store_id: str = None) -> sqlite3.Connection:
+    # Taken before opening: a swap in between only makes the pool recycle this connection once more
+    file_id = database_file_id(db_path)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False,
+                           factory=_FileConnection)
+    conn.db_path, conn.file_id = db_path, file_id
+    if store_id:
+        literal = "'" + str(store_id).replace("'", "''") + "'"
+        for table, key in SCOPED_TABLES.items():
+            conn.execute(
+                f"CREATE TEMP VIEW {table} AS SELECT * FROM main.{table} WHERE {key} = {literal}"
+            )
+    # Switched on only after the views exist: query_only also rejects CREATE TEMP VIEW
+    conn.execute("PRAGMA query_only = ON")
+    conn.set_authorizer(_authorizer(bool(store_id)))
+    return conn
+
+
+# Returns a SQLAlchemy engine whose connections are read-only and, for merchants, scoped to one store.
+# Building the engine is constant time: no rows are copied and no file is written.
+# With QUERY_BACKEND=duckdb a DuckDBEngine over the Parquet export is returned instead.
+# Each engine is the connection cache of its scope: a queue of already-scoped connections (views and
+# authorizer set up once) that any thread may check out, pool_size kept open plus up to
+# ENGINE_MAX_OVERFLOW opened on demand, so one engine can be shared by every session and worker.
+def create_scoped_engine(store_id: str = None, db_path: str = ORIGINAL_DB_PATH, backend: str = None,
+                         pool_size: int = ENGINE_POOL_SIZE):
+    if (backend or QUERY_BACKEND) == "duckdb":
+        return DuckDBEngine(PARQUET_FOLDER, store_id)
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.pool import QueuePool
+    engine = create_engine(
+        "sqlite://", creator=lambda: connect_scoped(db_path, store_id), poolclass=QueuePool,
+        pool_size=pool_size, max_overflow=ENGINE_MAX_OVERFLOW, pool_timeout=QUERY_TIMEOUT_SECONDS,
+    )
+    event.listen(engine, "checkout", _recycle_replaced)
+    return engine
+
+
+# Pool checkout hook: a connection opened on a database file that has since been replaced by a
+# rebuild is discarded, and the pool opens a new one on the current file in its place
+def _recycle_replaced(dbapi_conn, connection_record, connection_proxy):
+    if dbapi_conn.file_id != database_file_id(dbapi_conn.db_path):
+        from sqlalchemy.exc import DisconnectionError
+        raise DisconnectionError("database file was replaced by a rebuild")
+
+
+# SQL dialect spoken by an engine, used to pick the prompt's dialect note and the pre-flight checks
+def sql_dialect(engine) -> str:
+    return "duckdb" if isinstance(engine, DuckDBEngine) else "sqlite"
+
+
+# Raw connection handed out by DuckDBEngine, shaped like SQLAlchemy's (driver_connection + close),
+# with the generation of the export its cursor reads
+class _DuckDBRawConnection:
+    def __init__(self, cursor, generation: int):
+        self.driver_connection = cursor
+        self.generation = generation
+
+    def close(self):
+        self.driver_connection.close()
+
+
+# Embedded DuckDB engine over the Parquet export, for vectorized, multi-threaded scans across stores.
+# The scoped tables are loaded into an in-memory database on first use (only one store's rows for
+# merchants); file access is then disabled and the configuration locked, so generated SQL can read
+# nothing else. Each query runs on its own cursor of that database. When a new export is written
+# (its _generation file changes) the tables are loaded again; queries already running finish on the
+# previous copy.
+class DuckDBEngine:
+    def __init__(self, parquet_folder: str = PARQUET_FOLDER, store_id: str = None, threads: int = DUCKDB_THREADS):
+        self.parquet_folder = parquet_folder
+        self.store_id = store_id
+        self.threads = threads
+        self.generation = 0
+        self._db = None
+        self._lock = threading.Lock()
+
+    # Generation of the export on disk, written last by DataPreprocessor.export_parquet
+    def _export_generation(self) -> int:
+        try:
+            with open(os.path.join(self.parquet_folder, "_generation")) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _database(self):
+        generation = self._export_generation()
+        with self._lock:
+            if self._db is None or generation != self.generation:
+                try:
+                    import duckdb
+                except ImportError as e:
+                    raise RuntimeError("QUERY_BACKEND=duckdb requires the duckdb package (pip install duckdb)") from e
+                db = duckdb.connect(":memory:", config={"threads": self.threads})
+                for table, key in SCOPED_TABLES.items():
+                    files = os.path.join(self.parquet_folder, table, "*.parquet").replace("'", "''")
+                    if self.store_id:
+                        db.execute(
+                            f"CREATE TABLE {table} AS SELECT * FROM read_parquet('{files}') WHERE {key} = ?",
+                            [self.store_id],
+                        )
+                    else:
+                        db.execute(f"CREATE TABLE {table} AS SELECT * FROM read_parquet('{files}')")
+                db.execute("SET enable_external_access = false")
+                db.execute("SET lock_configuration = true")
+                self._db, self.generation = db, generation
+            return self._db, self.generation
+
+    def raw_connection(self) -> _DuckDBRawConnection:
+        db, generation = self._database()
+        return _DuckDBRawConnection(db.cursor(), generation)
+
+    def read_generation(self) -> int:
+        return self._database()[1]
+
+
+# Merchant directory of a database file, one per path for the life of the process
+_directories = {}
+_directories_lock = threading.Lock()
+
+
+def get_merchant_directory(db_path: str = ORIGINAL_DB_PATH) -> MerchantDirectory:
+    with _directories_lock:
+        if db_path not in _directories:
+            _directories[db_path] = MerchantDirectory(db_path)
+        return _directories[db_path]
+
+
+# Looks up the store_id for a merchant name, or None when the name is unknown. Case, punctuation and
+# stray spaces are ignored ("LITTLE SWEET INC. " and "Little Sweet Inc" are the same merchant).
+def lookup_store_id(merchant_name: str, db_path: str = ORIGINAL_DB_PATH):
+    return get_merchant_directory(db_path).lookup(merchant_name)
+
+
+# Cache scope for a connection: the whole database for internal users, one store for merchants
+def scope_key(store_id: str = None) -> str:
+    return f"merchant:{store_id}" if store_id else "internal"
+
+
+# Store of a scope made by scope_key, or None for the internal scope
+def scope_store_id(scope: str):
+    return scope.split(":", 1)[1] if scope.startswith("merchant:") else None
+
+
+# Generation stamp written by DataPreprocessor; changes on every rebuild of the database. Read on the
+# connection that will run the query, so the stamp always describes the data the result comes from.
+def read_generation(engine, conn=None) -> int:
+    if isinstance(engine, DuckDBEngine):
+        return engine.read_generation()
+    if conn is not None:
+        return conn.execute("PRAGMA user_version").fetchone()[0] or 0
+    raw = engine.raw_connection()
+    try:
+        return read_generation(engine, raw.driver_connection)
+    finally:
+        raw.close()
+
+
+# Runs generated SQL, serving repeat queries for the same scope and database generation from the cache.
+# The generation is read on the connection checked out for the query (the pool has already recycled
+# it if the database was rebuilt), so a result is never cached under another generation than its own.
+def execute_query(sql: str, engine, scope: str) -> pd.DataFrame:
+    raw = engine.raw_connection()
+    try:
+        conn = raw.driver_connection
+        if isinstance(engine, DuckDBEngine):
+            generation, run_query = raw.generation, _run_guarded_duckdb_query
+        else:
+            generation, run_query = read_generation(engine, conn), _run_guarded_sqlite_query
+        key = (normalize_sql(sql), scope, generation)
+        df = result_cache.get(key)
+        tracing.record(result_cache_hit=df is not None)
+        if df is None:
+            df = run_query(sql, conn, QUERY_TIMEOUT_SECONDS, QUERY_ROW_LIMIT)
+            result_cache.put(key, df)
+    finally:
+        raw.close()
+    tracing.record(rows=len(df))
+    return df
+
+
+# Executes SQL with a wall-clock deadline (SQLite progress handler) and a row cap.
+# Rows are fetched in chunks so an oversized result stops early instead of being fully materialized.
+def run_guarded_query(sql: str, engine, timeout_seconds: float = None, max_rows: int = None) -> pd.DataFrame:
+    timeout_seconds = QUERY_TIMEOUT_SECONDS if timeout_seconds is None else timeout_seconds
+    max_rows = QUERY_ROW_LIMIT if max_rows is None else max_rows
+    run_query = _run_guarded_duckdb_query if isinstance(engine, DuckDBEngine) else _run_guarded_sqlite_query
+    raw = engine.raw_connection()
+    try:
+        return run_query(sql, raw.driver_connection, timeout_seconds, max_rows)
+    finally:
+        raw.close()
+
+
+# run_guarded_query on a checked-out SQLite connection
+def _run_guarded_sqlite_query(sql: str, conn, timeout_seconds: float, max_rows: int) -> pd.DataFrame:
+    # pandas would execute a PRAGMA or DROP before noticing it returns no rows, so only a single
+    # query gets that far
+    error = statement_error(sql)
+    if error:
+        raise PermissionError(error)
+    import pandas as pd
+    deadline = time.monotonic() + timeout_seconds
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, PROGRESS_HANDLER_STEPS)
+    chunks = []
+    rows = 0
+    try:
+        for chunk in pd.read_sql_query(sql, conn, chunksize=QUERY_CHUNK_ROWS):
+            rows += len(chunk)
+            if rows > max_rows:
+                raise QueryBudgetExceeded(
+                    f"Query returned more than {max_rows} rows. "
+                    "Aggregate the result or add a LIMIT clause."
+                )
+            chunks.append(chunk)
+    except QueryBudgetExceeded:
+        raise
+    except Exception as e:
+        if "interrupted" not in str(e):
+            raise
+        raise QueryBudgetExceeded(
+            f"Query exceeded the {timeout_seconds:g} second time budget and was interrupted. "
+            "Avoid cross joins and filter or aggregate earlier."
+        ) from e
+    finally:
+        conn.set_progress_handler(None, 0)
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+# DuckDB counterpart of run_guarded_query: a timer interrupts the cursor at the deadline and the
+# result is fetched in DuckDB's vector-sized chunks up to the row cap
+def _run_guarded_duckdb_query(sql: str, cursor, timeout_seconds: float, max_rows: int) -> pd.DataFrame:
+    import pandas as pd
+    timer = threading.Timer(timeout_seconds, cursor.interrupt)
+    timer.daemon = True
+    timer.start()
+    chunks = []
+    rows = 0
+    try:
+        # The in-memory copy is writable, so anything but a query is refused up front
+        for statement in cursor.extract_statements(sql):
+            if statement.type.name != "SELECT":
+                raise PermissionError("attempt to write a readonly database: only SELECT statements can run")
+        result = cursor.execute(sql)
+        while True:
+            chunk = result.fetch_df_chunk()
+            if chunks and chunk.empty:
+                break
+            rows += len(chunk)
+            if rows > max_rows:
+                raise QueryBudgetExceeded(
+                    f"Query returned more than {max_rows} rows. "
+                    "Aggregate the result or add a LIMIT clause."
+                )
+            chunks.append(chunk)
+            if chunk.empty:
+                break
+    except QueryBudgetExceeded:
+        raise
+    except Exception as e:
+        if "interrupt" not in str(e).lower():
+            raise
+        raise QueryBudgetExceeded(
+            f"Query exceeded the {timeout_seconds:g} second time budget and was interrupted. "
+            "Avoid cross joins and filter or aggregate earlier."
+        ) from e
+    finally:
+        timer.cancel()
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)
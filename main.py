@@ -1,17 +1,58 @@
 # Required libraries
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextvars
+import json
 import os
-from sqlalchemy import create_engine
-import pandas as pd
-from groq import Groq
-from langchain.memory import ConversationBufferWindowMemory
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING
+from cache import LLMResponseCache
+from conversation_memory import ConversationMemory
+from semantic_cache import SemanticQuestionCache
+from schema_retriever import SchemaRetriever
+from sql_validator import validate_sql
+from result_summary import cents_columns, compact_result_table, estimate_tokens, fast_path_summary
+import tracing
+from database import (
+    QUERY_BACKEND, create_scoped_engine, execute_query, get_merchant_directory, lookup_store_id, scope_key,
+    scope_store_id, sql_dialect,
+)
+from merchant_directory import MerchantDirectory, normalize_name
 
-# Schema description for SQLite. Used by the SQL‐generation LLM prompt.
-SCHEMA_DESCRIPTION = """
-(Note: Text in parentheses indicates “column_name (TYPE, brief‐description)”)
+# pandas and the Groq SDK are only needed once a question is asked: the SDK is imported when the
+# first completion is requested and pandas arrives with the first query result
+if TYPE_CHECKING:
+    import pandas as pd
+    from groq import RateLimitError
 
-Use **SQLite** syntax only. Do not use any MySQL‐specific functions
+# Dialect notes for the configured query backend (QUERY_BACKEND=sqlite|duckdb)
+DIALECT_NAMES = {"sqlite": "SQLite", "duckdb": "DuckDB"}
+DIALECT_NOTES = {
+    "sqlite": """Use **SQLite** syntax only. Do not use any MySQL‐specific functions
 such as `DATE_SUB`, `CURDATE()`, `DATE_FORMAT`. Instead, use
 `DATE('now', '-X days')`, `DATE('now')`, `strftime(…)`, etc.
+Timestamps are stored in UTC as 'YYYY-MM-DD HH:MM:SS.SSS' text. For day ranges and
+grouping by day, filter on o.created_date directly instead of wrapping created_at in DATE().""",
+    "duckdb": """Use **DuckDB** syntax only. Do not use MySQL‐ or SQLite‐specific functions
+such as `DATE_SUB`, `CURDATE()`, `DATE('now')` or `strftime(format, value)`. Instead, use
+`current_date - INTERVAL 7 DAY`, `current_date`, `date_trunc('month', …)`, `strftime(value, format)`, etc.
+Timestamps are stored in UTC as 'YYYY-MM-DD HH:MM:SS.SSS' text; CAST them AS TIMESTAMP before
+using date functions. For day ranges and grouping by day, filter on o.created_date directly.""",
+}
+SQL_DIALECT = DIALECT_NAMES.get(QUERY_BACKEND, "SQLite")
+
+# Schema description for the query backend. Used by the SQL‐generation LLM prompt.
+SCHEMA_DESCRIPTION = """
+(Note: Text in parentheses indicates “column_name (TYPE, brief‐description)”)
+
+""" + DIALECT_NOTES.get(QUERY_BACKEND, DIALECT_NOTES["sqlite"]) + """
 
 Tables:
 orders(
@@ -24,6 +65,8 @@ orders(
     discount_amount_in_cents (INTEGER, discount applied),
     delivery_fee_in_cents (INTEGER, fee charged for delivery),
     created_at (DATETIME, order creation timestamp),
+    created_epoch (INTEGER, order creation time in Unix seconds),
+    created_date (DATE, order creation day as 'YYYY-MM-DD'),
     updated_at (DATETIME, last update timestamp),
     fulfillment_type (ENUM: “pickup”|“delivery”|“curbside”),
     tip_amount_in_cents (INTEGER, tip given by customer),
@@ -34,7 +77,12 @@ orders(
     risk_level (INTEGER, fraud risk score: 0 = low, 1 = high),
     order_type (ENUM: “regular_checkout”|“store_credit_reload”|“gift_card”|“subscription_purchase”),
     perdiem_platform_fee_in_cents (INTEGER, PerDiem’s platform fee),
-    scheduled_fulfillment_at (DATETIME, scheduled pickup/delivery time)
+    scheduled_fulfillment_at (DATETIME, scheduled pickup/delivery time),
+    delivery_provider (STRING, courier provider from delivery_info, e.g. “doordash”; NULL for non-delivery orders),
+    delivery_provider_fee_in_cents (INTEGER, courier provider’s delivery fee from delivery_info),
+    delivery_pickup_address (STRING, pickup address from delivery_info),
+    delivery_dropoff_address (STRING, customer drop-off address from delivery_info),
+    delivered_at (DATETIME, delivery time from delivery_info)
 )
 customers(
     customer_id (UUID, primary key),
@@ -51,23 +99,59 @@ stores(
     delivery_fee (JSON, store’s base delivery fee settings),
     platform_fee (JSON, store’s platform fee settings),
     consumer_fee (JSON, consumer‐facing fees),
-    pre_sale (JSON, whether scheduled orders are allowed)
+    pre_sale (JSON, whether scheduled orders are allowed),
+    platform_fee_type (ENUM: “amount”|“percentage”, from platform_fee),
+    platform_fee_value (REAL, platform fee: cents when platform_fee_type = 'amount', percent when 'percentage'),
+    platform_fee_enabled (INTEGER, 1 if the platform fee is enabled),
+    platform_delivery_app_fee_in_cents (INTEGER, platform fee on delivery app orders),
+    base_delivery_fee_in_cents (INTEGER, store’s base delivery fee from delivery_fee),
+    delivery_fee_enabled (INTEGER, 1 if the delivery fee is enabled),
+    minimum_delivery_amount_in_cents (INTEGER, minimum order amount for delivery),
+    pre_sale_active (INTEGER, 1 if a pre-sale is active),
+    pre_sale_start_at (DATETIME, pre-sale start),
+    pre_sale_end_at (DATETIME, pre-sale end)
+)
+store_consumer_fees(
+    store_id (UUID, foreign key → stores.store_id),
+    fulfillment_type (ENUM: “pickup”|“delivery”|“booking”),
+    fee_type (ENUM: “amount”|“percentage”),
+    fee (REAL, consumer-facing fee: cents when fee_type = 'amount', percent when 'percentage'),
+    enabled_fee (INTEGER, 1 if the fee is charged),
+    enabled_waiver (INTEGER, 1 if the fee can be waived)
 )
+daily_store_metrics(
+    store_id (UUID, foreign key → stores.store_id),
+    date (DATE, order creation day as 'YYYY-MM-DD', same as orders.created_date),
+    fulfillment_type (ENUM: “pickup”|“delivery”|“curbside”|“unknown”),
+    order_count (INTEGER, number of orders),
+    revenue_in_cents (INTEGER, SUM of orders.total_amount_in_cents),
+    tip_amount_in_cents (INTEGER, SUM of orders.tip_amount_in_cents),
+    delivery_fee_in_cents (INTEGER, SUM of orders.delivery_fee_in_cents),
+    service_fee_in_cents (INTEGER, SUM of orders.service_fee_in_cents),
+    discount_amount_in_cents (INTEGER, SUM of orders.discount_amount_in_cents),
+    perdiem_platform_fee_in_cents (INTEGER, SUM of orders.perdiem_platform_fee_in_cents)
+)
+Prefer these flattened columns over json_extract() on the JSON columns.
+daily_store_metrics holds one pre-aggregated row per store, day and fulfillment type. Use it for
+order counts, revenue, tips, fees and fulfillment mix per day/week/month (SUM over its rows);
+query orders only for per-order details, customers, order_type or other filters it does not cover.
 """
 
+# Instructions that follow the (full or pruned) schema in the SQL-generation system prompt
+SQL_INSTRUCTIONS = (
+    f"Convert the user’s natural language request into a valid {SQL_DIALECT} query for this schema. "
+    "The model should treat any possible question—simple or complex—as valid. "
+    "Always refer to the conversation history to understand context or implied references, "
+    f"then match the intent to the available tables/columns and generate the appropriate {SQL_DIALECT} query. "
+    f"If the user’s question relies on prior turns, use that context to disambiguate and produce a correct {SQL_DIALECT} statement."
+    f"**Using {SQL_DIALECT} syntax only.** Return only one SQL statement (no extra commentary). "
+)
+
 # Few‐shot prompt examples for converting natural‐language to SQL.
 FEW_SHOT_SQL_PROMPT = [
     {
         "role": "system",
-        "content": (
-            f"{SCHEMA_DESCRIPTION}\n"
-            "Convert the user’s natural language request into a valid SQLite query for this schema. "
-            "The model should treat any possible question—simple or complex—as valid. "
-            "Always refer to the conversation history to understand context or implied references, "
-            "then match the intent to the available tables/columns and generate the appropriate SQLite query. "
-            "If the user’s question relies on prior turns, use that context to disambiguate and produce a correct SQLite statement."
-            "**Using SQLite syntax only.** Return only one SQL statement (no extra commentary). "
-        )
+        "content": f"{SCHEMA_DESCRIPTION}\n{SQL_INSTRUCTIONS}"
     },
     # Example: compare week1 vs week2 for a store
     {
@@ -78,10 +162,10 @@ FEW_SHOT_SQL_PROMPT = [
         "role": "assistant",
         "content": (
             "SELECT\n"
-            "  SUM(CASE WHEN DATE(o.created_at) BETWEEN '2025-03-01' AND '2025-03-07' THEN 1 ELSE 0 END) AS week1_count,\n"
-            "  SUM(CASE WHEN DATE(o.created_at) BETWEEN '2025-03-08' AND '2025-03-14' THEN 1 ELSE 0 END) AS week2_count\n"
-            "FROM orders AS o\n"
-            "JOIN stores AS s ON o.store_id = s.store_id\n"
+            "  SUM(CASE WHEN m.date BETWEEN '2025-03-01' AND '2025-03-07' THEN m.order_count ELSE 0 END) AS week1_count,\n"
+            "  SUM(CASE WHEN m.date BETWEEN '2025-03-08' AND '2025-03-14' THEN m.order_count ELSE 0 END) AS week2_count\n"
+            "FROM daily_store_metrics AS m\n"
+            "JOIN stores AS s ON m.store_id = s.store_id\n"
             "WHERE s.name = 'Migos Fine Foods';"
         )
     },
@@ -94,11 +178,11 @@ FEW_SHOT_SQL_PROMPT = [
         "role": "assistant",
         "content": (
             "SELECT\n"
-            "  ROUND(SUM(o.total_amount_in_cents) / 100.0, 2) AS total_revenue_in_cents\n"
-            "FROM orders AS o\n"
-            "JOIN stores AS s ON o.store_id = s.store_id\n"
+            "  ROUND(SUM(m.revenue_in_cents) / 100.0, 2) AS total_revenue_in_cents\n"
+            "FROM daily_store_metrics AS m\n"
+            "JOIN stores AS s ON m.store_id = s.store_id\n"
             "WHERE s.name = 'Tikka Shack'\n"
-            "  AND DATE(o.created_at) BETWEEN '2025-01-01' AND '2025-03-31';"
+            "  AND m.date BETWEEN '2025-01-01' AND '2025-03-31';"
         )
     },
     # Example: count pickup orders for a specific week
@@ -115,72 +199,144 @@ FEW_SHOT_SQL_PROMPT = [
             "JOIN stores AS s ON o.store_id = s.store_id\n"
             "WHERE s.name = 'Coffee Drip'\n"
             "  AND o.fulfillment_type = 'pickup'\n"
-            "  AND DATE(o.created_at) BETWEEN '2025-03-15' AND '2025-03-21';"
+            "  AND o.created_date BETWEEN '2025-03-15' AND '2025-03-21';"
         )
     }
 ]
 
-# Initialize the Groq client with the environment variable key
+# Prompt tokens the few-shot SQL examples add to every generation request (reported in the traces)
+FEW_SHOT_SQL_TOKENS = sum(estimate_tokens(message["content"]) for message in FEW_SHOT_SQL_PROMPT[1:])
+
+# Question-aware pruning of the schema and few-shot examples sent with SQL generation and fix prompts
+# (SCHEMA_PRUNING=false sends the full schema and all examples every time)
+SCHEMA_PRUNING = os.getenv("SCHEMA_PRUNING", "true").lower() in ("1", "true", "yes")
+schema_retriever = SchemaRetriever(SCHEMA_DESCRIPTION, list(zip(FEW_SHOT_SQL_PROMPT[1::2], FEW_SHOT_SQL_PROMPT[2::2])))
+SCHEMA_TOKENS = estimate_tokens(SCHEMA_DESCRIPTION)
+
+# Groq API key shared by every client the process creates
 api_key = os.getenv("GROQ_KEY")
-client = Groq(api_key=api_key)
 
-# Sends a natural‐language query to the LLM with few‐shot context and returns the generated SQLite query.
-def nl_to_sql(query: str, context_str: str) -> str:
+# Model and decoding settings shared by all prompts
+LLM_MODEL = "llama3-70b-8192"
+LLM_TEMPERATURE = 0.0
+LLM_MAX_TOKENS = 256
+
+# LLM requests in flight at once across all sessions and batch workers of the process
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+
+# Retries once the Groq SDK's own retries of a 429 are exhausted. The limit belongs to the API key, so a
+# rate-limited request pauses every caller in the process (batch workers, sessions) until it lifts.
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "5"))
+_rate_limit_until = 0.0
+_rate_limit_lock = threading.Lock()
+
+# Seconds to wait after a 429: the server's retry-after header, else exponential backoff with jitter
+def _rate_limit_delay(error: RateLimitError, attempt: int) -> float:
     try:
-        history_str = memory.load_memory_variables({})["history"]
-        messages = FEW_SHOT_SQL_PROMPT + [
-            {"role": "user", "content": f"Conversation memory so far: {history_str}"},
-            {"role": "user", "content": f"Context: {context_str}"},
-            {"role": "user", "content": query}
-        ]
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=messages,
-            temperature=0.0,
-            max_tokens=256
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        # Return a recognizable error string to help catch exception cases
-        return f"--ERROR IN nl_to_sql: {str(e)}"
+        delay = float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        delay = min(60.0, 2.0 ** attempt)
+    return delay + random.uniform(0, 0.25 * delay + 0.1)
+
+def _back_off(error: RateLimitError, attempt: int) -> None:
+    global _rate_limit_until
+    tracing.add(rate_limited=1)
+    with _rate_limit_lock:
+        _rate_limit_until = max(_rate_limit_until, time.monotonic() + _rate_limit_delay(error, attempt))
+
+# Seconds left before requests may resume (0 when not rate-limited)
+def _rate_limit_pause() -> float:
+    return max(0.0, _rate_limit_until - time.monotonic())
+
+# Schema text and few-shot messages for a question: pruned to the relevant tables, columns and examples
+# unless SCHEMA_PRUNING is off. Records the schema size and the tokens saved against the full prompt.
+def prompt_schema(question: str, with_examples: bool = True, stores: list = None):
+    if not SCHEMA_PRUNING:
+        schema_text, examples = SCHEMA_DESCRIPTION, FEW_SHOT_SQL_PROMPT[1:]
+    else:
+        schema_text, examples = schema_retriever.prune(question, stores)
+    schema_tokens = estimate_tokens(schema_text)
+    saved = SCHEMA_TOKENS - schema_tokens
+    if with_examples:
+        saved += FEW_SHOT_SQL_TOKENS - sum(estimate_tokens(message["content"]) for message in examples)
+    tracing.record(schema_tokens=schema_tokens, tokens_saved=saved)
+    return schema_text, examples
+
+# Context line naming the store_id of every store mentioned in the question (see
+# MerchantDirectory.resolve_mentions), so the SQL filters on store_id instead of matching stores.name
+def store_hint(stores: list = None) -> str:
+    if not stores:
+        return ""
+    ids = []
+    for _, _, name, store_ids in stores:
+        if len(store_ids) == 1:
+            ids.append(f"{name} = store_id '{store_ids[0]}'")
+        else:
+            ids.append(f"{name} = store_id IN ({', '.join(repr(store_id) for store_id in store_ids)})")
+    return f"\nStores named in the question: {'; '.join(ids)}. Filter on these store_id values, not on stores.name."
+
+# Builds the SQL-generation prompt: (pruned) schema and few-shot examples, memory, context and the question
+def build_sql_messages(query: str, context_str: str, memory: ConversationMemory, stores: list = None) -> list:
+    history_str = memory.render("sql")
+    schema_text, examples = prompt_schema(query, stores=stores)
+    tracing.record(
+        few_shot_tokens=sum(estimate_tokens(message["content"]) for message in examples),
+        memory_tokens=estimate_tokens(str(history_str)),
+    )
+    return [{"role": "system", "content": f"{schema_text}\n{SQL_INSTRUCTIONS}"}] + examples + [
+        {"role": "user", "content": f"Conversation memory so far: {history_str}"},
+        {"role": "user", "content": f"Context: {context_str}{store_hint(stores)}"},
+        {"role": "user", "content": query}
+    ]
+
+# Errors saying the query used something outside the pruned schema; their fix prompt gets the full one
+SCHEMA_MISS_ERRORS = ("no such column", "no such table", "does not exist", "not found", "unknown column")
 
-# If the initial SQL fails on SQLite, this function builds a prompt and runs it through the model to rectify the error
-def fix_sql_with_error(question: str, bad_sql: str, error_msg: str, context_str: str) -> str:
+# Builds the SQL-correction prompt from the failed SQL and its database error
+def build_fix_messages(question: str, bad_sql: str, error_msg: str, context_str: str,
+                       memory: ConversationMemory, stores: list = None) -> list:
+    history_str = memory.render("sql")
+    tracing.record(memory_tokens=estimate_tokens(str(history_str)))
+    if any(marker in str(error_msg).lower() for marker in SCHEMA_MISS_ERRORS):
+        schema_text = SCHEMA_DESCRIPTION
+        tracing.record(schema_tokens=SCHEMA_TOKENS, tokens_saved=0)
+    else:
+        schema_text, _ = prompt_schema(question, with_examples=False, stores=stores)
+    return [
+        {
+            "role": "system",
+            "content": (
+                f"{schema_text}\n"
+                f"One of your previously generated SQL statements failed on {SQL_DIALECT} with an error. "
+                f"Below is the user’s conversation history, original question, the SQL you provided, the {SQL_DIALECT} error message, "
+                "and the context (merchant or PerDiem internal user). "
+                f"Please correct the SQL to be valid {SQL_DIALECT} syntax and satisfy the original request. "
+                "Return only the corrected SQL statement (no commentary)."
+            )
+        },
+        {"role": "user", "content": f"Context: {context_str}{store_hint(stores)}"},
+        {
+            "role": "user",
+            "content": (
+                f"Conversation memory so far: {history_str}\n"
+                f"User question: {question}\n"
+                f"Bad SQL: {bad_sql}\n"
+                f"{SQL_DIALECT} error: {error_msg}"
+            )
+        }
+    ]
+
+# Pre-flight check of generated SQL against SCHEMA_DESCRIPTION and the live (scoped) database.
+# MySQL functions, misspelled columns/tables and a missing stores join are rewritten locally;
+# returns (sql, error_msg) where error_msg is None when the backend's EXPLAIN accepts the query.
+def preflight_sql(sql: str, engine):
+    raw = engine.raw_connection()
     try:
-        history_str = memory.load_memory_variables({})["history"]
-        
-        fix_prompt = [
-            {
-                "role": "system",
-                "content": (
-                    f"{SCHEMA_DESCRIPTION}\n"
-                    "One of your previously generated SQL statements failed on SQLite with an error. "
-                    "Below is the user’s conversation history, original question, the SQL you provided, the SQLite error message, "
-                    "and the context (merchant or PerDiem internal user). "
-                    "Please correct the SQL to be valid SQLite syntax and satisfy the original request. "
-                    "Return only the corrected SQL statement (no commentary)."
-                )
-            },
-            {"role": "user", "content": f"Context: {context_str}"},
-            {
-                "role": "user",
-                "content": (
-                    f"Conversation memory so far: {history_str}\n"
-                    f"User question: {question}\n"
-                    f"Bad SQL: {bad_sql}\n"
-                    f"SQLite error: {error_msg}"
-                )
-            }
-        ]
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=fix_prompt,
-            temperature=0.0,
-            max_tokens=256
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"--ERROR IN fix_sql_with_error: {str(e)}"
+        sql, error_msg, rewrites = validate_sql(sql, raw.driver_connection, SCHEMA_DESCRIPTION, sql_dialect(engine))
+    finally:
+        raw.close()
+    tracing.add(rewrites=len(rewrites))
+    return sql, error_msg
 
 # Few‐shot prompt examples for summarizing the SQL result.
 FEW_SHOT_SUMMARY_PROMPT = [
@@ -218,35 +374,30 @@ FEW_SHOT_SUMMARY_PROMPT = [
     }
 ]
 
-# Instantiate memory once per chatbot session.
-memory = ConversationBufferWindowMemory(return_messages=True, k=3)
-
-# ----------------------------------------------------------------------
-# Function: summarize_result
-#
-# - Builds the “result_content” string depending on df or error.
-# - Loads conversation memory and includes it in the prompt.
-# - Calls LLM to generate a summary (or marketing idea).
-# - Saves the Q→A pair into memory for future context.
-# ----------------------------------------------------------------------
-def summarize_result(question: str, sql_query: str, df: pd.DataFrame = None, error_msg: str = None, context_str: str = "") -> str:
+# Cents-denominated columns from the schema, used to format single-value answers in dollars
+CENTS_COLUMNS = cents_columns(SCHEMA_DESCRIPTION)
+
+# Builds the summarization prompt: the result (or error), memory, question and final SQL
+def build_summary_messages(question: str, sql_query: str, df: pd.DataFrame = None, error_msg: str = None,
+                           context_str: str = "", memory: ConversationMemory = None) -> list:
     # Build result_content from DataFrame or error
     if error_msg:
         result_content = f"Error executing SQL: {error_msg}"
     elif df is None or df.empty:
         result_content = "Result: no rows returned."
     else:
-        table_text = df.to_csv(index=False)
         if df.shape == (1, 1) and str(df.iat[0, 0]) in ("0", "0.0"):
             result_content = "Result: single value 0"
         else:
-            result_content = f"Result Table:\n{table_text}"
+            # Full table within the token budget, otherwise head/tail rows plus column aggregates
+            result_content = compact_result_table(df)
 
-    # Load past conversation history from memory
-    history_str = memory.load_memory_variables({})["history"]
+    # Load past questions and answer digests from memory
+    history_str = memory.render("summary") if memory is not None else "(none)"
+    tracing.record(memory_tokens=estimate_tokens(str(history_str)))
 
     # Build messages for summarization prompt
-    messages = FEW_SHOT_SUMMARY_PROMPT + [
+    return FEW_SHOT_SUMMARY_PROMPT + [
         {"role": "user", "content": f"Context: {context_str}"},
         {
             "role": "user",
@@ -259,95 +410,508 @@ def summarize_result(question: str, sql_query: str, df: pd.DataFrame = None, err
         }
     ]
 
-    # Call LLM for summary/insight/marketing suggestion
-    try:
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
+
+# Question answering for any number of concurrent sessions. The service owns what is shared by the
+# whole process: the Groq client, the on-disk completion cache, the paraphrase cache and a bounded
+# pool running every LLM request (at most LLM_CONCURRENCY at once, streams included) and the merchant
+# directory that resolves store names in questions. Everything that
+# belongs to one conversation (memory, scoped engine, scope and context string) is passed to each
+# call, so sessions never see each other's history.
+class QueryService:
+    def __init__(self, client=None, llm_cache: LLMResponseCache = None, semantic_cache: SemanticQuestionCache = None,
+                 llm_concurrency: int = LLM_CONCURRENCY, merchant_directory: MerchantDirectory = None):
+        self._client = client
+        self._client_lock = threading.Lock()
+        # On-disk cache of completions; requests are deterministic (temperature 0) so repeats skip the Groq call
+        self.llm_cache = llm_cache if llm_cache is not None else LLMResponseCache(
+            path=os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.db"),
+            ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000")),
+        )
+        # Local paraphrase cache: validated SQL is reused for similar questions that differ only in dates/store names
+        self.semantic_cache = semantic_cache if semantic_cache is not None else SemanticQuestionCache(
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+        )
+        self.llm_pool = ThreadPoolExecutor(max_workers=max(1, llm_concurrency), thread_name_prefix="llm")
+        self.merchant_directory = merchant_directory if merchant_directory is not None else get_merchant_directory()
+
+    # Groq client, built on first use so that starting the app does not wait for the SDK import
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from groq import Groq
+                    self._client = Groq(api_key=api_key)
+        return self._client
+
+    # Runs fn on the LLM pool in the caller's context, so its usage and retries land on the caller's trace
+    def _submit(self, fn, *args, **kwargs):
+        return self.llm_pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    # client.chat.completions.create with the process-wide rate-limit backoff (runs on the LLM pool)
+    def _create_completion(self, **request):
+        from groq import RateLimitError
+        for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+            time.sleep(_rate_limit_pause())
+            try:
+                return self.client.chat.completions.create(**request)
+            except RateLimitError as e:
+                if attempt == LLM_RATE_LIMIT_RETRIES:
+                    raise
+                _back_off(e, attempt)
+
+    # Cache key covering everything that determines a completion
+    def _completion_key(self, messages: list) -> str:
+        return self.llm_cache.make_key(
+            model=LLM_MODEL, messages=messages, temperature=LLM_TEMPERATURE, max_tokens=LLM_MAX_TOKENS
+        )
+
+    def _complete(self, messages: list) -> str:
+        response = self._create_completion(
+            model=LLM_MODEL,
             messages=messages,
-            temperature=0.0,
-            max_tokens=256
+            temperature=LLM_TEMPERATURE,
+            max_tokens=LLM_MAX_TOKENS
         )
-        summary = response.choices[0].message.content.strip()
-    except Exception as e:
-        summary = f"--ERROR IN summarize_result: {str(e)}"
+        tracing.record_usage(getattr(response, "usage", None))
+        return response.choices[0].message.content.strip()
+
+    # Sends the messages to the LLM, replaying the cached completion when the exact same request was seen before
+    def chat_completion(self, messages: list) -> str:
+        key = self._completion_key(messages)
+        cached = self.llm_cache.get(key)
+        if cached is not None:
+            tracing.add(llm_cache_hits=1)
+            return cached
+        content = self._submit(self._complete, messages).result()
+        self.llm_cache.put(key, content)
+        return content
 
-    # Save this question/summary pair into memory for future turns
-    memory.save_context({"user": question}, {"assistant": summary})
-    return summary
+    # Async counterpart of chat_completion: awaits the request running on the LLM pool
+    async def chat_completion_async(self, messages: list) -> str:
+        key = self._completion_key(messages)
+        cached = self.llm_cache.get(key)
+        if cached is not None:
+            tracing.add(llm_cache_hits=1)
+            return cached
+        content = await asyncio.wrap_future(self._submit(self._complete, messages))
+        self.llm_cache.put(key, content)
+        return content
 
+    # Streams the completion token by token; a cached completion is yielded in one piece. The stream is
+    # read on the LLM pool and handed to the event loop through a queue.
+    async def stream_chat_completion(self, messages: list):
+        key = self._completion_key(messages)
+        cached = self.llm_cache.get(key)
+        if cached is not None:
+            tracing.add(llm_cache_hits=1)
+            yield cached
+            return
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def hand_over(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # The consumer's event loop is gone; the rest of the stream is dropped
+                pass
+
+        def read_stream():
+            try:
+                stream = self._create_completion(
+                    model=LLM_MODEL,
+                    messages=messages,
+                    temperature=LLM_TEMPERATURE,
+                    max_tokens=LLM_MAX_TOKENS,
+                    stream=True
+                )
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        hand_over(delta)
+                    # Groq sends the token usage with the final chunk
+                    tracing.record_usage(getattr(getattr(chunk, "x_groq", None), "usage", None))
+                hand_over(None)
+            except Exception as e:
+                hand_over(e)
+
+        reader = self._submit(read_stream)
+        parts = []
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            parts.append(item)
+            yield item
+        await asyncio.wrap_future(reader)
+        self.llm_cache.put(key, "".join(parts).strip())
+
+    # Records SQL that executed successfully so paraphrased questions can reuse it without an LLM call
+    def remember_validated_sql(self, question: str, sql: str, context_str: str, stores: list = None):
+        self.semantic_cache.add(question, sql, context_str, stores)
+
+    # Store names mentioned in the question, resolved locally to their store_id values; a merchant
+    # session only resolves its own store. A missing or unreadable directory resolves nothing.
+    def resolve_stores(self, question: str, scope: str) -> list:
+        try:
+            stores = self.merchant_directory.resolve_mentions(question, scope_store_id(scope))
+        except sqlite3.Error:
+            stores = []
+        tracing.record(store_mentions=len(stores))
+        return stores
+
+    # Sends a natural‐language query to the LLM with few‐shot context and returns the generated SQL query.
+    def nl_to_sql(self, query: str, context_str: str, memory: ConversationMemory, stores: list = None) -> str:
+        try:
+            # A close paraphrase of an answered question reuses its SQL with the new literals filled in
+            cached_sql = self.semantic_cache.lookup(query, context_str, stores)
+            tracing.record(semantic_cache_hit=cached_sql is not None)
+            if cached_sql is not None:
+                return cached_sql
+            return self.chat_completion(build_sql_messages(query, context_str, memory, stores))
+        except Exception as e:
+            # Return a recognizable error string to help catch exception cases
+            return f"--ERROR IN nl_to_sql: {str(e)}"
+
+    # Async counterpart of nl_to_sql
+    async def nl_to_sql_async(self, query: str, context_str: str, memory: ConversationMemory,
+                              stores: list = None) -> str:
+        try:
+            cached_sql = self.semantic_cache.lookup(query, context_str, stores)
+            tracing.record(semantic_cache_hit=cached_sql is not None)
+            if cached_sql is not None:
+                return cached_sql
+            return await self.chat_completion_async(build_sql_messages(query, context_str, memory, stores))
+        except Exception as e:
+            return f"--ERROR IN nl_to_sql: {str(e)}"
+
+    # If the initial SQL fails on the database, this function builds a prompt and runs it through the model to rectify the error
+    def fix_sql_with_error(self, question: str, bad_sql: str, error_msg: str, context_str: str,
+                           memory: ConversationMemory, stores: list = None) -> str:
+        try:
+            return self.chat_completion(build_fix_messages(question, bad_sql, error_msg, context_str, memory, stores))
+        except Exception as e:
+            return f"--ERROR IN fix_sql_with_error: {str(e)}"
+
+    # Async counterpart of fix_sql_with_error
+    async def fix_sql_with_error_async(self, question: str, bad_sql: str, error_msg: str, context_str: str,
+                                       memory: ConversationMemory, stores: list = None) -> str:
+        try:
+            return await self.chat_completion_async(
+                build_fix_messages(question, bad_sql, error_msg, context_str, memory, stores)
+            )
+        except Exception as e:
+            return f"--ERROR IN fix_sql_with_error: {str(e)}"
+
+    # ----------------------------------------------------------------------
+    # Function: summarize_result
+    #
+    # - Answers trivial results (error, no rows, single value) with rules when the fast path is enabled.
+    # - Builds the “result_content” string depending on df or error (compacted past the token budget).
+    # - Loads conversation memory and includes it in the prompt.
+    # - Calls LLM to generate a summary (or marketing idea).
+    # - Saves the question, its SQL and an answer digest into memory for future context.
+    # ----------------------------------------------------------------------
+    def summarize_result(self, question: str, sql_query: str, df: pd.DataFrame = None, error_msg: str = None,
+                         context_str: str = "", memory: ConversationMemory = None) -> str:
+        # Trivial results (errors, no rows, a single value) are answered by rules without an LLM call
+        summary = fast_path_summary(question, sql_query, df, error_msg, CENTS_COLUMNS)
+        tracing.record(fast_path=summary is not None)
+        if summary is None:
+            # Call LLM for summary/insight/marketing suggestion
+            try:
+                summary = self.chat_completion(
+                    build_summary_messages(question, sql_query, df, error_msg, context_str, memory)
+                )
+            except Exception as e:
+                summary = f"--ERROR IN summarize_result: {str(e)}"
+
+        # Save this turn into memory for future turns (the SQL only when it ran)
+        if memory is not None:
+            memory.save_turn(question, None if error_msg else sql_query, summary)
+        return summary
+
+    # Streaming counterpart of summarize_result: yields the summary token by token, then saves it to memory
+    async def summarize_result_stream(self, question: str, sql_query: str, df: pd.DataFrame = None,
+                                      error_msg: str = None, context_str: str = "",
+                                      memory: ConversationMemory = None):
+        summary = fast_path_summary(question, sql_query, df, error_msg, CENTS_COLUMNS)
+        tracing.record(fast_path=summary is not None)
+        if summary is not None:
+            yield summary
+        else:
+            parts = []
+            try:
+                messages = build_summary_messages(question, sql_query, df, error_msg, context_str, memory)
+                async for token in self.stream_chat_completion(messages):
+                    parts.append(token)
+                    yield token
+                summary = "".join(parts).strip()
+            except Exception as e:
+                summary = f"--ERROR IN summarize_result: {str(e)}"
+                yield summary
+        if memory is not None:
+            memory.save_turn(question, None if error_msg else sql_query, summary)
+
+    # Async pipeline used by the Streamlit app: nl_to_sql → pre-flight → execute (→ fix loop) → streamed summary.
+    # Yields ("sql", sql), ("table", df) as soon as execution finishes, ("token", text) per summary token
+    # and finally ("done", summary). Blocking database work runs in a worker thread.
+    # Each stage is a span of the caller's active trace (see tracing.py).
+    async def answer_question_async(self, question: str, engine, scope: str, context_str: str,
+                                    memory: ConversationMemory, max_retries: int = 3):
+        with tracing.span("nl_to_sql"):
+            stores = self.resolve_stores(question, scope)
+            generated_sql = await self.nl_to_sql_async(question, context_str, memory, stores)
+        df_result = None
+        error_msg = None
+        if generated_sql.startswith("--ERROR"):
+            # If nl_to_sql itself failed, skip retries
+            error_msg = generated_sql
+        else:
+            attempt = 0
+            while attempt < max_retries:
+                with tracing.span("preflight"):
+                    generated_sql, error_msg = await asyncio.to_thread(preflight_sql, generated_sql, engine)
+                if error_msg is None:
+                    try:
+                        with tracing.span("execute"):
+                            df_result = await asyncio.to_thread(execute_query, generated_sql, engine, scope)
+                        break
+                    except Exception as e:
+                        error_msg = str(e)
+                attempt += 1
+                with tracing.span("fix_sql"):
+                    corrected_sql = await self.fix_sql_with_error_async(
+                        question, generated_sql, error_msg, context_str, memory, stores
+                    )
+                if corrected_sql.startswith("--ERROR"):
+                    break
+                generated_sql = corrected_sql
+            tracing.record(retries=attempt)
+
+            if error_msg is None and df_result is not None:
+                self.remember_validated_sql(question, generated_sql, context_str, stores)
+        tracing.record(failed=error_msg is not None)
+
+        yield "sql", generated_sql
+        if df_result is not None:
+            yield "table", df_result
+
+        parts = []
+        with tracing.span("summarize"):
+            async for token in self.summarize_result_stream(
+                question, generated_sql, df_result, error_msg, context_str, memory
+            ):
+                parts.append(token)
+                yield "token", token
+        yield "done", "".join(parts).strip()
+
+    # Full synchronous pipeline for one question: SQL generation, pre-flight, execution with the fix loop,
+    # then the summary. Returns (final_sql, df_result, error_msg, summary). Like the async pipeline, each
+    # stage is a span of the caller's active trace.
+    def answer_question(self, question: str, engine, scope: str, context_str: str, memory: ConversationMemory,
+                        max_retries: int = 3, verbose: bool = True):
+        # Generate raw SQL from user question, including context
+        with tracing.span("nl_to_sql"):
+            stores = self.resolve_stores(question, scope)
+            generated_sql = self.nl_to_sql(question, context_str, memory, stores)
+        if generated_sql.startswith("--ERROR"):
+            tracing.record(failed=True)
+            return generated_sql, None, generated_sql, generated_sql
+
+        # Try executing with retries
+        attempt = 0
+        df_result = None
+        error_msg = None
+
+        while attempt < max_retries:
+            # Rewrite deterministic problems locally; only what remains goes to the LLM fix loop
+            with tracing.span("preflight"):
+                generated_sql, error_msg = preflight_sql(generated_sql, engine)
+            if error_msg is None:
+                try:
+                    with tracing.span("execute"):
+                        df_result = execute_query(generated_sql, engine, scope)
+                    break
+                except Exception as e:
+                    error_msg = str(e)
+            attempt += 1
+            with tracing.span("fix_sql"):
+                corrected_sql = self.fix_sql_with_error(question, generated_sql, error_msg, context_str, memory, stores)
+            if corrected_sql.startswith("--ERROR"):
+                break
+            generated_sql = corrected_sql  # Set the corrected query for next retry
+            if verbose:
+                print(f"Retry attempt {attempt}: fixing SQL...")
+        tracing.record(retries=attempt, failed=error_msg is not None)
+
+        if error_msg is None and df_result is not None:
+            self.remember_validated_sql(question, generated_sql, context_str, stores)
+
+        # Summarize results (or error), passing context
+        with tracing.span("summarize"):
+            summary = self.summarize_result(question, generated_sql, df_result, error_msg, context_str, memory)
+        return generated_sql, df_result, error_msg, summary
+
+
+# Drives an async generator from synchronous code (e.g. st.write_stream) on a private event loop
+def iterate_sync(async_gen):
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_gen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(async_gen.aclose())
+        loop.close()
+
+
+# Console tracing options: per-question stage timings and an aggregate statistics file written on exit
+TRACE_CONSOLE = os.getenv("TRACE_CONSOLE", "False").lower() == "true"
+TRACE_STATS_PATH = os.getenv("TRACE_STATS_PATH", "")
 
 # main(): Launches a console‐based chatbot loop.
 def main(merchant_name: str, is_per_diem: bool):
-    # If merchant_name is provided, build a filtered database containing only that store's data
-    original_db_path = "Processed/dashboard_chatbot.db"
+    # If merchant_name is provided, scope the shared database to that store's rows through TEMP views
     if merchant_name:
-        # Load the original database into pandas DataFrames
-        original_engine = create_engine(f"sqlite:///{original_db_path}")
-        stores_df = pd.read_sql_query("SELECT * FROM stores WHERE name = ?", original_engine, params=(merchant_name,))
-        if stores_df.empty:
+        store_id = lookup_store_id(merchant_name)
+        if store_id is None:
             raise RuntimeError(f"No store found with name '{merchant_name}'")
-        store_id = stores_df.iloc[0]["store_id"]
-
-        # Filter orders and customers tables by store_id
-        orders_df = pd.read_sql_query("SELECT * FROM orders WHERE store_id = ?", original_engine, params=(store_id,))
-        customers_df = pd.read_sql_query("SELECT * FROM customers WHERE store_id = ?", original_engine, params=(store_id,))
-
-        # Write these filtered tables to a new SQLite file
-        filtered_db_path = "Processed/filtered_dashboard_chatbot.db"
-        if os.path.exists(filtered_db_path):
-            os.remove(filtered_db_path)
-        filtered_engine = create_engine(f"sqlite:///{filtered_db_path}")
-        stores_df.to_sql("stores", filtered_engine, index=False)
-        orders_df.to_sql("orders", filtered_engine, index=False)
-        customers_df.to_sql("customers", filtered_engine, index=False)
-
-        engine = create_engine(f"sqlite:///{filtered_db_path}")
+        engine = create_scoped_engine(store_id)
+        scope = scope_key(store_id)
         context_str = f"Serving for merchant: {merchant_name}"
     else:
-        # Per Diem user: use the full original database
-        engine = create_engine(f"sqlite:///{original_db_path}")
+        # Per Diem user: use the full original database (read-only)
+        engine = create_scoped_engine()
+        scope = scope_key()
         context_str = "Serving for PerDiem internal user"
+    service = QueryService()
+    memory = ConversationMemory()
 
     print("Chatbot is running. Type your question or 'exit' to quit.")
     while True:
         user_question = input("\nYou: ").strip()
         if not user_question or user_question.lower() == "exit":
+            stats = service.llm_cache.stats()
+            print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses")
+            if TRACE_STATS_PATH:
+                tracing.tracer.export_stats(TRACE_STATS_PATH)
+                print(f"Stage statistics written to {TRACE_STATS_PATH}")
             print("Goodbye!")
             break
 
-        # Generate raw SQL from user question, including context
-        generated_sql = nl_to_sql(user_question, context_str)
-        if generated_sql.startswith("--ERROR"):
-            print(f"\nAssistant: {generated_sql}")
-            continue
+        with tracing.tracer.trace(user_question, scope) as trace:
+            _, _, _, summary = service.answer_question(user_question, engine, scope, context_str, memory)
+        print(f"\nAssistant: {summary}")
+        if TRACE_CONSOLE:
+            stages = ", ".join(f"{name} {ms:.0f} ms" for name, ms in trace.stage_ms().items())
+            print(f"[{trace.total_ms:.0f} ms: {stages}]")
 
-        # Try executing with retries
-        MAX_RETRIES = 3
-        attempt = 0
-        df_result = None
-        error_msg = None
+# Worker threads answering batch questions concurrently (most of their time is spent waiting on the LLM)
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
 
-        while attempt < MAX_RETRIES:
-            try:
-                df_result = pd.read_sql_query(generated_sql, engine)
-                error_msg = None
-                break  
-            except Exception as e:
-                error_msg = str(e)
-                attempt += 1
-                corrected_sql = fix_sql_with_error(user_question, generated_sql, error_msg, context_str)
-                if corrected_sql.startswith("--ERROR"):
-                    break
-                generated_sql = corrected_sql  # Set the corrected query for next retry
-                print(f"Retry attempt {attempt}: fixing SQL...")
 
-        # Summarize results (or error), passing context
-        summary = summarize_result(user_question, generated_sql, df_result, error_msg, context_str)
-        print(f"\nAssistant: {summary}")
+# Answers one batch record on a worker thread; returns its output record. Questions are answered
+# independently and concurrently, so each gets a memory that keeps no turns.
+def _answer_batch_record(service: QueryService, line: int, record: dict, engine, scope: str, context_str: str) -> dict:
+    question = str(record.get("question", "")).strip()
+    with tracing.tracer.trace(question, scope) as trace:
+        sql, df_result, error_msg, summary = service.answer_question(
+            question, engine, scope, context_str, ConversationMemory(k=0), verbose=False
+        )
+    return {
+        "line": line,
+        "merchant": record.get("merchant") or "",
+        "question": question,
+        "sql": sql,
+        "answer": summary,
+        "error": error_msg,
+        "rows": None if df_result is None else json.loads(df_result.to_json(orient="records", date_format="iso")),
+        "duration_ms": trace.total_ms,
+    }
+
+
+# Batch mode: answers a JSONL file of {"merchant": ..., "question": ...} records (merchant empty for
+# internal questions) and writes one JSON line per record to output_path as answers complete.
+# Records are grouped by merchant (names compared like lookup_store_id does, ignoring case, punctuation
+# and spacing) so each scope is set up once; up to `workers` questions run at once.
+def run_batch(input_path: str, output_path: str, workers: int = BATCH_WORKERS, service: QueryService = None):
+    service = service or QueryService()
+    with open(input_path, encoding="utf-8") as f:
+        records = [(line, json.loads(text)) for line, text in enumerate(f, 1) if text.strip()]
+
+    # normalized merchant name -> (merchant name as first written, records)
+    groups = OrderedDict()
+    for line, record in records:
+        merchant_name = " ".join(str(record.get("merchant") or "").split())
+        groups.setdefault(normalize_name(merchant_name), (merchant_name, []))[1].append((line, record))
+
+    engines = []
+    done = 0
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool, open(output_path, "w", encoding="utf-8") as out:
+            futures = {}
+            for normalized, (merchant_name, items) in groups.items():
+                if normalized:
+                    store_id = lookup_store_id(merchant_name)
+                    if store_id is None:
+                        for line, record in items:
+                            out.write(json.dumps({
+                                "line": line, "merchant": merchant_name, "question": record.get("question", ""),
+                                "error": f"No store found with name '{merchant_name}'",
+                            }) + "\n")
+                            done += 1
+                            print(f"[{done}/{len(records)}] {merchant_name}: {record.get('question', '')} (error)")
+                        continue
+                    context_str = f"Serving for merchant: {merchant_name}"
+                else:
+                    store_id = None
+                    context_str = "Serving for PerDiem internal user"
+                engine = create_scoped_engine(store_id, pool_size=workers + 1)
+                engines.append(engine)
+                for line, record in items:
+                    future = pool.submit(
+                        _answer_batch_record, service, line, record, engine, scope_key(store_id), context_str
+                    )
+                    futures[future] = (line, merchant_name, record)
+
+            for future in as_completed(futures):
+                line, merchant_name, record = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"line": line, "merchant": merchant_name, "question": record.get("question", ""),
+                              "error": str(e)}
+                out.write(json.dumps(result, default=str) + "\n")
+                out.flush()
+                done += 1
+                status = "error" if result.get("error") else f"{result.get('duration_ms', 0):.0f} ms"
+                print(f"[{done}/{len(records)}] {merchant_name or 'internal'}: {result['question']} ({status})")
+    finally:
+        for engine in engines:
+            if hasattr(engine, "dispose"):
+                engine.dispose()
+    print(f"Answered {done} questions in {time.perf_counter() - start:.1f} s; results written to {output_path}")
+
 
 if __name__ == "__main__":
-    # Pass merchant_name AND set is_per_diem=False for a merchant
-    # Pass merchant_name="" AND is_per_diem=True for a Per Diem internal user
-    merchant_name = os.getenv("MERCHANT_NAME", "")
-    is_per_diem = os.getenv("IS_PER_DIEM", "False").lower() == "true"
-    main(merchant_name, is_per_diem)
+    parser = argparse.ArgumentParser(description="Per Diem DataQuery console chatbot")
+    parser.add_argument("--batch", metavar="JSONL", help="answer {merchant, question} records instead of chatting")
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSONL file for the batch answers")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="concurrent batch questions")
+    args = parser.parse_args()
+    if args.batch:
+        run_batch(args.batch, args.output, args.workers)
+    else:
+        # Pass merchant_name AND set is_per_diem=False for a merchant
+        # Pass merchant_name="" AND is_per_diem=True for a Per Diem internal user
+        merchant_name = os.getenv("MERCHANT_NAME", "")
+        is_per_diem = os.getenv("IS_PER_DIEM", "False").lower() == "true"
+        main(merchant_name, is_per_diem)
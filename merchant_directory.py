@@ -0,0 +1,220 @@
+import os
+import re
+import sqlite3
+import threading
+
+# Directory of merchant names built by DataPreprocessor from the stores table: one row per store with
+# its display name (whitespace collapsed) and normalized name, plus a trigram index for fuzzy search
+DIRECTORY_TABLE = "merchant_directory"
+TRIGRAM_TABLE = "merchant_trigrams"
+
+# Merchants offered by the typeahead search, and the share of the typed trigrams a name must contain
+MERCHANT_SEARCH_LIMIT = int(os.getenv("MERCHANT_SEARCH_LIMIT", "20"))
+MERCHANT_MATCH_THRESHOLD = float(os.getenv("MERCHANT_MATCH_THRESHOLD", "0.5"))
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_QUOTES = {"'": "'", '"': '"', "‘": "’", "“": "”"}
+_SENTENCE_END_RE = re.compile(r"[.!?:;]\W*$")
+
+# Everyday words that a store name made up only of ("My Business", "The Coffee Shop") is too likely to
+# mean something else in a question; such names are only resolved when quoted
+COMMON_NAME_WORDS = frozenset("""
+    a an the my our your their his her its this that these those i me we us you it of and or in on at to
+    for from with by all any best good great new old first last next little big local main
+    business company shop store stores restaurant cafe coffee kitchen bar grill house place market
+    food foods bakery deli pizza inc llc co ltd corp
+    order orders customer customers day week month year today revenue sales delivery pickup
+""".split())
+
+
+# Case, punctuation and spacing folded away: "LITTLE SWEET INC. " -> "little sweet inc"
+def normalize_name(name: str) -> str:
+    return " ".join(_WORD_RE.findall((name or "").casefold()))
+
+
+# Name as shown to users: surrounding and repeated whitespace removed
+def display_name(name: str) -> str:
+    return " ".join((name or "").split())
+
+
+# Trigrams of a normalized name, each word padded like PostgreSQL's pg_trgm ("  b", " ba", "bag", ...)
+def name_trigrams(normalized: str) -> set:
+    grams = set()
+    for word in normalized.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+# Whether some word of a mention is written with a capital, not counting the capital of a word that
+# starts a sentence ("Bagel Barn", "WAFFLE WORKS", but not "My business ..." at the start)
+def _capitalized(question: str, words: list) -> bool:
+    for start, end, _ in words:
+        text = question[start:end]
+        if _SENTENCE_END_RE.search(question[:start]) or not question[:start].strip():
+            text = text[1:]
+        if any(ch.isupper() for ch in text):
+            return True
+    return False
+
+
+# Merchant lookups for the app and the question pipeline: exact lookup by normalized name, typeahead
+# search over the trigram index and resolution of store names mentioned in a question. Names are held
+# in memory per database generation; a database built before the directory existed is served from
+# the stores table.
+class MerchantDirectory:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._generation = None
+        self._has_tables = False
+        # normalized name -> (display name, store ids); first word -> normalized names, longest first
+        self._names = {}
+        self._by_first_word = {}
+        # store id -> name shown in the typeahead, and that name normalized -> store id. Stores sharing
+        # a name get their id appended ("Bagel Barn (store 1a2b3c4d)") so each can be picked.
+        self._labels = {}
+        self._label_ids = {}
+
+    # Read-only connection to the shared database
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    # Reloads the names when the database generation changed since the last call
+    def _load(self, conn):
+        generation = conn.execute("PRAGMA user_version").fetchone()[0]
+        with self._lock:
+            if generation == self._generation:
+                return
+            self._has_tables = conn.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+                (DIRECTORY_TABLE, TRIGRAM_TABLE),
+            ).fetchone()[0] == 2
+            if self._has_tables:
+                rows = conn.execute(
+                    f"SELECT normalized_name, name, store_id FROM {DIRECTORY_TABLE} ORDER BY normalized_name, store_id"
+                ).fetchall()
+            else:
+                rows = [
+                    (normalize_name(name), display_name(name), store_id)
+                    for name, store_id in conn.execute(
+                        "SELECT name, store_id FROM stores WHERE name IS NOT NULL ORDER BY store_id"
+                    )
+                ]
+            names, store_names = {}, {}
+            for normalized, name, store_id in rows:
+                if normalized:
+                    names.setdefault(normalized, (name, []))[1].append(store_id)
+                    store_names[store_id] = name
+            by_first_word = {}
+            for normalized in sorted(names, key=len, reverse=True):
+                by_first_word.setdefault(normalized.split(" ", 1)[0], []).append(normalized)
+            labels = {}
+            for _, ids in names.values():
+                width = 8 if len({store_id[:8] for store_id in ids}) == len(ids) else max(map(len, ids))
+                for store_id in ids:
+                    name = store_names[store_id]
+                    labels[store_id] = name if len(ids) == 1 else f"{name} (store {store_id[:width]})"
+            self._names = {normalized: (name, tuple(ids)) for normalized, (name, ids) in names.items()}
+            self._by_first_word = by_first_word
+            self._labels = labels
+            self._label_ids = {normalize_name(label): store_id for store_id, label in labels.items()}
+            self._generation = generation
+
+    # store_id of a merchant name or typeahead entry, ignoring case, punctuation and spacing; for a bare
+    # name that several stores share, the lowest id. None when no store has it. Never guesses: a near
+    # miss is not a match.
+    def lookup(self, merchant_name: str):
+        conn = self._connect()
+        try:
+            self._load(conn)
+        finally:
+            conn.close()
+        normalized = normalize_name(merchant_name)
+        if normalized in self._label_ids:
+            return self._label_ids[normalized]
+        entry = self._names.get(normalized)
+        return entry[1][0] if entry else None
+
+    # Up to limit (typeahead name, store_id) pairs matching typed text, one per store, best first: names
+    # starting with it, then names containing it, then fuzzy matches sharing at least
+    # MERCHANT_MATCH_THRESHOLD of its trigrams (typos, missing words)
+    def search(self, text: str, limit: int = MERCHANT_SEARCH_LIMIT) -> list:
+        query = normalize_name(text)
+        if not query:
+            return []
+        grams = sorted(name_trigrams(query))
+        conn = self._connect()
+        try:
+            self._load(conn)
+            if self._has_tables:
+                placeholders = ", ".join("?" * len(grams))
+                rows = conn.execute(
+                    f"SELECT d.store_id, d.normalized_name, COUNT(*) AS shared, d.trigram_count "
+                    f"FROM {TRIGRAM_TABLE} AS t JOIN {DIRECTORY_TABLE} AS d ON d.store_id = t.store_id "
+                    f"WHERE t.trigram IN ({placeholders}) GROUP BY d.store_id",
+                    grams,
+                ).fetchall()
+            else:
+                rows = []
+                for normalized, (_, store_ids) in self._names.items():
+                    name_grams = name_trigrams(normalized)
+                    rows.extend(
+                        (store_id, normalized, len(name_grams & set(grams)), len(name_grams)) for store_id in store_ids
+                    )
+        finally:
+            conn.close()
+
+        ranked = {}
+        for store_id, normalized, shared, trigram_count in rows:
+            if normalized.startswith(query):
+                rank = 2
+            elif query in normalized:
+                rank = 1
+            elif shared >= MERCHANT_MATCH_THRESHOLD * len(grams):
+                rank = 0
+            else:
+                continue
+            ranked[store_id] = (-rank, -shared / (len(grams) + trigram_count - shared), normalized, store_id)
+        best = sorted((store_id for store_id in ranked if store_id in self._labels), key=ranked.get)
+        return [(self._labels[store_id], store_id) for store_id in best[:limit]]
+
+    # Merchant names mentioned in a question, as (start, end, display name, store ids) in question order.
+    # A mention is a run of words equal to a normalized name (the longest one that counts wins), widened
+    # to take in surrounding quotes. It only counts when quoted, or when written capitalized (beyond the
+    # capital that starts a sentence) and the name is not made up only of COMMON_NAME_WORDS: a store called
+    # "Delivery" is not found in "delivery orders", nor "My Business" in "how is my business doing".
+    # With store_id set (merchant sessions), only that store is resolved.
+    def resolve_mentions(self, question: str, store_id: str = None) -> list:
+        conn = self._connect()
+        try:
+            self._load(conn)
+        finally:
+            conn.close()
+        words = [(m.start(), m.end(), m.group(0).casefold()) for m in _WORD_RE.finditer(question)]
+        mentions = []
+        position = 0
+        while position < len(words):
+            # A rejected name does not hide a shorter one starting at the same word
+            length = 1
+            for normalized in self._by_first_word.get(words[position][2], []):
+                parts = normalized.split(" ")
+                if [word for _, _, word in words[position:position + len(parts)]] != parts:
+                    continue
+                start, end = words[position][0], words[position + len(parts) - 1][1]
+                quoted = start > 0 and end < len(question) and _QUOTES.get(question[start - 1]) == question[end]
+                name, store_ids = self._names[normalized]
+                mentioned = quoted or (
+                    _capitalized(question, words[position:position + len(parts)])
+                    and not set(parts) <= COMMON_NAME_WORDS
+                )
+                if mentioned and (store_id is None or store_id in store_ids):
+                    if quoted:
+                        start, end = start - 1, end + 1
+                    mentions.append((start, end, name, store_ids if store_id is None else (store_id,)))
+                    length = len(parts)
+                    break
+            position += length
+        return mentions
@@ -1,125 +1,842 @@
+import argparse
+import hashlib
+import json
 import os
 import re
+import time
 import pandas as pd
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 import sqlite3
+from merchant_directory import DIRECTORY_TABLE, TRIGRAM_TABLE, display_name, name_trigrams, normalize_name
+
+
+# Declared column types and primary keys for the generated dashboard_chatbot.db
+TABLE_SCHEMAS = {
+    "orders": [
+        ("order_id", "TEXT PRIMARY KEY"),
+        ("store_id", "TEXT NOT NULL"),
+        ("customer_id", "TEXT"),
+        ("external_location_id", "TEXT"),
+        ("external_order_id", "TEXT"),
+        ("total_amount_in_cents", "INTEGER"),
+        ("discount_amount_in_cents", "INTEGER"),
+        ("delivery_fee_in_cents", "INTEGER"),
+        ("created_at", "TEXT"),
+        ("created_epoch", "INTEGER"),
+        ("created_date", "TEXT"),
+        ("updated_at", "TEXT"),
+        ("fulfillment_type", "TEXT"),
+        ("tip_amount_in_cents", "INTEGER"),
+        ("service_fee_in_cents", "INTEGER"),
+        ("subscription_discounts_metadata", "TEXT"),
+        ("notes", "TEXT"),
+        ("delivery_info", "TEXT"),
+        ("risk_level", "INTEGER"),
+        ("order_type", "TEXT"),
+        ("perdiem_platform_fee_in_cents", "INTEGER"),
+        ("scheduled_fulfillment_at", "TEXT"),
+        ("delivery_provider", "TEXT"),
+        ("delivery_provider_fee_in_cents", "INTEGER"),
+        ("delivery_pickup_address", "TEXT"),
+        ("delivery_dropoff_address", "TEXT"),
+        ("delivered_at", "TEXT"),
+    ],
+    "customers": [
+        ("customer_id", "TEXT PRIMARY KEY"),
+        ("store_id", "TEXT NOT NULL"),
+        ("external_customer_id", "TEXT"),
+    ],
+    "stores": [
+        ("store_id", "TEXT PRIMARY KEY"),
+        ("external_store_id", "TEXT"),
+        ("name", "TEXT"),
+        ("active", "TEXT"),
+        ("created_at", "TEXT"),
+        ("updated_at", "TEXT"),
+        ("delivery_fee", "TEXT"),
+        ("platform_fee", "TEXT"),
+        ("consumer_fee", "TEXT"),
+        ("pre_sale", "TEXT"),
+        ("platform_fee_type", "TEXT"),
+        ("platform_fee_value", "REAL"),
+        ("platform_fee_enabled", "INTEGER"),
+        ("platform_delivery_app_fee_in_cents", "INTEGER"),
+        ("base_delivery_fee_in_cents", "INTEGER"),
+        ("delivery_fee_enabled", "INTEGER"),
+        ("minimum_delivery_amount_in_cents", "INTEGER"),
+        ("pre_sale_active", "INTEGER"),
+        ("pre_sale_start_at", "TEXT"),
+        ("pre_sale_end_at", "TEXT"),
+    ],
+}
+
+# Daily per-store rollup of the common order metrics, maintained by the preprocessor.
+# Weekly and monthly figures are sums over these rows.
+ROLLUP_TABLE = "daily_store_metrics"
+ROLLUP_COLUMNS = [
+    ("store_id", "TEXT NOT NULL", "o.store_id"),
+    ("date", "TEXT NOT NULL", "o.created_date"),
+    ("fulfillment_type", "TEXT NOT NULL", "COALESCE(o.fulfillment_type, 'unknown')"),
+    ("order_count", "INTEGER NOT NULL", "COUNT(*)"),
+    ("revenue_in_cents", "INTEGER", "SUM(o.total_amount_in_cents)"),
+    ("tip_amount_in_cents", "INTEGER", "SUM(o.tip_amount_in_cents)"),
+    ("delivery_fee_in_cents", "INTEGER", "SUM(o.delivery_fee_in_cents)"),
+    ("service_fee_in_cents", "INTEGER", "SUM(o.service_fee_in_cents)"),
+    ("discount_amount_in_cents", "INTEGER", "SUM(o.discount_amount_in_cents)"),
+    ("perdiem_platform_fee_in_cents", "INTEGER", "SUM(o.perdiem_platform_fee_in_cents)"),
+]
+ROLLUP_KEY = ("store_id", "date", "fulfillment_type")
+
+# Optional Parquet export for the DuckDB query backend: one folder per table, with the large tables
+# split into one file per month of this date column
+PARQUET_MONTH_COLUMNS = {"orders": "created_date", ROLLUP_TABLE: "date"}
+PARQUET_GENERATION_FILE = "_generation"
+# Schema-only file written for a month-partitioned table without rows, so that it can still be read
+PARQUET_EMPTY_FILE = "empty.parquet"
+# Parquet column types of empty exports, by declared SQLite type (everything else is text)
+PARQUET_EMPTY_DTYPES = {"INTEGER": "Int64", "REAL": "Float64"}
+
+# Merchant directory rebuilt from stores after every load (see merchant_directory.py): display and
+# normalized name per store, and the trigrams of each normalized name for the typeahead search
+MERCHANT_DIRECTORY_COLUMNS = [
+    ("store_id", "TEXT PRIMARY KEY"),
+    ("name", "TEXT NOT NULL"),
+    ("normalized_name", "TEXT NOT NULL"),
+    ("trigram_count", "INTEGER NOT NULL"),
+]
+MERCHANT_TRIGRAM_COLUMNS = [("trigram", "TEXT NOT NULL"), ("store_id", "TEXT NOT NULL")]
+
+# Frequently queried keys of the JSON-like columns, parsed once at ingest into the typed columns above:
+# (JSON column, key, target column)
+JSON_FIELDS = {
+    "orders": [
+        ("delivery_info", "courierProviderName", "delivery_provider"),
+        ("delivery_info", "providerDeliveryFee", "delivery_provider_fee_in_cents"),
+        ("delivery_info", "pickupAddress", "delivery_pickup_address"),
+        ("delivery_info", "dropoffAddress", "delivery_dropoff_address"),
+        ("delivery_info", "deliverAt", "delivered_at"),
+    ],
+    "stores": [
+        ("platform_fee", "type", "platform_fee_type"),
+        ("platform_fee", "fee", "platform_fee_value"),
+        ("platform_fee", "enabled_fee", "platform_fee_enabled"),
+        ("platform_fee", "delivery_app_fee_in_cents", "platform_delivery_app_fee_in_cents"),
+        ("delivery_fee", "fee", "base_delivery_fee_in_cents"),
+        ("delivery_fee", "enabled_fee", "delivery_fee_enabled"),
+        ("delivery_fee", "minimum_delivery_amount_in_cents", "minimum_delivery_amount_in_cents"),
+        ("pre_sale", "active", "pre_sale_active"),
+        ("pre_sale", "start_date", "pre_sale_start_at"),
+        ("pre_sale", "end_date", "pre_sale_end_at"),
+    ],
+}
+
+# Tables derived from the loaded tables with SQLite's JSON functions, refreshed after every load.
+# consumer_fee holds one object per fulfillment type ({"pickup": {...}, "delivery": {...}}).
+SIDE_TABLES = {
+    "store_consumer_fees": {
+        "columns": [
+            ("store_id", "TEXT NOT NULL"),
+            ("fulfillment_type", "TEXT NOT NULL"),
+            ("fee_type", "TEXT"),
+            ("fee", "REAL"),
+            ("enabled_fee", "INTEGER"),
+            ("enabled_waiver", "INTEGER"),
+        ],
+        "primary_key": "store_id, fulfillment_type",
+        "populate": (
+            "SELECT s.store_id, f.key, json_extract(f.value, '$.type'), json_extract(f.value, '$.fee'), "
+            "json_extract(f.value, '$.enabled_fee'), json_extract(f.value, '$.enabled_waiver') "
+            "FROM stores AS s, json_each(s.consumer_fee) AS f "
+            "WHERE json_valid(s.consumer_fee) AND f.type = 'object'"
+        ),
+    },
+}
+
+# Primary key of each table, used to keep only the latest copy of a record across monthly files
+TABLE_KEYS = {"orders": "order_id", "customers": "customer_id", "stores": "store_id"}
+
+# Indexes serving the merchant scope filter and the joins/date filters the LLM generates
+TABLE_INDEXES = {
+    "idx_orders_store_created": "orders(store_id, created_date)",
+    "idx_orders_customer": "orders(customer_id)",
+    "idx_customers_store": "customers(store_id)",
+    "idx_stores_name": "stores(name)",
+    "idx_stores_platform_fee_type": "stores(platform_fee_type)",
+    "idx_orders_delivery_provider": "orders(store_id, delivery_provider)",
+    "idx_merchant_directory_name": f"{DIRECTORY_TABLE}(normalized_name)",
+}
+
+# Timestamps are stored as UTC ISO-8601 text, which sorts and compares correctly as plain strings
+TIMESTAMP_COLUMNS = {
+    "orders": ["created_at", "updated_at", "scheduled_fulfillment_at", "delivered_at"],
+    "stores": ["created_at", "updated_at", "pre_sale_start_at", "pre_sale_end_at"],
+}
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Low-cardinality text columns held as pandas categoricals while cleaning
+CATEGORY_COLUMNS = {"orders": ["fulfillment_type", "order_type"]}
+
+# Integer columns with a tiny value range (risk_level is 0 or 1)
+SMALL_INT_COLUMNS = {"risk_level"}
+
+# Bookkeeping of raw files already loaded into the database, used by incremental ingestion.
+# Files are keyed by their resolved path, so same-named CSVs in different folders stay apart.
+MANIFEST_TABLE = "ingest_manifest"
+MANIFEST_SCHEMA = [
+    ("file_path", "TEXT PRIMARY KEY"),
+    ("table_name", "TEXT NOT NULL"),
+    ("size", "INTEGER NOT NULL"),
+    ("mtime", "REAL NOT NULL"),
+    ("sha256", "TEXT NOT NULL"),
+    ("ingested_at", "TEXT NOT NULL"),
+]
+
+# Rows read, cleaned and written per chunk when loading the fixed CSVs, which bounds peak memory
+LOAD_CHUNK_ROWS = 50000
+
+# Page size used for freshly built databases (must be set before the first table is created)
+DB_PAGE_SIZE = 8192
+
+# Approximate amount of text read, fixed and written per block by the comma pre-fixer
+PREFIX_BLOCK_CHARS = 4 * 1024 * 1024
+
+_BRACE_RE = re.compile(r"[{}]")
+
+
+# Reference implementation of the comma fix: walks the line character by character.
+# Kept for lines with unbalanced closing braces, whose output it defines.
+def _replace_commas_reference(line: str) -> str:
+    output = []
+    buffer = []
+    stack = 0
+    inside_json = False
+
+    for ch in line:
+        if ch == '{':
+            stack += 1
+            inside_json = True
+            buffer.append(ch)
+        elif ch == '}':
+            stack -= 1
+            buffer.append(ch)
+            if stack == 0:
+                inside_json = False
+                output.append("".join(buffer).replace(",", ";"))
+                buffer = []
+        elif inside_json:
+            buffer.append(ch)
+        else:
+            output.append(ch)
+
+    output.extend(buffer)
+    return "".join(output)
+
+
+# Replace commas inside nested JSON-like {...} structures with semicolons.
+# Jumps between braces with a regex and replaces whole top-level {...} spans at once; lines without
+# braces are returned untouched. Output is identical to _replace_commas_reference.
+def fix_json_commas(line: str) -> str:
+    if "{" not in line and "}" not in line:
+        return line
+    parts = []
+    depth = 0
+    start = 0
+    for match in _BRACE_RE.finditer(line):
+        if match.group(0) == "{":
+            if depth == 0:
+                parts.append(line[start:match.start()])
+                start = match.start()
+            depth += 1
+        else:
+            depth -= 1
+            if depth < 0:
+                return _replace_commas_reference(line)
+            if depth == 0:
+                parts.append(line[start:match.end()].replace(",", ";"))
+                start = match.end()
+    # An unclosed {... at the end of the line is kept as-is
+    parts.append(line[start:])
+    return "".join(parts)
+
+
+# Table a raw monthly file belongs to (orders_2025_3.csv -> orders), or None for unrelated files
+def table_for_file(file_name: str):
+    base = os.path.basename(file_name)
+    if base.startswith("fixed_"):
+        base = base[len("fixed_"):]
+    for table in TABLE_SCHEMAS:
+        if base == f"{table}.csv" or base.startswith(f"{table}_"):
+            return table
+    return None
+
+
+# Parses raw timestamps ("2025-04-17T22:54:03.747Z") as UTC; unparseable values become NaT
+def parse_timestamps(series: pd.Series) -> pd.Series:
+    return pd.to_datetime(series.str.strip(), utc=True, errors="coerce", format="ISO8601")
+
+
+# Formats parsed timestamps as "2025-04-17 22:54:03.747", the layout SQLite's date functions read natively
+def format_timestamps(parsed: pd.Series) -> pd.Series:
+    return parsed.dt.strftime(TIMESTAMP_FORMAT).str[:-3]
+
+
+# Parses one JSON-like field; anything that is not a JSON object counts as empty
+def load_json_object(text) -> dict:
+    if not isinstance(text, str):
+        return {}
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+# One key of a parsed JSON object; JSON booleans become 0/1 so they load as integers
+def json_field(value, key: str):
+    if not isinstance(value, dict):
+        return None
+    field = value.get(key)
+    return int(field) if isinstance(field, bool) else field
+
+
+# SHA-256 of a file, read in 1 MB blocks
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Pre-fixes one raw CSV in large blocks of whole lines (the fix never spans lines, so no state
+# is carried between blocks). Module-level so it can run in a worker process.
+def prefix_csv_file(csv_file: str, output_path: str) -> str:
+    with open(csv_file, "r", encoding="utf-8") as infile, \
+         open(output_path, "w", encoding="utf-8") as outfile:
+        while True:
+            lines = infile.readlines(PREFIX_BLOCK_CHARS)
+            if not lines:
+                break
+            outfile.write("".join(map(fix_json_commas, lines)))
+    return output_path
 
 
 class DataPreprocessor:
-    def __init__(self, input_folder="Raw", output_folder="Processed"):
+    def __init__(self, input_folder="Raw", output_folder="Processed", parquet_folder=None):
         self.input_folder = input_folder
         self.output_folder = output_folder
+        # When set, every build also writes the tables as Parquet here (see export_parquet)
+        self.parquet_folder = parquet_folder
         os.makedirs(self.output_folder, exist_ok=True)
 
         self.orders_json_cols = ["delivery_info", "subscription_discounts_metadata"]
         self.stores_json_cols = ["platform_fee", "delivery_fee", "pre_sale", "consumer_fee"]
         self.customers_json_cols = []
+        self.db_path = os.path.join(self.output_folder, "dashboard_chatbot.db")
+
+    # JSON-like columns whose commas were swapped for semicolons by the pre-fix stage
+    def json_columns(self, table: str):
+        return {
+            "orders": self.orders_json_cols,
+            "customers": self.customers_json_cols,
+            "stores": self.stores_json_cols,
+        }[table]
+
+    # Restore the commas the pre-fix stage replaced inside JSON-like fields
+    def restore_commas(self, df: pd.DataFrame, json_columns) -> pd.DataFrame:
+        for col in json_columns:
+            if col in df.columns:
+                df[col] = df[col].str.replace(";", ",", regex=False)
+        return df
+
+    # Materialize the JSON_FIELDS keys as columns, parsing each distinct JSON value only once
+    def flatten_json(self, table: str, df: pd.DataFrame) -> pd.DataFrame:
+        fields = JSON_FIELDS.get(table, [])
+        for json_column in dict.fromkeys(column for column, _, _ in fields):
+            if json_column not in df.columns:
+                continue
+            parsed = {text: load_json_object(text) for text in df[json_column].dropna().unique()}
+            objects = df[json_column].map(parsed)
+            for column, key, target in fields:
+                if column == json_column:
+                    df[target] = objects.map(lambda value: json_field(value, key))
+        return df
+
+    # Convert the raw text columns to the typed schema: nullable integers for cents and flags,
+    # categoricals for enums and normalized UTC timestamps (plus created_epoch/created_date on orders)
+    def apply_types(self, table: str, df: pd.DataFrame) -> pd.DataFrame:
+        for name, decl in TABLE_SCHEMAS[table]:
+            if name not in df.columns:
+                continue
+            if name in TIMESTAMP_COLUMNS.get(table, ()):
+                parsed = parse_timestamps(df[name])
+                df[name] = format_timestamps(parsed)
+                if table == "orders" and name == "created_at":
+                    df["created_epoch"] = ((parsed - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)).astype("Int64")
+                    df["created_date"] = parsed.dt.strftime("%Y-%m-%d")
+            elif name in CATEGORY_COLUMNS.get(table, ()):
+                df[name] = df[name].astype("category")
+            elif decl.startswith("INTEGER"):
+                numbers = pd.to_numeric(df[name], errors="coerce").round()
+                df[name] = numbers.astype("Int8" if name in SMALL_INT_COLUMNS else "Int64")
+            elif decl.startswith("REAL"):
+                df[name] = pd.to_numeric(df[name], errors="coerce")
+        return df
+
+    # Final cleanup and imputation for one table's rows
+    def clean_table(self, table: str, df: pd.DataFrame) -> pd.DataFrame:
+        if df.empty:
+            return df
+        df = self.apply_types(table, self.flatten_json(table, df))
+        if table == "orders":
+            if 'delivery_fee_in_cents' in df.columns:
+                df.loc[
+                    (
+                        df['fulfillment_type'].isin(['pickup', 'curbside']) |
+                        df['order_type'].isin(['store_credit_reload', 'gift_card', 'subscription_purchase'])
+                    ) & df['delivery_fee_in_cents'].isna(),
+                    'delivery_fee_in_cents'
+                ] = 0
+
+            df['subscription_discounts_metadata'] = df['subscription_discounts_metadata'].fillna('{}')
+            df['delivery_info'] = df['delivery_info'].fillna('{}')
+            df['notes'] = df['notes'].fillna('')
+            df['scheduled_fulfillment_at'] = df['scheduled_fulfillment_at'].fillna(df['created_at'])
+        elif table == "stores":
+            df['platform_fee'] = df['platform_fee'].fillna('{}')
+            df['consumer_fee'] = df['consumer_fee'].fillna('{}')
+        return df
 
     # Replace commas inside nested JSON-like {...} structures with semicolons
     def replace_commas_in_json_fields(self, line: str) -> str:
-        output = ""
-        buffer = ""
-        stack = 0
-        inside_json = False
-
-        for ch in line:
-            if ch == '{':
-                stack += 1
-                inside_json = True
-                buffer += ch
-            elif ch == '}':
-                stack -= 1
-                buffer += ch
-                if stack == 0:
-                    inside_json = False
-                    output += buffer.replace(",", ";")
-                    buffer = ""
-            elif inside_json:
-                buffer += ch
-            else:
-                output += ch
+        return fix_json_commas(line)
 
-        output += buffer
-        return output
-
-    # Preprocess all CSV files by replacing problematic commas and saving them
-    def preprocess_files(self):
+    # Preprocess all CSV files by replacing problematic commas and saving them.
+    # Files are handled in parallel by a process pool (workers=1 keeps everything in-process).
+    def preprocess_files(self, workers: int = None):
         all_csvs = glob(os.path.join(self.input_folder, "*.csv"))
-        for csv_file in all_csvs:
-            file_name = os.path.basename(csv_file)
-            output_path = os.path.join(self.output_folder, f"fixed_{file_name}")
+        jobs = [
+            (csv_file, os.path.join(self.output_folder, f"fixed_{os.path.basename(csv_file)}"))
+            for csv_file in all_csvs
+        ]
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        if workers <= 1:
+            results = (prefix_csv_file(csv_file, output_path) for csv_file, output_path in jobs)
+            for (csv_file, _), output_path in zip(jobs, results):
+                print(f"Processed: {os.path.basename(csv_file)} → {output_path}")
+            return
 
-            with open(csv_file, "r", encoding="utf-8") as infile, \
-                 open(output_path, "w", encoding="utf-8") as outfile:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(prefix_csv_file, csv_file, output_path) for csv_file, output_path in jobs]
+            for (csv_file, _), future in zip(jobs, futures):
+                print(f"Processed: {os.path.basename(csv_file)} → {future.result()}")
 
-                for line in infile:
-                    fixed_line = self.replace_commas_in_json_fields(line)
-                    outfile.write(fixed_line)
+    # Stream the fixed CSVs into a fresh database, restoring commas and cleaning chunk by chunk.
+    # Duplicates across monthly files are resolved by the primary keys during the upsert, so no
+    # table is ever held in memory as a whole.
+    def clean_and_save_all(self):
+        db_path = self.db_path
+        generation = self.read_generation(db_path) + 1
 
-            print(f"Processed: {file_name} → {output_path}")
+        # Rebuild from scratch so the page size applies; bulk load first, index afterwards. The new
+        # database is built next to the live one and swapped in whole, so readers never see a partial
+        # build and pooled connections can tell the file was replaced (see database.connect_scoped).
+        build_path = db_path + ".build"
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(build_path + suffix):
+                os.remove(build_path + suffix)
+        conn = sqlite3.connect(build_path)
+        conn.execute(f"PRAGMA page_size = {DB_PAGE_SIZE}")
+        # A failed build is simply rerun, so the load does not need to survive a crash
+        conn.execute("PRAGMA synchronous = OFF")
+        self.create_tables(conn)
 
-    # Load cleaned CSVs, restore commas, and apply final cleanup and imputation
-    def clean_and_save_all(self):
-        fixed_folder = self.output_folder
-        def load_and_restore_commas(files, json_columns):
-            dfs = []
-            for file in files:
-                try:
-                    df = pd.read_csv(file, dtype=str)
-                    for col in json_columns:
-                        if col in df.columns:
-                            df[col] = df[col].str.replace(";", ",", regex=False)
-                    dfs.append(df)
-                except Exception as e:
-                    print(f"Error reading {file}: {e}")
-            if dfs:
-                return pd.concat(dfs, ignore_index=True).drop_duplicates()
-            return pd.DataFrame()
-
-        orders_files = glob(os.path.join(self.output_folder, "fixed_orders_*.csv"))
-        customers_files = glob(os.path.join(self.output_folder, "fixed_customers_*.csv"))
-        stores_files = glob(os.path.join(self.output_folder, "fixed_stores_*.csv")) + \
-                       [os.path.join(self.output_folder, "fixed_stores.csv")]
-
-        orders_df = load_and_restore_commas(orders_files, self.orders_json_cols)
-        customers_df = load_and_restore_commas(customers_files, self.customers_json_cols)
-        stores_df = load_and_restore_commas(stores_files, self.stores_json_cols)
-
-        if 'delivery_fee_in_cents' in orders_df.columns:
-            orders_df.loc[
-                (
-                    orders_df['fulfillment_type'].isin(['pickup', 'curbside']) |
-                    orders_df['order_type'].isin(['store_credit_reload', 'gift_card', 'subscription_purchase'])
-                ) & orders_df['delivery_fee_in_cents'].isna(),
-                'delivery_fee_in_cents'
-            ] = 0
-
-        orders_df['subscription_discounts_metadata'] = orders_df['subscription_discounts_metadata'].fillna('{}')
-        orders_df['delivery_info'] = orders_df['delivery_info'].fillna('{}')
-        orders_df['notes'] = orders_df['notes'].fillna('')
-        orders_df['scheduled_fulfillment_at'] = orders_df['scheduled_fulfillment_at'].fillna(orders_df['created_at'])
-
-        stores_df['platform_fee'] = stores_df['platform_fee'].fillna('{}')
-        stores_df['consumer_fee'] = stores_df['consumer_fee'].fillna('{}')
-
-        orders_df.to_csv(os.path.join(self.output_folder, "cleaned_orders.csv"), index=False)
-        customers_df.to_csv(os.path.join(self.output_folder, "cleaned_customers.csv"), index=False)
-        stores_df.to_csv(os.path.join(self.output_folder, "cleaned_stores.csv"), index=False)
+        fixed_files = sorted(glob(os.path.join(self.output_folder, "fixed_*.csv")))
+        for table in TABLE_SCHEMAS:
+            for fixed_path in fixed_files:
+                if table_for_file(fixed_path) == table:
+                    try:
+                        self.load_file(conn, table, fixed_path)
+                    except Exception as e:
+                        print(f"Error reading {fixed_path}: {e}")
 
+        self.refresh_side_tables(conn)
+        self.refresh_merchant_directory(conn)
+        self.refresh_rollups(conn)
+        self.tune_database(conn, generation)
+        # Everything currently in the raw folder is now loaded; incremental runs start from here
+        for raw_file in glob(os.path.join(self.input_folder, "*.csv")):
+            if table_for_file(raw_file):
+                self.record_manifest(conn, raw_file)
+        conn.commit()
+        conn.execute("PRAGMA synchronous = NORMAL")
+
+        self.export_cleaned_csvs(conn)
+        if self.parquet_folder:
+            self.export_parquet(conn)
+        # Fold the WAL back into the file so the build moves as a single file
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+        self.replace_database(build_path, db_path)
+
+        print(f"Loaded all tables into SQLite DB at {db_path} (generation {generation})")
+
+    # Load one fixed CSV into its table in LOAD_CHUNK_ROWS chunks, one transaction per chunk.
+    # For orders, the (store_id, created_date) pairs written are added to touched_days when given, together
+    # with the pairs the replaced orders had before, in case an update moved an order to another day or store.
+    def load_file(self, conn, table: str, fixed_path: str, touched_days: set = None) -> int:
+        rows = 0
+        for chunk in pd.read_csv(fixed_path, dtype=str, chunksize=LOAD_CHUNK_ROWS):
+            chunk = self.clean_table(table, self.restore_commas(chunk, self.json_columns(table)))
+            track_days = touched_days is not None and table == "orders" and not chunk.empty
+            if track_days:
+                touched_days.update(self.stored_days(conn, chunk["order_id"].dropna().tolist()))
+            self.upsert(conn, table, chunk)
+            conn.commit()
+            rows += len(chunk)
+            if track_days:
+                touched_days.update(chunk[["store_id", "created_date"]].dropna().itertuples(index=False, name=None))
+        return rows
+
+    # (store_id, created_date) pairs currently stored for the given order ids
+    def stored_days(self, conn, order_ids: list) -> set:
+        days = set()
+        for start in range(0, len(order_ids), 500):
+            batch = order_ids[start:start + 500]
+            days.update(conn.execute(
+                "SELECT store_id, created_date FROM orders WHERE created_date IS NOT NULL AND store_id IS NOT NULL "
+                f"AND order_id IN ({', '.join('?' for _ in batch)})",
+                batch,
+            ).fetchall())
+        return days
+
+    # Write cleaned_<table>.csv from the deduplicated tables, streaming in chunks
+    def export_cleaned_csvs(self, conn):
+        for table in TABLE_SCHEMAS:
+            output_path = os.path.join(self.output_folder, f"cleaned_{table}.csv")
+            chunks = pd.read_sql_query(f"SELECT * FROM {table}", conn, chunksize=LOAD_CHUNK_ROWS)
+            for position, chunk in enumerate(chunks):
+                chunk.to_csv(output_path, mode="w" if position == 0 else "a", header=position == 0, index=False)
         print("All cleaned files saved successfully!")
-        
-        db_path = os.path.join(fixed_folder, "dashboard_chatbot.db")
-        conn = sqlite3.connect(db_path)
-        orders_df.to_sql("orders", conn, if_exists="replace", index=False)
-        customers_df.to_sql("customers", conn, if_exists="replace", index=False)
-        stores_df.to_sql("stores", conn, if_exists="replace", index=False)
+
+    # Incremental mode: only new or changed raw files are pre-fixed, cleaned and upserted into the
+    # existing tables, so the cost scales with the new data rather than with the full history.
+    def ingest_incremental(self):
+        if not os.path.exists(self.db_path):
+            print("No existing database; running a full build instead.")
+            self.preprocess_files()
+            self.clean_and_save_all()
+            return
+
+        conn = sqlite3.connect(self.db_path)
+        if not self.schema_matches(conn):
+            conn.close()
+            print("Existing database predates the current table schema; running a full build instead.")
+            self.preprocess_files()
+            self.clean_and_save_all()
+            return
+
+        self.create_manifest(conn)
+        changed = 0
+        touched_days = set()
+        for raw_file in sorted(glob(os.path.join(self.input_folder, "*.csv"))):
+            table = table_for_file(raw_file)
+            if table is None or not self.needs_ingest(conn, raw_file):
+                continue
+            fixed_path = prefix_csv_file(
+                raw_file, os.path.join(self.output_folder, f"fixed_{os.path.basename(raw_file)}")
+            )
+            rows = self.load_file(conn, table, fixed_path, touched_days)
+            self.record_manifest(conn, raw_file)
+            conn.commit()
+            changed += 1
+            print(f"Ingested: {os.path.basename(raw_file)} → {table} ({rows} rows)")
+
+        if changed:
+            self.refresh_side_tables(conn)
+            self.refresh_merchant_directory(conn)
+            self.refresh_rollups(conn, touched_days)
+            generation = conn.execute("PRAGMA user_version").fetchone()[0] + 1
+            conn.execute("PRAGMA optimize")
+            conn.execute(f"PRAGMA user_version = {generation}")
+            conn.commit()
+            if self.parquet_folder:
+                # Only the months that received orders are rewritten
+                exported = os.path.exists(os.path.join(self.parquet_folder, PARQUET_GENERATION_FILE))
+                self.export_parquet(conn, {date[:7] for _, date in touched_days} if exported else None)
+            print(f"Incremental load of {changed} file(s) done (generation {generation})")
+        else:
+            print("No new or changed files to ingest.")
         conn.close()
 
-        print(f"Loaded all tables into SQLite DB at {db_path}")
+    # Write every table as Parquet for the DuckDB backend (requires pyarrow). Monthly tables are written
+    # one month at a time, so memory stays bounded; months limits the rewrite to those 'YYYY-MM' months.
+    # Rows are sorted by store_id so a merchant's rows can be found from the row-group statistics.
+    def export_parquet(self, conn, months: set = None):
+        tables = list(TABLE_SCHEMAS) + list(SIDE_TABLES) + [ROLLUP_TABLE]
+        for table in tables:
+            folder = os.path.join(self.parquet_folder, table)
+            os.makedirs(folder, exist_ok=True)
+            date_column = PARQUET_MONTH_COLUMNS.get(table)
+            if date_column is None:
+                df = pd.read_sql_query(f"SELECT * FROM {table} ORDER BY store_id", conn, dtype_backend="numpy_nullable")
+                if df.empty:
+                    df = self.empty_frame(conn, table)
+                df.to_parquet(os.path.join(folder, f"{table}.parquet"), index=False)
+                continue
+
+            all_months = [row[0] for row in conn.execute(
+                f"SELECT DISTINCT substr({date_column}, 1, 7) FROM {table} WHERE {date_column} IS NOT NULL"
+            )]
+            if months is None:
+                # Full export: drop files of months that no longer exist
+                for stale in set(glob(os.path.join(folder, "*.parquet"))) - {
+                    os.path.join(folder, f"{month}.parquet") for month in all_months
+                }:
+                    os.remove(stale)
+            undated_path = os.path.join(folder, "undated.parquet")
+            undated = pd.read_sql_query(
+                f"SELECT * FROM {table} WHERE {date_column} IS NULL ORDER BY store_id", conn,
+                dtype_backend="numpy_nullable",
+            )
+            if not undated.empty:
+                undated.to_parquet(undated_path, index=False)
+            elif os.path.exists(undated_path):
+                os.remove(undated_path)
+            for month in sorted(all_months if months is None else set(all_months) & set(months)):
+                df = pd.read_sql_query(
+                    f"SELECT * FROM {table} WHERE substr({date_column}, 1, 7) = ? ORDER BY store_id",
+                    conn, params=(month,), dtype_backend="numpy_nullable",
+                )
+                df.to_parquet(os.path.join(folder, f"{month}.parquet"), index=False)
+            # A table without rows has no month files; a typed schema-only file stands in for them
+            empty_path = os.path.join(folder, PARQUET_EMPTY_FILE)
+            if set(glob(os.path.join(folder, "*.parquet"))) - {empty_path}:
+                if os.path.exists(empty_path):
+                    os.remove(empty_path)
+            else:
+                self.empty_frame(conn, table).to_parquet(empty_path, index=False)
+
+        # The DuckDB backend reports this as the database generation
+        generation = conn.execute("PRAGMA user_version").fetchone()[0]
+        with open(os.path.join(self.parquet_folder, PARQUET_GENERATION_FILE), "w") as f:
+            f.write(str(generation))
+        print(f"Exported Parquet files to {self.parquet_folder} (generation {generation})")
+
+    # Zero-row frame with the table's columns, typed after their declared SQLite types
+    def empty_frame(self, conn, table: str) -> pd.DataFrame:
+        return pd.DataFrame({
+            name: pd.Series(dtype=PARQUET_EMPTY_DTYPES.get((declared or "").split(" ")[0].upper(), "string"))
+            for _, name, declared, *_ in conn.execute(f"PRAGMA table_info({table})")
+        })
+
+    # Insert or update rows keyed on the table's primary key; a row only replaces an existing one
+    # when it is at least as recent (by updated_at) as what is stored
+    def upsert(self, conn, table: str, df: pd.DataFrame):
+        if df.empty:
+            return
+        key = TABLE_KEYS[table]
+        columns = [name for name, _ in TABLE_SCHEMAS[table] if name in df.columns]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != key)
+        sql = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT({key}) DO UPDATE SET {updates}"
+        )
+        if "updated_at" in columns:
+            sql += f" WHERE {table}.updated_at IS NULL OR excluded.updated_at >= {table}.updated_at"
+        rows = df[columns].dropna(subset=[key]).astype(object)
+        rows = rows.where(rows.notna(), None)
+        conn.executemany(sql, rows.itertuples(index=False, name=None))
+
+    # Recompute daily_store_metrics: every row after a full build, or only the (store_id, date) pairs in
+    # touched_days after an incremental load. Each pair is re-aggregated from orders as a whole, so
+    # updated orders never leave stale totals behind.
+    def refresh_rollups(self, conn, touched_days: set = None):
+        columns = ", ".join(name for name, _, _ in ROLLUP_COLUMNS)
+        select = (
+            f"SELECT {', '.join(expression for _, _, expression in ROLLUP_COLUMNS)} FROM orders AS o"
+        )
+        group_by = "GROUP BY o.store_id, o.created_date, COALESCE(o.fulfillment_type, 'unknown')"
+        if touched_days is None:
+            conn.execute(f"DELETE FROM {ROLLUP_TABLE}")
+            conn.execute(f"INSERT INTO {ROLLUP_TABLE} ({columns}) {select} WHERE o.created_date IS NOT NULL {group_by}")
+        elif touched_days:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS rollup_days (store_id TEXT, date TEXT, PRIMARY KEY (store_id, date))")
+            conn.execute("DELETE FROM temp.rollup_days")
+            conn.executemany("INSERT OR IGNORE INTO temp.rollup_days VALUES (?, ?)", sorted(touched_days))
+            conn.execute(
+                f"DELETE FROM {ROLLUP_TABLE} WHERE (store_id, date) IN (SELECT store_id, date FROM temp.rollup_days)"
+            )
+            conn.execute(
+                f"INSERT INTO {ROLLUP_TABLE} ({columns}) {select} "
+                "JOIN temp.rollup_days AS d ON o.store_id = d.store_id AND o.created_date = d.date "
+                f"{group_by}"
+            )
+        conn.commit()
+
+    # True when every table in the database has the columns of TABLE_SCHEMAS, SIDE_TABLES and the rollup
+    def schema_matches(self, conn) -> bool:
+        expected = dict(TABLE_SCHEMAS)
+        expected.update({table: spec["columns"] for table, spec in SIDE_TABLES.items()})
+        expected[ROLLUP_TABLE] = [(name, decl) for name, decl, _ in ROLLUP_COLUMNS]
+        expected[DIRECTORY_TABLE] = MERCHANT_DIRECTORY_COLUMNS
+        expected[TRIGRAM_TABLE] = MERCHANT_TRIGRAM_COLUMNS
+        for table, columns in expected.items():
+            existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            if existing != [name for name, _ in columns]:
+                return False
+        return True
+
+    # Create the manifest table on first use (databases built before it existed have none). Manifests
+    # keyed by file name, which always named files in the raw folder, are rekeyed by resolved path.
+    def create_manifest(self, conn):
+        column_sql = ", ".join(f"{name} {decl}" for name, decl in MANIFEST_SCHEMA)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} ({column_sql})")
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({MANIFEST_TABLE})")]
+        if "file_name" in columns:
+            conn.execute(f"ALTER TABLE {MANIFEST_TABLE} RENAME COLUMN file_name TO file_path")
+            for (name,) in conn.execute(f"SELECT file_path FROM {MANIFEST_TABLE}").fetchall():
+                conn.execute(
+                    f"UPDATE {MANIFEST_TABLE} SET file_path = ? WHERE file_path = ?",
+                    (os.path.realpath(os.path.join(self.input_folder, name)), name)
+                )
+            conn.commit()
+
+    # A file needs ingesting when it is not in the manifest or its content changed.
+    # Size and mtime are checked first so unchanged files are never hashed.
+    def needs_ingest(self, conn, raw_file: str) -> bool:
+        row = conn.execute(
+            f"SELECT size, mtime, sha256 FROM {MANIFEST_TABLE} WHERE file_path = ?",
+            (os.path.realpath(raw_file),)
+        ).fetchone()
+        if row is None:
+            return True
+        stat = os.stat(raw_file)
+        if row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return False
+        if row[0] == stat.st_size and row[2] == file_sha256(raw_file):
+            # Touched but identical: remember the new mtime and skip it
+            conn.execute(
+                f"UPDATE {MANIFEST_TABLE} SET mtime = ? WHERE file_path = ?",
+                (stat.st_mtime, os.path.realpath(raw_file))
+            )
+            return False
+        return True
+
+    # Remember a raw file's size, mtime and content hash once its rows are loaded
+    def record_manifest(self, conn, raw_file: str):
+        self.create_manifest(conn)
+        stat = os.stat(raw_file)
+        conn.execute(
+            f"INSERT OR REPLACE INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                os.path.realpath(raw_file),
+                table_for_file(raw_file),
+                stat.st_size,
+                stat.st_mtime,
+                file_sha256(raw_file),
+                time.strftime("%Y-%m-%dT%H:%M:%S"),
+            )
+        )
+
+    # Create the tables with declared types and primary keys
+    def create_tables(self, conn):
+        for table, columns in TABLE_SCHEMAS.items():
+            column_sql = ",\n    ".join(f"{name} {decl}" for name, decl in columns)
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"CREATE TABLE {table} (\n    {column_sql}\n)")
+        for table, spec in SIDE_TABLES.items():
+            column_sql = ",\n    ".join(f"{name} {decl}" for name, decl in spec["columns"])
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"CREATE TABLE {table} (\n    {column_sql},\n    PRIMARY KEY ({spec['primary_key']})\n)")
+        column_sql = ",\n    ".join(f"{name} {decl}" for name, decl in MERCHANT_DIRECTORY_COLUMNS)
+        conn.execute(f"DROP TABLE IF EXISTS {DIRECTORY_TABLE}")
+        conn.execute(f"CREATE TABLE {DIRECTORY_TABLE} (\n    {column_sql}\n)")
+        column_sql = ",\n    ".join(f"{name} {decl}" for name, decl in MERCHANT_TRIGRAM_COLUMNS)
+        conn.execute(f"DROP TABLE IF EXISTS {TRIGRAM_TABLE}")
+        conn.execute(f"CREATE TABLE {TRIGRAM_TABLE} (\n    {column_sql},\n    PRIMARY KEY (trigram, store_id)\n) WITHOUT ROWID")
+        column_sql = ",\n    ".join(f"{name} {decl}" for name, decl, _ in ROLLUP_COLUMNS)
+        conn.execute(f"DROP TABLE IF EXISTS {ROLLUP_TABLE}")
+        conn.execute(
+            f"CREATE TABLE {ROLLUP_TABLE} (\n    {column_sql},\n    PRIMARY KEY ({', '.join(ROLLUP_KEY)})\n)"
+        )
+
+    # Rebuild the side tables from the current contents of the loaded tables
+    def refresh_side_tables(self, conn):
+        for table, spec in SIDE_TABLES.items():
+            columns = ", ".join(name for name, _ in spec["columns"])
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"INSERT OR REPLACE INTO {table} ({columns}) {spec['populate']}")
+        conn.commit()
+
+    # Rebuild the merchant directory and its trigram index from the stores table. Names are cleaned in
+    # Python (trailing spaces, case, punctuation), so "LITTLE SWEET INC. " is found as "Little Sweet Inc"
+    def refresh_merchant_directory(self, conn):
+        directory, trigrams = [], []
+        for store_id, name in conn.execute("SELECT store_id, name FROM stores WHERE name IS NOT NULL"):
+            normalized = normalize_name(name)
+            if not normalized:
+                continue
+            grams = name_trigrams(normalized)
+            directory.append((store_id, display_name(name), normalized, len(grams)))
+            trigrams.extend((gram, store_id) for gram in grams)
+        conn.execute(f"DELETE FROM {DIRECTORY_TABLE}")
+        conn.execute(f"DELETE FROM {TRIGRAM_TABLE}")
+        conn.executemany(f"INSERT INTO {DIRECTORY_TABLE} VALUES (?, ?, ?, ?)", directory)
+        conn.executemany(f"INSERT INTO {TRIGRAM_TABLE} VALUES (?, ?)", trigrams)
+        conn.commit()
+
+    # Post-load stage: indexes, planner statistics, WAL and the generation stamp read by query caches
+    def tune_database(self, conn, generation: int):
+        for index_name, target in TABLE_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {target}")
+        conn.execute("ANALYZE")
+        conn.execute(f"PRAGMA user_version = {int(generation)}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.commit()
+
+    # Atomically move a finished build over the live database. The old file's WAL and shared-memory
+    # index belong to the replaced file and are removed; connections still open on it keep reading
+    # the old data until their pool recycles them. WAL mode is switched back on for the new file.
+    def replace_database(self, build_path: str, db_path: str):
+        os.replace(build_path, db_path)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+        finally:
+            conn.close()
+
+    # Generation stamp of an existing database (0 when it does not exist yet)
+    def read_generation(self, db_path: str) -> int:
+        if not os.path.exists(db_path):
+            return 0
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            conn.close()
 
 
 # Run preprocessing when script is executed directly
 if __name__ == "__main__":
-    processor = DataPreprocessor()
-    processor.preprocess_files()
-    processor.clean_and_save_all()
+    parser = argparse.ArgumentParser(description="Build Processed/dashboard_chatbot.db from the raw CSVs")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="only load new or changed raw files into the existing database"
+    )
+    parser.add_argument(
+        "--parquet", action="store_true",
+        help="also write the tables as Parquet to Processed/parquet for QUERY_BACKEND=duckdb"
+    )
+    args = parser.parse_args()
+
+    processor = DataPreprocessor(parquet_folder=os.path.join("Processed", "parquet") if args.parquet else None)
+    if args.incremental:
+        processor.ingest_incremental()
+    else:
+        processor.preprocess_files()
+        processor.clean_and_save_all()
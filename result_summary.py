@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import TYPE_CHECKING
+
+# pandas is only imported by the functions that receive a DataFrame, i.e. once a query has run
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Prompt budget for the result table sent to summarize_result; larger results are compacted
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "1500"))
+
+# Rows kept from each end of a compacted result
+EDGE_ROWS = 5
+
+
+# Rough token estimate for Llama-style tokenizers (about four characters per token)
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+# Numeric view of the result: numeric columns as-is, text columns that fully parse as numbers converted
+def _numeric_columns(df: pd.DataFrame) -> pd.DataFrame:
+    import pandas as pd
+    numeric = {}
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if not pd.api.types.is_numeric_dtype(series):
+            converted = pd.to_numeric(series, errors="coerce")
+            if converted.notna().sum() == 0 or converted.notna().sum() != series.notna().sum():
+                continue
+            series = converted
+        numeric[column] = series
+    return pd.DataFrame(numeric, index=df.index)
+
+
+# Per-column aggregates computed column-wise: min/max/sum for numbers, distinct counts for everything
+def column_aggregates(df: pd.DataFrame) -> pd.DataFrame:
+    import pandas as pd
+    aggregates = pd.DataFrame(index=df.columns)
+    aggregates["distinct"] = df.nunique(dropna=True)
+    aggregates["nulls"] = df.isna().sum()
+    numeric = _numeric_columns(df)
+    if not numeric.empty:
+        stats = numeric.agg(["min", "max", "sum"]).T
+        aggregates = aggregates.join(stats)
+    aggregates.index.name = "column"
+    return aggregates
+
+
+# Serializes a result for the summary prompt. Within the token budget the full CSV is sent;
+# beyond it, the head/tail rows, per-column aggregates and the total row count are sent instead.
+def compact_result_table(df: pd.DataFrame, budget_tokens: int = None) -> str:
+    budget_tokens = SUMMARY_TOKEN_BUDGET if budget_tokens is None else budget_tokens
+    full_text = f"Result Table:\n{df.to_csv(index=False)}"
+    if estimate_tokens(full_text) <= budget_tokens:
+        return full_text
+
+    aggregates_text = column_aggregates(df).to_csv(float_format="%.2f")
+    edge_rows = EDGE_ROWS
+    while True:
+        head = df.head(edge_rows).to_csv(index=False)
+        tail = df.tail(edge_rows).to_csv(index=False, header=False)
+        text = (
+            f"Result Table (compacted: {len(df)} rows in total; only the first and last {edge_rows} rows are shown, "
+            "use the column aggregates for totals and ranges):\n"
+            f"{head}...\n{tail}\n"
+            f"Column aggregates over all {len(df)} rows:\n{aggregates_text}"
+        )
+        if estimate_tokens(text) <= budget_tokens or edge_rows <= 1:
+            return text
+        edge_rows //= 2
+
+
+# Rule-based answers for trivial results (errors, empty results, single values) that need no LLM call.
+# Set SUMMARY_FAST_PATH=false to always use the LLM summary.
+SUMMARY_FAST_PATH = os.getenv("SUMMARY_FAST_PATH", "true").lower() == "true"
+
+# Canned replies, worded exactly as the summary prompt instructs the LLM to answer
+NO_ANSWER_REPLY = "I’m sorry, I couldn’t retrieve an answer—please rephrase or check the data."
+ZERO_REPLY = "It seems there are zero matching records—please verify your question."
+
+# Questions asking for advice or insight still go to the LLM
+_INSIGHT_RE = re.compile(r"\b(insight|marketing|promot\w*|campaign|idea|suggest\w*|recommend\w*|advice|why|improve)\b", re.I)
+# Quoted text, parentheses and the SELECT/FROM keywords, to find the outermost SELECT list of a query
+_SELECT_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"[^\"]*\"|\(|\)|\b(?:select|from)\b", re.I)
+_ALIAS_RE = re.compile(r"\s+as\s+(?:\w+|\"[^\"]*\")$", re.I)
+_COUNT_RE = re.compile(r"count\(\s*(?:distinct\s+)?[\w.*]+\s*\)")
+_ROUND_RE = re.compile(r"round\((.*?)(?:,\s*\d+)?\)", re.S)
+# A money expression: a column, optionally aggregated and optionally divided by 100 (inside or outside)
+_MONEY_EXPR_RE = re.compile(
+    r"(?:(sum|avg|min|max|total)\(\s*)?(?:\w+\.)?(\w+)(\s*/\s*100(?:\.0*)?)?(?(1)\s*\))(\s*/\s*100(?:\.0*)?)?"
+)
+# Fee columns holding cents only when the fee type is 'amount' (a percent otherwise)
+_FEE_VALUE_COLUMNS = ("platform_fee_value", "fee")
+_AMOUNT_FEE_RE = re.compile(r"fee_type\s*=\s*'amount'", re.I)
+# Rates and percentages: a factor of 100, or a percentage fee
+_RATE_RE = re.compile(r"\*\s*100(?:\.0*)?\b|\b100(?:\.0*)?\s*\*|percent|fee_type\s*=\s*'percentage'", re.I)
+
+
+# Cents columns documented in the schema prompt, e.g. total_amount_in_cents
+def cents_columns(schema_text: str) -> set:
+    return set(re.findall(r"(\w+_in_cents) \(INTEGER", schema_text))
+
+
+# Human label for a result column: total_revenue_in_cents -> "total revenue", SUM(o.tip_amount_in_cents) -> "sum of tip amount"
+def _label(column: str) -> str:
+    column = str(column).strip()
+    call = re.fullmatch(r"(\w+)\((.*)\)", column)
+    if call:
+        inner = call.group(2).strip()
+        if inner in ("", "*", "1"):
+            return call.group(1).lower()
+        return f"{call.group(1).lower()} of {_label(inner.split('.')[-1])}"
+    label = re.sub(r"_?in_(cents|dollars)$", "", column).replace("_", " ").strip()
+    return label or "result"
+
+
+# Selected expressions of the outermost SELECT, i.e. the main query after any WITH clauses; SELECTs in
+# CTEs and subqueries are inside parentheses. None when the SQL has no SELECT.
+def _outer_select_list(sql_query: str):
+    depth, start = 0, None
+    for match in _SELECT_TOKEN_RE.finditer(sql_query or ""):
+        token = match.group(0).lower()
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0 and token == "select" and start is None:
+            start = match.end()
+        elif depth == 0 and token == "from" and start is not None:
+            return sql_query[start:match.start()]
+    if start is None:
+        return None
+    return sql_query[start:].rstrip().rstrip(";")
+
+
+# Whether the SQL involves amounts whose unit depends on how they are selected: cents columns,
+# fee values (cents or a percent, depending on the fee type) or rates
+def _has_unit_sensitive_values(text: str, cents: set) -> bool:
+    text = text.lower()
+    return (
+        "_in_cents" in text
+        or any(column in text for column in cents)
+        or any(re.search(rf"\b{column}\b", text) for column in _FEE_VALUE_COLUMNS)
+        or bool(_RATE_RE.search(text))
+    )
+
+
+# Money unit of a single selected expression: "cents", "dollars", or None when it is no money amount.
+# Only clear cases count: a cents column (optionally SUM/AVG/MIN/MAX'ed, optionally divided by 100), or
+# a fee value filtered on fee_type = 'amount'. Counts, CASE sums and percentages are not money.
+def _money_unit(expression: str, sql_query: str, cents: set):
+    match = _MONEY_EXPR_RE.fullmatch(expression)
+    if not match:
+        return None
+    column = match.group(2)
+    is_cents = column in cents or column.endswith("_in_cents")
+    if not is_cents and not (column in _FEE_VALUE_COLUMNS and _AMOUNT_FEE_RE.search(sql_query or "")):
+        return None
+    return "dollars" if match.group(3) or match.group(4) else "cents"
+
+
+# Formats a single value using units inferred from the SQL expression that produced it and the schema.
+# Returns None when the SQL involves cents, fee values or rates and the outer SELECT does not show the
+# value's unit (e.g. a CTE or derived table column), so that the LLM summarizes it instead of a guess
+# being printed.
+def format_scalar(column: str, value, sql_query: str = "", cents: set = frozenset()):
+    import pandas as pd
+    number = pd.to_numeric(pd.Series([value]), errors="coerce").iloc[0]
+    if pd.isna(number):
+        return str(value).strip()
+    # The selected expression, or the column name when the SQL does not show it (unaliased results
+    # are named after their expression)
+    select = _outer_select_list(sql_query)
+    expression = select if select is not None else str(column)
+    expression = " ".join(_ALIAS_RE.sub("", expression.strip()).lower().split())
+    expression = re.sub(r"^distinct\s+", "", expression)
+    rounded = _ROUND_RE.fullmatch(expression)
+    if rounded:
+        expression = rounded.group(1).strip()
+    unit = _money_unit(expression, sql_query, cents)
+    if unit == "cents":
+        return f"${number / 100:,.2f}"
+    if unit == "dollars":
+        return f"${number:,.2f}"
+    if not _COUNT_RE.fullmatch(expression) and _has_unit_sensitive_values(f"{sql_query} {expression}", cents):
+        return None
+    if float(number).is_integer():
+        return f"{int(number):,}"
+    return f"{number:,.2f}"
+
+
+# Returns a deterministic answer for trivial results, or None when the LLM should summarize
+def fast_path_summary(question: str, sql_query: str, df: pd.DataFrame = None, error_msg: str = None,
+                      cents: set = frozenset()):
+    if not SUMMARY_FAST_PATH or _INSIGHT_RE.search(question or ""):
+        return None
+    if error_msg or df is None or df.empty:
+        return NO_ANSWER_REPLY
+    if df.shape != (1, 1):
+        return None
+    import pandas as pd
+    value = df.iat[0, 0]
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return NO_ANSWER_REPLY
+    if str(value).strip() in ("0", "0.0"):
+        return ZERO_REPLY
+    column = df.columns[0]
+    formatted = format_scalar(column, value, sql_query, cents)
+    if formatted is None:
+        return None
+    label = _label(column)
+    return f"{label[0].upper()}{label[1:]}: {formatted}."
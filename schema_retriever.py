@@ -0,0 +1,258 @@
+import math
+import re
+from collections import OrderedDict
+
+from semantic_cache import extract_literals, is_follow_up, normalize_terms
+from result_summary import estimate_tokens
+
+_TABLE_START_RE = re.compile(r"^(\w+)\($")
+_COLUMN_RE = re.compile(r"^\s+(\w+) \((.*)\),?$")
+_SQL_TABLE_RE = re.compile(r"\b(?:from|join)\s+(\w+)", re.I)
+_FOREIGN_KEY_RE = re.compile(r"foreign key → (\w+)\.")
+
+# Column types and filler words that say nothing about the question
+_TYPE_WORDS = {"uuid", "string", "integer", "real", "boolean", "json", "enum", "datetime", "date", "text"}
+_NOISE_WORDS = {"per", "by", "or", "and", "not", "null", "non", "as", "e", "g", "like", "if", "id", "1", "0"}
+# Entities the tables are named after. Most descriptions mention them ("total order value"), so they
+# select a table by name but never a column.
+_ENTITY_TERMS = {"order", "customer", "store"}
+# "how many" becomes "count": it only points at a count column of the entity being counted
+_WEAK_TERMS = {"count", "number"}
+# Words describing an entity by how often it appears in another table ("repeat customers" are customers
+# with several orders)
+_FREQUENCY_TERMS = {"repeat", "returning", "frequent", "loyal", "regular", "often"}
+# Columns scoring below this share of their table's best match are dropped, and so are tables
+# scoring below this share of the best table
+_KEEP_RATIO = 0.6
+
+# Question words that point at schema concepts the column descriptions spell differently
+_SCHEMA_SYNONYMS = {
+    "day": "date", "daily": "date", "week": "date", "weekly": "date", "month": "date", "monthly": "date",
+    "year": "date", "yearly": "date", "today": "date", "yesterday": "date", "trend": "date", "when": "date",
+    "last": "date", "recent": "date", "ordered": "order", "bought": "order",
+    "<date>": "date", "<month>": "date", "<name>": "name", "spend": "amount", "spent": "amount",
+    "paid": "amount", "value": "amount", "gmv": "revenue", "aov": "amount", "courier": "provider",
+    "doordash": "provider", "uber": "provider", "address": "address", "deliveries": "delivery",
+    "fraud": "risk", "risky": "risk", "giftcard": "gift_card", "schedule": "scheduled",
+}
+
+
+# Terms of free text (question or description): words split on underscores and canonicalized like
+# the paraphrase cache, then mapped onto the schema's vocabulary
+def _terms(text: str) -> set:
+    words = normalize_terms(text.replace("_", " ").lower())
+    return {_SCHEMA_SYNONYMS.get(word, word) for word in words} - _NOISE_WORDS
+
+
+# Local, question-aware pruning of the schema description and the few-shot SQL examples.
+# Tables are picked when the question names them or one of their non-key columns; within a table the
+# join keys, the matching columns and (for date questions) the date columns are kept, and a table
+# matched only by its name is kept whole; an entity asked about by date or frequency brings along the
+# table that references it with the dates. Questions naming a store (resolved by the merchant directory)
+# keep the stores join key and name. Follow-up questions and questions matching nothing get the full
+# schema, so pruning never hides context the model would otherwise have seen.
+class SchemaRetriever:
+    def __init__(self, schema_text: str, examples: list = None, max_examples: int = 2):
+        self.schema_text = schema_text
+        self.max_examples = max_examples
+        self.preamble, self.tables, self.notes = self._parse(schema_text)
+        self.full_tokens = estimate_tokens(schema_text)
+
+        # Inverse document frequency of each term over all column descriptions
+        documents = [column["terms"] for table in self.tables.values() for column in table["columns"]]
+        counts = {}
+        for terms in documents:
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+        self.idf = {term: math.log((1 + len(documents)) / (1 + count)) + 1 for term, count in counts.items()}
+
+        # Few-shot examples as (user message, assistant message, tables used, question terms)
+        self.examples = []
+        for question, answer in examples or []:
+            tables = {name.lower() for name in _SQL_TABLE_RE.findall(answer["content"])}
+            self.examples.append((question, answer, tables, _terms(extract_literals(question["content"])[0])))
+
+    # Splits the description into the text before the tables, the table blocks and the notes after them
+    @staticmethod
+    def _parse(schema_text: str):
+        preamble, tables, notes = [], OrderedDict(), []
+        current = None
+        seen_tables = False
+        for line in schema_text.splitlines():
+            start = _TABLE_START_RE.match(line)
+            if start:
+                current = {"name": start.group(1).lower(), "header": line, "columns": []}
+                tables[current["name"]] = current
+                seen_tables = True
+            elif current is not None and line.strip() == ")":
+                current = None
+            elif current is not None:
+                match = _COLUMN_RE.match(line)
+                if match:
+                    name, description = match.group(1), match.group(2)
+                    kind = description.split(",")[0].split(":")[0].strip()
+                    terms = _terms(name + " " + description) - _TYPE_WORDS
+                    # Day/week/month questions are about when orders were created
+                    if kind == "DATE" or name.startswith("created"):
+                        terms.add("date")
+                    references = _FOREIGN_KEY_RE.search(description)
+                    current["columns"].append({
+                        "name": name,
+                        "kind": kind,
+                        "name_terms": _terms(name),
+                        "line": line.rstrip(","),
+                        "key": "primary key" in description or "foreign key" in description,
+                        "references": references.group(1).lower() if references else None,
+                        "terms": terms,
+                    })
+            elif seen_tables:
+                notes.append(line)
+            else:
+                preamble.append(line)
+        # Notes are kept per paragraph and belong to the first table they mention (if any)
+        paragraphs = [p for p in re.split(r"\n(?=[A-Z\w])", "\n".join(notes)) if p.strip()]
+        owned = []
+        for paragraph in paragraphs:
+            owner = next((name for name in tables if re.search(rf"\b{name}\b", paragraph)), None)
+            owned.append((paragraph, owner))
+        return "\n".join(preamble), tables, owned
+
+    # Tables and columns to keep for a question, or None when the full schema should be sent
+    def select(self, question: str, stores: list = None):
+        template, _ = extract_literals(question)
+        if is_follow_up(question):
+            return None
+        terms = _terms(template)
+        scores = {}
+        for name, table in self.tables.items():
+            scores[name] = {c["name"]: self._score(c, terms) for c in table["columns"] if not c["key"]}
+        best = max((score for table in scores.values() for score in table.values()), default=0.0)
+        by_name, by_column = [], OrderedDict()
+        for name, table in self.tables.items():
+            table_best = max(scores[name].values(), default=0.0)
+            if best > 0 and table_best >= _KEEP_RATIO * best:
+                by_column[name] = self._cover(table, scores[name], terms, table_best)
+            elif _terms(name) <= terms:
+                by_name.append(name)
+        if not by_column and not by_name:
+            return None
+
+        selected = OrderedDict()
+        for name, table in self.tables.items():
+            if name in by_column:
+                keep = by_column[name] | {c["name"] for c in table["columns"] if c["key"]}
+                if "store" in terms and name == "stores":
+                    keep.add("name")
+                if "date" in terms:
+                    keep.update(c["name"] for c in table["columns"] if "date" in c["terms"])
+                keep |= self._referenced(table, keep)
+            elif name in by_name and not by_column:
+                # Only named ("how many customers"): the whole table
+                keep = {c["name"] for c in table["columns"]}
+            elif name in by_name or (name == "stores" and ("name" in terms or stores)):
+                # Named next to tables matched on columns: just what a join or a filter by name (or
+                # by date, for a date question) needs
+                keep = {c["name"] for c in table["columns"] if c["key"] or c["name"] == "name"}
+                if "date" in terms and name in by_name:
+                    keep.update(c["name"] for c in table["columns"] if "date" in c["terms"])
+            else:
+                continue
+            selected[name] = [c["name"] for c in table["columns"] if c["name"] in keep]
+        if "date" in terms or terms & _FREQUENCY_TERMS:
+            selected = self._add_dated_partners(selected)
+        return selected
+
+    # For a date or frequency question about an entity without dates of its own ("repeat customers in
+    # April 2025"), the tables referencing it that hold the dates (orders for customers), with their
+    # keys and date columns
+    def _add_dated_partners(self, selected: OrderedDict) -> OrderedDict:
+        partners = {}
+        for name in selected:
+            if any("date" in c["terms"] for c in self.tables[name]["columns"]):
+                continue
+            for partner, table in self.tables.items():
+                dated = [c["name"] for c in table["columns"] if "date" in c["terms"]]
+                if partner not in selected and dated and any(c["references"] == name for c in table["columns"]):
+                    partners[partner] = set(dated) | {c["name"] for c in table["columns"] if c["key"]}
+        if not partners:
+            return selected
+        widened = OrderedDict()
+        for name, table in self.tables.items():
+            if name in selected:
+                widened[name] = selected[name]
+            elif name in partners:
+                widened[name] = [c["name"] for c in table["columns"] if c["name"] in partners[name]]
+        return widened
+
+    # Columns close to the table's best match, plus any column covering a question term none of the
+    # higher-scoring columns covers ("pickup" next to "fee" keeps fulfillment_type)
+    def _cover(self, table: dict, scores: dict, terms: set, table_best: float) -> set:
+        keep, covered = set(), set()
+        for column in sorted(table["columns"], key=lambda c: -scores.get(c["name"], 0.0)):
+            score = scores.get(column["name"], 0.0)
+            if score <= 0:
+                break
+            new_terms = (column["terms"] & terms) - covered - _ENTITY_TERMS - {"date"}
+            if score >= _KEEP_RATIO * table_best or new_terms:
+                keep.add(column["name"])
+                covered |= column["terms"] & terms
+        return keep
+
+    # Non-JSON columns of the table that the descriptions of the kept columns refer to
+    # ("cents when fee_type = 'amount'" needs fee_type to be read correctly)
+    @staticmethod
+    def _referenced(table: dict, keep: set) -> set:
+        lines = " ".join(c["line"].split("(", 1)[-1] for c in table["columns"] if c["name"] in keep)
+        return {
+            c["name"] for c in table["columns"]
+            if c["kind"] != "JSON" and re.search(rf"\b{c['name']}\b", lines)
+        }
+
+    # IDF-weighted overlap of a column with the question terms (entities and dates only pick tables)
+    def _score(self, column: dict, terms: set) -> float:
+        matched = column["terms"] & (terms - _ENTITY_TERMS - _WEAK_TERMS - {"date"})
+        if terms & _WEAK_TERMS and column["name_terms"] & terms & _ENTITY_TERMS:
+            matched |= column["terms"] & terms & _WEAK_TERMS
+        return sum(self.idf.get(term, 1.0) for term in matched)
+
+    # Schema text restricted to the selection, in the original order and wording
+    def render(self, selected: dict) -> str:
+        parts = [self.preamble.rstrip("\n"), ""]
+        for name, table in self.tables.items():
+            if name not in selected:
+                continue
+            lines = [c["line"] for c in table["columns"] if c["name"] in selected[name]]
+            parts.append(table["header"])
+            parts.append(",\n".join(lines))
+            parts.append(")")
+        for paragraph, owner in self.notes:
+            if owner is None or owner in selected:
+                parts.append(paragraph)
+        return "\n".join(parts) + "\n"
+
+    # Few-shot pairs whose SQL only uses selected tables, best question overlap first; at least one pair
+    # is always kept so the model still sees the expected output format
+    def select_examples(self, question: str, selected: dict) -> list:
+        terms = _terms(extract_literals(question)[0])
+
+        def score(example):
+            _, _, tables, example_terms = example
+            overlap = sum(self.idf.get(term, 1.0) for term in terms & example_terms)
+            return (tables <= set(selected), overlap)
+
+        ranked = sorted(self.examples, key=score, reverse=True)
+        chosen = [example for example in ranked if example[2] <= set(selected)][: self.max_examples] or ranked[:1]
+        # Keep the original order of the examples
+        chosen_ids = {id(example) for example in chosen}
+        messages = []
+        for example in self.examples:
+            if id(example) in chosen_ids:
+                messages.extend([example[0], example[1]])
+        return messages
+
+    # (schema text, few-shot messages) for a question; the full schema and all examples when unpruned
+    def prune(self, question: str, stores: list = None):
+        selected = self.select(question, stores)
+        if selected is None:
+            return self.schema_text, [message for example in self.examples for message in example[:2]]
+        return self.render(selected), self.select_examples(question, selected)
@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import calendar
+import re
+import threading
+import zlib
+from typing import TYPE_CHECKING
+
+# NumPy is imported by the paraphrase index on first use; the literal and term helpers do not need it
+if TYPE_CHECKING:
+    import numpy as np
+
+MONTHS = {name.lower(): index for index, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): index for index, name in enumerate(calendar.month_abbr) if name})
+
+# Literals we know how to lift out of a question and substitute back into its SQL
+_ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_MONTH_RE = re.compile(
+    r"\b(" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\.?(?:\s+(\d{4}))?\b(?!\s+\d{1,2}\b)",
+    re.I,
+)
+_QUOTED_RE = re.compile(r"'([^']+)'|\"([^\"]+)\"|‘([^’]+)’|“([^”]+)”")
+_SQL_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SQL_DATE_RE = re.compile(r"(\d{4})-(\d{2})(?:-(\d{2}))?(%?)")
+
+# Questions leaning on earlier turns cannot be answered from a context-free cache
+_FOLLOW_UP_RE = re.compile(
+    r"^\s*(and|also|now|what about|how about)\b|\b(same|previous|above|earlier|those|these|them)\b", re.I
+)
+
+_TOKEN_RE = re.compile(r"<\w+>|[a-z0-9_]+")
+
+# Words that carry no query intent once literals are lifted out
+_STOPWORDS = {
+    "a", "an", "the", "i", "my", "me", "we", "our", "us", "you", "your", "did", "do", "does", "get", "got",
+    "have", "had", "has", "in", "on", "of", "for", "during", "is", "are", "was", "were", "be", "there",
+    "what", "which", "show", "give", "tell", "list", "please", "can", "could", "would", "total", "all",
+    "to", "at", "it", "its", "that", "with", "from", "many", "much",
+}
+
+# Phrases and words folded onto one canonical token so paraphrases share features
+_PHRASES = [(re.compile(r"\bhow many\b"), "count"), (re.compile(r"\bnumber of\b"), "count")]
+_SYNONYMS = {
+    "number": "count", "sales": "revenue", "earnings": "revenue", "income": "revenue", "made": "revenue",
+    "purchase": "order", "client": "customer", "merchant": "store", "shop": "store", "restaurant": "store",
+    "gratuity": "tip", "avg": "average", "mean": "average",
+}
+
+
+# Splits a question into a literal-free template and the ordered literals that were removed. stores are
+# the store mentions resolved by MerchantDirectory.resolve_mentions, lifted out as (name, store ids).
+def extract_literals(question: str, stores: list = None):
+    literals = []
+    for start, end, name, store_ids in sorted(stores or [], reverse=True):
+        literals.append((start, "store", (name, tuple(store_ids))))
+        question = f"{question[:start]} <store> {question[end:]}"
+
+    def take(kind, make):
+        def replace(match):
+            # "may" is only a month when a year follows ("May 2025"), not in "may I see..."
+            if kind == "month" and match.group(1).lower() == "may" and not match.group(2):
+                return match.group(0)
+            literals.append((match.start(), kind, make(match)))
+            return f" <{kind}> "
+        return replace
+
+    # Quoted names first so dates inside names are not touched
+    template = _QUOTED_RE.sub(take("name", lambda m: next(g for g in m.groups() if g)), question)
+    template = _ISO_DATE_RE.sub(take("date", lambda m: m.group(0)), template)
+    template = _MONTH_RE.sub(
+        take("month", lambda m: (int(m.group(2)) if m.group(2) else None, MONTHS[m.group(1).lower()])),
+        template,
+    )
+    literals.sort(key=lambda item: item[0])
+    return template.lower(), [(kind, value) for _, kind, value in literals]
+
+
+# Questions leaning on earlier turns ("and last month?") need the conversation, not just their own words
+def is_follow_up(question: str) -> bool:
+    return bool(_FOLLOW_UP_RE.search(extract_literals(question)[0]))
+
+
+# Canonical terms of a template: paraphrase phrases folded, stopwords dropped, plurals stripped
+def normalize_terms(template: str):
+    for pattern, replacement in _PHRASES:
+        template = pattern.sub(replacement, template)
+    terms = []
+    for word in _TOKEN_RE.findall(template):
+        if word in _STOPWORDS:
+            continue
+        if not word.startswith("<") and len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(_SYNONYMS.get(word, word))
+    return terms
+
+
+# Numbers left in the template (e.g. "top 5") must match exactly for a cached SQL to be reusable
+def _residual_numbers(template: str):
+    return tuple(re.findall(r"\d+(?:\.\d+)?", template))
+
+
+# Rewrites the content of one SQL string literal if it renders the old literal; None when unrelated
+def _rewrite_literal(content: str, kind: str, old, new):
+    if kind == "name":
+        return new.replace("'", "''") if content.replace("''", "'").lower() == old.lower() else None
+    if kind == "date":
+        return new if content == old else None
+    if kind == "store":
+        (old_name, old_ids), (new_name, new_ids) = old, new
+        unescaped = content.replace("''", "'")
+        if unescaped in old_ids:
+            return new_ids[old_ids.index(unescaped)].replace("'", "''")
+        return new_name.replace("'", "''") if unescaped.strip().lower() == old_name.lower() else None
+
+    match = _SQL_DATE_RE.fullmatch(content)
+    if not match:
+        return None
+    old_year, old_month = old
+    new_year, new_month = new
+    year, month, day, wildcard = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+    if month != old_month or (old_year is not None and year != old_year):
+        return None
+    target_year = new_year if new_year is not None else year
+    if day is None:
+        return f"{target_year:04d}-{new_month:02d}{wildcard}"
+    # Keep month boundaries on boundaries (e.g. 03-31 becomes 04-30)
+    last_old = calendar.monthrange(year, month)[1]
+    last_new = calendar.monthrange(target_year, new_month)[1]
+    target_day = last_new if int(day) == last_old else min(int(day), last_new)
+    return f"{target_year:04d}-{new_month:02d}-{target_day:02d}{wildcard}"
+
+
+# Re-parameterizes cached SQL with the literals of a new question, or None if a literal cannot be placed.
+# Every SQL string literal is rewritten in a single pass, so swapped literals cannot clobber each other.
+def reparameterize(sql: str, old_literals: list, new_literals: list):
+    if [kind for kind, _ in old_literals] != [kind for kind, _ in new_literals]:
+        return None
+    pairs = [(kind, old, new) for (kind, old), (_, new) in zip(old_literals, new_literals)]
+    # A store resolved to several ids (shared name) only maps onto a store with as many
+    if any(kind == "store" and len(old[1]) != len(new[1]) for kind, old, new in pairs):
+        return None
+    placed = [old == new for _, old, new in pairs]
+
+    def rewrite(match):
+        content = match.group(0)[1:-1]
+        for position, (kind, old, new) in enumerate(pairs):
+            replacement = _rewrite_literal(content, kind, old, new)
+            if replacement is not None:
+                placed[position] = True
+                return f"'{replacement}'"
+        return match.group(0)
+
+    sql = _SQL_STRING_RE.sub(rewrite, sql)
+    return sql if all(placed) else None
+
+
+# Local TF-IDF + cosine similarity cache of validated SQL, one NumPy index per context string
+class SemanticQuestionCache:
+    def __init__(self, threshold: float = 0.85, dim: int = 4096, max_entries: int = 500):
+        self.threshold = threshold
+        self.dim = dim
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    # Hashed term counts over the normalized, stopword-free words of the template
+    def _term_vector(self, template: str) -> np.ndarray:
+        import numpy as np
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for term in normalize_terms(template):
+            vector[zlib.crc32(term.encode("utf-8")) % self.dim] += 1.0
+        return vector
+
+    # TF-IDF weighting with sublinear term frequency, L2-normalized row-wise
+    def _weigh(self, counts: np.ndarray, doc_freq: np.ndarray, n_docs: int) -> np.ndarray:
+        import numpy as np
+        idf = np.log((1.0 + n_docs) / (1.0 + doc_freq)) + 1.0
+        weighted = np.where(counts > 0, 1.0 + np.log(np.maximum(counts, 1.0)), 0.0) * idf
+        norms = np.linalg.norm(weighted, axis=-1, keepdims=True)
+        return weighted / np.maximum(norms, 1e-12)
+
+    # Returns cached SQL rewritten for this question, or None when nothing close enough can be reused
+    def lookup(self, question: str, context_str: str, stores: list = None):
+        template, literals = extract_literals(question, stores)
+        if _FOLLOW_UP_RE.search(template):
+            return None
+        with self._lock:
+            index = self._indexes.get(context_str)
+            if not index or not index["entries"]:
+                self.misses += 1
+                return None
+            import numpy as np
+            counts = index["counts"][: len(index["entries"])]
+            doc_freq = (counts > 0).sum(axis=0)
+            matrix = self._weigh(counts, doc_freq, len(counts))
+            query = self._weigh(self._term_vector(template)[None, :], doc_freq, len(counts))[0]
+            scores = matrix @ query
+            for position in np.argsort(-scores):
+                if scores[position] < self.threshold:
+                    break
+                entry = index["entries"][position]
+                if entry["numbers"] != _residual_numbers(template):
+                    continue
+                sql = reparameterize(entry["sql"], entry["literals"], literals)
+                if sql is not None:
+                    self.hits += 1
+                    return sql
+            self.misses += 1
+            return None
+
+    # Records SQL that executed successfully for a (non follow-up) question
+    def add(self, question: str, sql: str, context_str: str, stores: list = None):
+        template, literals = extract_literals(question, stores)
+        if _FOLLOW_UP_RE.search(template):
+            return
+        import numpy as np
+        with self._lock:
+            index = self._indexes.setdefault(
+                context_str, {"counts": np.zeros((8, self.dim), dtype=np.float32), "entries": []}
+            )
+            entries = index["entries"]
+            for entry in entries:
+                if entry["template"] == template:
+                    entry.update(sql=sql, literals=literals)
+                    return
+            if len(entries) >= self.max_entries:
+                # Oldest entry out; shift its row away
+                entries.pop(0)
+                index["counts"][:-1] = index["counts"][1:].copy()
+            position = len(entries)
+            if position >= len(index["counts"]):
+                grown = np.zeros((max(8, 2 * len(index["counts"])), self.dim), dtype=np.float32)
+                grown[: len(index["counts"])] = index["counts"]
+                index["counts"] = grown
+            index["counts"][position] = self._term_vector(template)
+            entries.append({
+                "template": template,
+                "literals": literals,
+                "numbers": _residual_numbers(template),
+                "sql": sql,
+            })
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = sum(len(index["entries"]) for index in self._indexes.values())
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
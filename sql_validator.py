@@ -0,0 +1,305 @@
+import difflib
+import re
+
+# SQL string literals are never touched by the rewrites below
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+
+# Table references in FROM/JOIN clauses, with an optional alias
+_TABLE_REF_RE = re.compile(
+    r"\b(from|join)\s+([A-Za-z_]\w*)(?:\s+(?:as\s+)?(?!(?:on|where|join|inner|left|right|cross|group|order|limit|having|union|using)\b)([A-Za-z_]\w*))?",
+    re.I,
+)
+
+# MySQL interval units mapped onto SQLite date modifiers
+_INTERVAL_UNITS = {"day": ("days", 1), "week": ("days", 7), "month": ("months", 1), "year": ("years", 1)}
+
+# DuckDB binder/catalog errors mapped onto the SQLite messages _fix_error understands
+_DUCKDB_ERRORS = [
+    (re.compile(r'Table "(\w+)" does not have a column named "(\w+)"'), "no such column: {0}.{1}"),
+    (re.compile(r'Referenced column "(\w+)" not found'), "no such column: {0}"),
+    (re.compile(r"Table with name (\w+) does not exist"), "no such table: {0}"),
+]
+
+# Maximum number of local rewrites attempted before handing the SQL to the LLM fix loop
+MAX_LOCAL_FIXES = 5
+
+# Literals, quoted identifiers and comments, which statement_error looks past
+_STATEMENT_NOISE_RE = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?(?:\*/|$)""", re.S)
+_STATEMENT_KEYWORDS = {"select", "values", "insert", "update", "delete", "replace"}
+
+
+# Applies fn to every part of sql that is outside a string literal
+def _outside_literals(sql: str, fn) -> str:
+    parts = []
+    last = 0
+    for match in _LITERAL_RE.finditer(sql):
+        parts.append(fn(sql[last:match.start()]))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(fn(sql[last:]))
+    return "".join(parts)
+
+
+# Finds NAME( ... ) calls outside literals and returns (start, end, [args]) for the first one
+def _find_call(sql: str, name: str):
+    for match in re.finditer(rf"\b{name}\s*\(", sql, re.I):
+        if _inside_literal(sql, match.start()):
+            continue
+        depth, args, current, i = 1, [], "", match.end()
+        in_string = False
+        while i < len(sql) and depth:
+            ch = sql[i]
+            if ch == "'":
+                in_string = not in_string
+            if not in_string:
+                if ch == "(":
+                    depth += 1
+                elif ch == ")":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif ch == "," and depth == 1:
+                    args.append(current.strip())
+                    current = ""
+                    i += 1
+                    continue
+            current += ch
+            i += 1
+        if depth:
+            return None
+        if current.strip() or args:
+            args.append(current.strip())
+        return match.start(), i + 1, args
+    return None
+
+
+def _inside_literal(sql: str, position: int) -> bool:
+    return any(m.start() < position < m.end() for m in _LITERAL_RE.finditer(sql))
+
+
+# Builds the SQLite equivalent of DATE_SUB/DATE_ADD(expr, INTERVAL n unit)
+def _interval_call(args, sign: str):
+    if len(args) != 2:
+        return None
+    match = re.fullmatch(r"interval\s+'?(\d+)'?\s+(day|week|month|year)s?", args[1], re.I)
+    if not match:
+        return None
+    unit, factor = _INTERVAL_UNITS[match.group(2).lower()]
+    return f"DATE({args[0]}, '{sign}{int(match.group(1)) * factor} {unit}')"
+
+
+# Deterministic rewrites of MySQL-only functions into SQLite syntax
+_FUNCTION_REWRITES = {
+    "CURDATE": lambda args: "DATE('now')" if not args else None,
+    "CURRENT_DATE": lambda args: "DATE('now')" if not args else None,
+    "NOW": lambda args: "DATETIME('now')" if not args else None,
+    "DATE_SUB": lambda args: _interval_call(args, "-"),
+    "DATE_ADD": lambda args: _interval_call(args, "+"),
+    "DATE_FORMAT": lambda args: f"strftime({args[1]}, {args[0]})" if len(args) == 2 else None,
+    "YEAR": lambda args: f"CAST(strftime('%Y', {args[0]}) AS INTEGER)" if len(args) == 1 else None,
+    "MONTH": lambda args: f"CAST(strftime('%m', {args[0]}) AS INTEGER)" if len(args) == 1 else None,
+    "DAY": lambda args: f"CAST(strftime('%d', {args[0]}) AS INTEGER)" if len(args) == 1 else None,
+    "CONCAT": lambda args: "(" + " || ".join(args) + ")" if args else None,
+}
+
+
+# Rewrites MySQL functions until none are left (innermost calls are handled as they appear in arguments)
+def rewrite_mysql_functions(sql: str, rewrites: list) -> str:
+    for name, build in _FUNCTION_REWRITES.items():
+        for _ in range(20):
+            call = _find_call(sql, name)
+            if call is None:
+                break
+            start, end, args = call
+            args = [rewrite_mysql_functions(arg, rewrites) for arg in args]
+            replacement = build(args)
+            if replacement is None:
+                break
+            rewrites.append(f"{name}(...) -> {replacement}")
+            sql = sql[:start] + replacement + sql[end:]
+    return sql
+
+
+# Column names per table documented in the schema prompt ("    column (TYPE, ...)" lines)
+def parse_schema_description(schema_text: str) -> dict:
+    schema = {}
+    for table, body in re.findall(r"^(\w+)\(\n(.*?)^\)", schema_text, re.M | re.S):
+        schema[table.lower()] = re.findall(r"^\s+(\w+) \(", body, re.M)
+    return schema
+
+
+# Live column names per table, as seen through the (possibly scoped) connection
+def load_live_schema(conn, tables) -> dict:
+    schema = {}
+    for table in tables:
+        try:
+            rows = conn.execute(f"PRAGMA table_info({table})").fetchall()
+        except Exception:
+            # DuckDB raises for unknown tables where SQLite returns no rows
+            rows = []
+        if rows:
+            schema[table.lower()] = [row[1] for row in rows]
+    return schema
+
+
+# alias -> table for every FROM/JOIN reference (a table is also its own alias)
+def table_aliases(sql: str) -> dict:
+    aliases = {}
+    for _, table, alias in _TABLE_REF_RE.findall(_LITERAL_RE.sub("''", sql)):
+        aliases[table.lower()] = table.lower()
+        if alias:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+
+# A typo keeps the words of a snake_case name recognizable: order_kind is not a misspelled order_id
+def _same_words(name: str, candidate: str) -> bool:
+    words, candidate_words = name.split("_"), candidate.split("_")
+    if len(words) != len(candidate_words):
+        return True
+    return all(
+        a == b or difflib.SequenceMatcher(None, a, b).ratio() >= 0.75 for a, b in zip(words, candidate_words)
+    )
+
+
+# Best schema match for a misspelled name: a unique prefix match (total_amount -> total_amount_in_cents)
+# or a close edit-distance match
+def _closest(name: str, candidates):
+    prefixed = [c for c in candidates if c.lower().startswith(name.lower())]
+    if len(prefixed) == 1:
+        return prefixed[0]
+    matches = difflib.get_close_matches(name.lower(), [c.lower() for c in candidates], n=3, cutoff=0.75)
+    match = next((m for m in matches if _same_words(name.lower(), m)), None)
+    if match is None:
+        return None
+    return next(c for c in candidates if c.lower() == match)
+
+
+# Rewrites a DuckDB error in SQLite's wording when it is one we can fix locally
+def _normalize_error(error: str, dialect: str) -> str:
+    if dialect == "duckdb":
+        for pattern, template in _DUCKDB_ERRORS:
+            match = pattern.search(error)
+            if match:
+                return template.format(*match.groups())
+    return error
+
+
+# Tries one deterministic fix for a SQLite prepare error; returns the new SQL or None
+def _fix_error(sql: str, error: str, schema: dict, documented: dict, rewrites: list):
+    aliases = table_aliases(sql)
+
+    match = re.match(r"no such column: (?:(\w+)\.)?(\w+)", error)
+    if match:
+        alias, column = match.group(1), match.group(2)
+        if alias and alias.lower() in aliases:
+            table = aliases[alias.lower()]
+            candidates = documented.get(table) or schema.get(table, [])
+            fixed = _closest(column, candidates)
+            if fixed is None:
+                return None
+            rewrites.append(f"{alias}.{column} -> {alias}.{fixed}")
+            pattern = re.compile(rf"\b{re.escape(alias)}\.{re.escape(column)}\b")
+            return _outside_literals(sql, lambda part: pattern.sub(f"{alias}.{fixed}", part))
+        if alias:
+            # Alias never joined: add the stores join through store_id when the column lives on stores
+            if "stores" in aliases.values() or column.lower() not in [c.lower() for c in schema.get("stores", [])]:
+                return None
+            anchor = next(
+                (m for m in _TABLE_REF_RE.finditer(sql)
+                 if m.group(2).lower() in ("orders", "customers") and m.group(1).lower() == "from"),
+                None,
+            )
+            if anchor is None:
+                return None
+            owner = anchor.group(3) or anchor.group(2)
+            join = f" JOIN stores AS {alias} ON {owner}.store_id = {alias}.store_id"
+            rewrites.append(f"added{join}")
+            return sql[:anchor.end()] + join + sql[anchor.end():]
+        candidates = [c for table in set(aliases.values()) for c in (documented.get(table) or schema.get(table, []))]
+        fixed = _closest(column, sorted(set(candidates)))
+        if fixed is None:
+            return None
+        rewrites.append(f"{column} -> {fixed}")
+        pattern = re.compile(rf"(?<![\w.]){re.escape(column)}\b")
+        return _outside_literals(sql, lambda part: pattern.sub(fixed, part))
+
+    match = re.match(r"no such table: (?:\w+\.)?(\w+)", error)
+    if match:
+        fixed = _closest(match.group(1), list(schema))
+        if fixed is None:
+            return None
+        rewrites.append(f"{match.group(1)} -> {fixed}")
+        pattern = re.compile(rf"\b(from|join)(\s+){re.escape(match.group(1))}\b", re.I)
+        return _outside_literals(sql, lambda part: pattern.sub(rf"\g<1>\g<2>{fixed}", part))
+
+    return None
+
+
+# Error message when sql is not a single SELECT statement (optionally behind a WITH clause), else None.
+# Generated SQL is only ever a query: PRAGMA, DDL, ATTACH and data changes are refused before anything
+# is prepared or run, and so is a second statement after a ';'.
+def statement_error(sql: str):
+    text = _STATEMENT_NOISE_RE.sub(lambda m: " " if m.group(0)[0] in "-/" else "''", sql).strip()
+    text = text.rstrip("; \t\r\n")
+    if ";" in text:
+        return "Only one SQL statement can run at a time. Remove everything after the first ';'."
+    words = []
+    depth = 0
+    for token in re.findall(r"[()]|[A-Za-z_]\w*", text):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            words.append(token.lower())
+    # After a WITH clause, the statement itself starts at the first top-level statement keyword
+    first = words[0] if words else ""
+    if first == "with":
+        first = next((word for word in words if word in _STATEMENT_KEYWORDS), "")
+    if first != "select":
+        return "Only a single SELECT query can run (optionally with a WITH clause); PRAGMA, DDL and data changes are not allowed."
+    return None
+
+
+# Pre-flight check of generated SQL without executing it.
+# Deterministic problems are rewritten locally; returns (sql, error_msg or None, rewrites).
+# For dialect="duckdb" the MySQL rewrites (which target SQLite functions) are skipped and EXPLAIN is used.
+def validate_sql(sql: str, conn, schema_text: str = "", dialect: str = "sqlite"):
+    rewrites = []
+    sql = sql.strip()
+    if dialect == "sqlite":
+        sql = rewrite_mysql_functions(sql, rewrites)
+    error = statement_error(sql)
+    if error:
+        return sql, error, rewrites
+    explain = "EXPLAIN QUERY PLAN" if dialect == "sqlite" else "EXPLAIN"
+    documented = parse_schema_description(schema_text) if schema_text else {}
+    schema = load_live_schema(conn, documented or ("orders", "customers", "stores"))
+
+    for _ in range(MAX_LOCAL_FIXES + 1):
+        try:
+            conn.execute(f"{explain} {sql}")
+        except Exception as e:
+            error = str(e)
+            fixed = _fix_error(sql, _normalize_error(error, dialect), schema, documented, rewrites)
+            if fixed is None or fixed == sql:
+                return sql, error, rewrites
+            sql = fixed
+            continue
+
+        # Canonical casing for qualified columns (alias.Col -> alias.col) so equal queries share cache keys
+        aliases = table_aliases(sql)
+
+        def canonical(part):
+            def repl(m):
+                table = aliases.get(m.group(1).lower())
+                for column in schema.get(table, []):
+                    if column.lower() == m.group(2).lower():
+                        return f"{m.group(1)}.{column}"
+                return m.group(0)
+            return re.sub(r"\b(\w+)\.(\w+)\b", repl, part)
+
+        return _outside_literals(sql, canonical), None, rewrites
+
+    return sql, "Too many local SQL rewrites", rewrites
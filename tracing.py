@@ -0,0 +1,187 @@
+import contextvars
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# JSON-lines file that receives one record per answered question (disabled when empty)
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "")
+# Number of recent span durations per stage kept for the p50/p95 aggregates
+TRACE_WINDOW = int(os.getenv("TRACE_WINDOW", "1000"))
+
+# Trace of the question being answered. Set once by the caller; asyncio tasks and asyncio.to_thread
+# copy it, so every stage of the pipeline sees the same trace.
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+# Spans of one question: nl_to_sql, preflight, execute, fix_sql, summarize. Attributes recorded while a
+# span is open (tokens, rows, cache hits) land on the innermost one, otherwise on the trace itself.
+# Open spans live on the trace rather than in the context, so a span may cross async generator yields.
+class Trace:
+    def __init__(self, question: str, scope: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.question = question
+        self.scope = scope
+        self.started_at = time.time()
+        self.attrs = {}
+        self.spans = []
+        self.total_ms = None
+        self._start = time.perf_counter()
+        self._open = []
+
+    @contextmanager
+    def span(self, name: str):
+        record = {"name": name, "start_ms": round((time.perf_counter() - self._start) * 1000, 3)}
+        self.spans.append(record)
+        self._open.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            self._open.remove(record)
+
+    def _target(self) -> dict:
+        return self._open[-1] if self._open else self.attrs
+
+    def record(self, **attrs):
+        self._target().update(attrs)
+
+    # Adds numeric counters (e.g. token counts) instead of overwriting them
+    def add(self, **counts):
+        target = self._target()
+        for key, value in counts.items():
+            target[key] = target.get(key, 0) + value
+
+    def finish(self):
+        self.total_ms = round((time.perf_counter() - self._start) * 1000, 3)
+
+    # Sum of the span durations per stage, in ms
+    def stage_ms(self) -> dict:
+        totals = {}
+        for record in self.spans:
+            totals[record["name"]] = totals.get(record["name"], 0.0) + record.get("duration_ms", 0.0)
+        return totals
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "timestamp": self.started_at,
+            "scope": self.scope,
+            "question": self.question,
+            "total_ms": self.total_ms,
+            **self.attrs,
+            "spans": self.spans,
+        }
+
+
+# Collects finished traces: appends them to the JSON-lines log, keeps the most recent ones for the
+# debug panel and aggregates latency, token and cache counters per stage over a sliding window
+class Tracer:
+    def __init__(self, log_path: str = TRACE_LOG_PATH, window: int = TRACE_WINDOW, keep: int = 50):
+        self.log_path = log_path
+        self.window = window
+        self.recent = deque(maxlen=keep)
+        self._durations = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def trace(self, question: str, scope: str = ""):
+        current = Trace(question, scope)
+        token = _current_trace.set(current)
+        try:
+            yield current
+        finally:
+            _current_trace.reset(token)
+            current.finish()
+            self._collect(current)
+
+    def _collect(self, current: Trace):
+        with self._lock:
+            self.recent.append(current)
+            for record in current.spans + [{"name": "total", "duration_ms": current.total_ms, **current.attrs}]:
+                name = record["name"]
+                self._durations.setdefault(name, deque(maxlen=self.window)).append(record.get("duration_ms", 0.0))
+                counters = self._counters.setdefault(name, {})
+                for key, value in record.items():
+                    if key in ("name", "start_ms", "duration_ms") or not isinstance(value, (int, float)):
+                        continue
+                    counters[key] = counters.get(key, 0) + value
+            if self.log_path:
+                folder = os.path.dirname(self.log_path)
+                if folder:
+                    os.makedirs(folder, exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(current.to_dict(), default=str) + "\n")
+
+    # Per-stage aggregates: span count, p50/p95 latency over the window and summed counters
+    # (booleans such as result_cache_hit count the hits)
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for name, durations in self._durations.items():
+                values = sorted(durations)
+                result[name] = {
+                    "spans": len(values),
+                    "p50_ms": round(statistics.median(values), 3),
+                    "p95_ms": round(values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))], 3),
+                    **self._counters.get(name, {}),
+                }
+            return result
+
+    def export_stats(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.stats(), f, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self.recent.clear()
+            self._durations.clear()
+            self._counters.clear()
+
+
+# Process-wide tracer used by main.py, app.py and the console
+tracer = Tracer()
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+# Times a pipeline stage of the current trace; does nothing when no trace is active
+@contextmanager
+def span(name: str):
+    current = _current_trace.get()
+    if current is None:
+        yield {}
+        return
+    with current.span(name) as record:
+        yield record
+
+
+def record(**attrs):
+    current = _current_trace.get()
+    if current is not None:
+        current.record(**attrs)
+
+
+def add(**counts):
+    current = _current_trace.get()
+    if current is not None:
+        current.add(**counts)
+
+
+# Adds the token counts of a Groq `usage` object (completion or final stream chunk) to the current span
+def record_usage(usage):
+    if usage is None:
+        return
+    add(
+        llm_calls=1,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+    )